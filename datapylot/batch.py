@@ -0,0 +1,177 @@
+""" Renders many vizzes of one datasource into standalone html files
+
+    python -m datapylot.batch data.csv specs.json --output reports
+
+The specs file is a json list of vizzes, each with a name and the attributes of its VizConfig. Attributes are
+either a column name (a measure for numeric columns, a dimension otherwise) or an object with a type
+(see ATTRIBUTE_TYPES), a column and the options of that attribute type:
+
+    [{"name": "sales", "columns": ["Category", {"type": "measure", "column": "Sales", "aggregation": "mean"}],
+      "rows": ["Region"], "color": "Profit", "mark_type": "bar",
+      "filters": [{"column": "Region", "values": ["East", "West"]}, {"column": "Sales", "min_value": 10}]}]
+
+Filters are attributes like above plus the values, min_value and/or max_value of a Filter. Names are used as
+file names, so they can't contain path separators.
+
+The datasource is loaded and all vizzes are aggregated once in this process, then a pool of forked workers
+renders them, reusing the cached aggregates. A manifest.json with the timing of every viz is written next to
+the html files.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from bokeh.embed import file_html
+from bokeh.resources import CDN
+
+from datapylot.data.attributes import Attribute, BinnedDimension, DateDimension, Dimension, Measure
+from datapylot.data.cost import CostPolicy
+from datapylot.data.datasource import Datasource
+from datapylot.data.filters import Filter
+from datapylot.data.vizconfig import VizConfig
+from datapylot.data_preparation.aggregator import Aggregator
+from datapylot.logger import log
+from datapylot.plotting.bokeh_plotter import Plotter
+from datapylot.utils import MarkType
+
+ATTRIBUTE_TYPES = {
+    'dimension': Dimension,
+    'measure': Measure,
+    'date': DateDimension,
+    'binned': BinnedDimension
+}
+
+# workers are replaced after rendering this many vizzes, which frees the memory of their bokeh models
+TASKS_PER_WORKER = 10
+
+AttributeSpec = Union[str, Dict[str, Any]]
+
+# the keys of a filter spec that are options of the Filter, the other keys are the ones of its attribute
+FILTER_OPTIONS = ('values', 'min_value', 'max_value')
+
+# the datasource and policy of the worker processes, set before they are forked
+_worker_args = None  # type: Optional[Tuple[Datasource, Optional[CostPolicy], str]]
+
+
+def config_from_spec(spec: Dict[str, Any], datasource: Datasource) -> VizConfig:
+    """ Creates the VizConfig of a viz spec, raises a ValueError for unknown attribute or mark types or bad filters
+    """
+    def to_attribute(attribute: Optional[AttributeSpec]) -> Optional[Attribute]:
+        if attribute is None:
+            return None
+        if isinstance(attribute, str):
+            return Measure(attribute) if datasource.columns.get(attribute) == 'Measure' else Dimension(attribute)
+        options = dict(attribute)
+        attribute_type = options.pop('type', 'dimension')
+        if attribute_type not in ATTRIBUTE_TYPES:
+            raise ValueError(f'Unknown attribute type {attribute_type}, must be one of {list(ATTRIBUTE_TYPES)}')
+        return ATTRIBUTE_TYPES[attribute_type](options.pop('column'), **options)
+
+    def to_filter(filter_spec: Dict[str, Any]) -> Filter:
+        attribute = {key: value for key, value in filter_spec.items() if key not in FILTER_OPTIONS}
+        options = {key: value for key, value in filter_spec.items() if key in FILTER_OPTIONS}
+        # a plain column is a measure or dimension by its type, like the attributes given by name
+        return Filter(to_attribute(attribute['column'] if list(attribute) == ['column'] else attribute), **options)
+
+    mark_type = spec.get('mark_type', 'circle').upper()
+    if mark_type not in MarkType.__members__:
+        raise ValueError(f'Unknown mark type {mark_type}, must be one of {list(MarkType.__members__)}')
+    return VizConfig(
+        [to_attribute(attribute) for attribute in spec.get('columns', [])],
+        [to_attribute(attribute) for attribute in spec.get('rows', [])],
+        to_attribute(spec.get('color')),
+        to_attribute(spec.get('size')),
+        MarkType[mark_type],
+        [to_filter(filter_spec) for filter_spec in spec.get('filters', [])]
+    )
+
+
+def render_all(
+        datasource: Datasource,
+        specs: List[Dict[str, Any]],
+        output_dir: str,
+        processes: Optional[int] = None,
+        policy: Optional[CostPolicy] = None
+) -> List[Dict[str, Any]]:
+    """ Renders every spec into output_dir/<name>.html, returns one manifest entry per spec in the order of specs
+
+    Specs that can't be rendered get an entry with their error instead of failing the other ones.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # aggregating here fills the cache of the datasource, which the forked workers then share
+    for spec in specs:
+        try:
+            Aggregator(datasource, config_from_spec(spec, datasource), policy).update_data()
+        except Exception as e:
+            log('batch', f'Could not aggregate {spec.get("name")}: {e}')
+
+    global _worker_args
+    _worker_args = (datasource, policy, output_dir)
+    if processes == 1:
+        return [_render(spec) for spec in specs]
+    with Pool(processes, maxtasksperchild=TASKS_PER_WORKER) as pool:
+        return pool.map(_render, specs, chunksize=1)
+
+
+def _render(spec: Dict[str, Any]) -> Dict[str, Any]:
+    datasource, policy, output_dir = _worker_args
+    name = spec.get('name', '')
+    entry: Dict[str, Any] = {'name': name}
+    start = time.perf_counter()
+    try:
+        plotter = Plotter(datasource, config_from_spec(spec, datasource), policy)
+        plotter.create_viz()
+        html = file_html(plotter.get_output(), CDN, title=name).encode('utf-8')
+        filename = os.path.join(output_dir, f'{name}.html')
+        with open(filename, 'wb') as file:
+            file.write(html)
+        entry.update({'file': filename, 'plots': len(plotter.plots), 'bytes': len(html)})
+    except Exception as e:
+        entry['error'] = f'{type(e).__name__}: {e}'
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    return entry
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Renders the vizzes of a specs file into standalone html files')
+    parser.add_argument('datasource', help='csv file with the data of all vizzes')
+    parser.add_argument('specs', help='json file with a list of vizzes')
+    parser.add_argument('--output', default='reports', help='directory of the html files and the manifest')
+    parser.add_argument('--processes', type=int, default=None, help='amount of workers, defaults to the cpu count')
+    options = parser.parse_args(args)
+
+    start = time.perf_counter()
+    datasource = Datasource.from_csv(options.datasource)
+    with open(options.specs) as file:
+        specs = json.load(file)
+    names = [spec.get('name') for spec in specs]
+    if None in names or len(set(names)) != len(names):
+        parser.error('every spec needs a unique name')
+    separators = {'/', os.sep, os.altsep} - {None}
+    invalid = [name for name in names if not isinstance(name, str) or name in ('', '.', '..') or
+               any(sep in name for sep in separators)]
+    if invalid:
+        parser.error(f'spec names are file names and can not be paths: {invalid}')
+    load_seconds = time.perf_counter() - start
+
+    outputs = render_all(datasource, specs, options.output, options.processes)
+    manifest = {
+        'datasource': options.datasource,
+        'load_seconds': round(load_seconds, 3),
+        'total_seconds': round(time.perf_counter() - start, 3),
+        'outputs': outputs
+    }
+    with open(os.path.join(options.output, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    failed = [output['name'] for output in outputs if 'error' in output]
+    if failed:
+        log('batch', f'Could not render {failed}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
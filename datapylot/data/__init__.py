@@ -1,3 +1,7 @@
-from .attributes import Attribute, Measure, Dimension
+from .attributes import Attribute, Measure, Dimension, DerivedDimension, DateDimension, BinnedDimension
+from .cost import CostEstimate, CostLimitExceeded, CostPolicy
+from .crossfilter import CrossFilter
 from .datasource import Datasource
+from .filters import Filter
 from .vizconfig import VizConfig
+from .tiles import TilePyramid
@@ -1,3 +1,15 @@
+from typing import Optional, TYPE_CHECKING
+
+from datapylot.data.binning import assign_bins, get_bin_edges
+from datapylot.data.dateparts import AUTO_DATE_PART, DATE_PARTS, derive_date_part
+from datapylot.data.table_calculations import TABLE_CALCULATIONS
+
+# static type analysis
+if TYPE_CHECKING:
+    import pandas
+    from datapylot.data.datasource import Datasource
+
+
 class Attribute:
     def __init__(self, col_name: str) -> None:
         self.col_name = col_name
@@ -22,7 +34,106 @@ class Dimension(Attribute):
         super().__init__(col_name)
 
 
-class Measure(Attribute):
-    def __init__(self, col_name: str, *, aggregation: str = 'sum') -> None:
+class DerivedDimension(Dimension):
+    """ Base class for dimensions whose values are computed from another column, not useful to instantiate.
+
+    The datasource computes the values on first use and caches them until its data changes.
+    """
+
+    def __init__(self, col_name: str, source_col: str) -> None:
         super().__init__(col_name)
+        self.source_col = source_col
+
+    def derive(self, datasource: 'Datasource') -> 'pandas.Series':
+        """ Will raise NotImplementedError to remind you to overwrite it in subclasses
+        """
+        raise NotImplementedError('derive() is only available in subclasses of DerivedDimension')
+
+
+class DateDimension(DerivedDimension):
+    """ Dimension over a datetime column that groups by a truncated period or a date part
+
+    With truncate=True, DateDimension('Order Date', 'month') groups by calendar month (2013-01, 2013-02, ...),
+    with truncate=False it groups by the month of the year only (01, 02, ..., 12).
+    The part 'auto' lets the Aggregator pick a truncation that fits the pixel size of the plots.
+    """
+
+    def __init__(self, col_name: str, part: str = 'month', *, truncate: bool = True) -> None:
+        if part not in DATE_PARTS and not (part == AUTO_DATE_PART and truncate):
+            raise ValueError(f'Unknown date part {part}, must be one of {DATE_PARTS} or {AUTO_DATE_PART}')
+        name = f'{part.upper()}({col_name})' if truncate else f'{part.upper()}_OF({col_name})'
+        super().__init__(name, col_name)
+        self.part = part
+        self.truncate = truncate
+
+    @property
+    def is_auto(self) -> bool:
+        return self.part == AUTO_DATE_PART
+
+    def with_part(self, part: str) -> 'DateDimension':
+        """ Returns a DateDimension over the same column and with the same truncation, but another part
+        """
+        return DateDimension(self.source_col, part, truncate=self.truncate)
+
+    def derive(self, datasource: 'Datasource') -> 'pandas.Series':
+        if self.is_auto:
+            raise ValueError(f'{self} has an automatic resolution, which must be resolved by the Aggregator')
+        return derive_date_part(datasource.get_column(self.source_col), self.part, self.truncate)
+
+
+class BinnedDimension(DerivedDimension):
+    """ Dimension that buckets a numeric column, eg. to draw a histogram of a measure
+
+    Exactly one of width (fixed bin size), count (fixed amount of equal bins) or quantiles
+    (fixed amount of equally filled bins) must be given. Edges are based on the cached column statistics.
+    """
+
+    def __init__(
+            self,
+            col_name: str,
+            *,
+            width: Optional[float] = None,
+            count: Optional[int] = None,
+            quantiles: Optional[int] = None
+    ) -> None:
+        options = {'width': width, 'count': count, 'quantiles': quantiles}
+        given = [(mode, amount) for mode, amount in options.items() if amount is not None]
+        if len(given) != 1 or given[0][1] <= 0:
+            raise ValueError(f'Need exactly one positive value of width, count or quantiles, got {options}')
+        self.mode, self.amount = given[0]
+        super().__init__(f'BIN({col_name}, {self.mode}={self.amount})', col_name)
+
+    def derive(self, datasource: 'Datasource') -> 'pandas.Series':
+        edges = get_bin_edges(datasource.get_statistics(self.source_col), self.mode, self.amount)
+        return assign_bins(datasource.get_column(self.source_col), edges)
+
+
+class Measure(Attribute):
+    """ Numeric attribute that is aggregated per group of dimensions
+
+    A table_calculation ('running_total', 'percent_of_total', 'rank' or 'moving_average' over the last
+    window values) is applied on top of the aggregated values, separately for each plot.
+    """
+
+    def __init__(
+            self,
+            col_name: str,
+            *,
+            aggregation: str = 'sum',
+            table_calculation: Optional[str] = None,
+            window: int = 3
+    ) -> None:
+        if table_calculation is None:
+            name = col_name
+        elif table_calculation == 'moving_average':
+            name = f'MOVING_AVERAGE({col_name}, {window})'
+        elif table_calculation in TABLE_CALCULATIONS:
+            name = f'{table_calculation.upper()}({col_name})'
+        else:
+            raise ValueError(f'Unknown table calculation {table_calculation}, must be one of {TABLE_CALCULATIONS}')
+        super().__init__(name)
+        # the column that is aggregated, col_name differs from it for table calculations
+        self.source_col = col_name
         self.aggregation = aggregation
+        self.table_calculation = table_calculation
+        self.window = window
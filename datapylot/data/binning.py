@@ -0,0 +1,80 @@
+from typing import List, TYPE_CHECKING
+
+import numpy
+import pandas
+
+# static type analysis
+if TYPE_CHECKING:
+    from datapylot.data.statistics import ColumnStatistics
+
+BIN_MODES = ('width', 'count', 'quantiles')
+
+# every bin becomes a category and a glyph, more bins than this are an error in the options, not a histogram
+MAX_BINS = 10000
+
+
+def get_bin_edges(statistics: 'ColumnStatistics', mode: str, amount: float) -> numpy.ndarray:
+    """ Returns the sorted edges of all bins, based on the (cached) statistics of the column
+
+    width: bins of a fixed size, aligned to multiples of the width
+    count: a fixed amount of bins of equal size between min and max
+    quantiles: a fixed amount of bins that each contain about the same amount of rows
+
+    Raises a ValueError if the options would create more than MAX_BINS bins.
+    """
+    if mode not in BIN_MODES:
+        raise ValueError(f'Unknown bin mode {mode}, must be one of {BIN_MODES}')
+    if not statistics.is_numeric:
+        raise ValueError('Only numeric columns can be binned')
+    if mode != 'width' and amount > MAX_BINS:
+        raise ValueError(f'Can not create {amount} bins, the maximum is {MAX_BINS}')
+    if statistics.count == 0:
+        return numpy.array([0.0, 1.0])
+
+    _min, _max = float(statistics.min), float(statistics.max)
+    if mode == 'width':
+        start = numpy.floor(_min / amount) * amount
+        bin_amount = max(int(numpy.floor((_max - start) / amount)) + 1, 1)
+        if bin_amount > MAX_BINS:
+            raise ValueError(f'A bin width of {amount} makes {bin_amount} bins, the maximum is {MAX_BINS}')
+        return start + numpy.arange(bin_amount + 1) * amount
+    if mode == 'count':
+        if _min == _max:
+            _max = _min + 1
+        return numpy.linspace(_min, _max, int(amount) + 1)
+    # duplicated quantiles happen for columns with few distinct values and would create empty bins
+    edges = numpy.unique(statistics.quantiles(int(amount)))
+    if len(edges) < 2:
+        # all values are the same, which still makes one bin
+        return numpy.array([_min, _min + 1])
+    return edges
+
+
+def assign_bins(column: pandas.Series, edges: numpy.ndarray) -> pandas.Series:
+    """ Assigns every value to its bin in a single vectorized pass and returns a categorical series
+
+    Bins include their lower edge, the last bin also includes the upper edge. Empty bins are not part of
+    the categories, so grouping by the result only yields bins that contain data.
+    """
+    values = column.values.astype('float64')
+    codes = numpy.searchsorted(edges, values, side='right') - 1
+    # values equal to the last edge belong to the last bin
+    codes = numpy.clip(codes, 0, len(edges) - 2)
+    codes[numpy.isnan(values)] = -1
+
+    categorical = pandas.Categorical.from_codes(codes, get_bin_labels(edges), ordered=True)
+    return pandas.Series(categorical.remove_unused_categories(), index=column.index)
+
+
+def get_bin_labels(edges: numpy.ndarray) -> List[str]:
+    """ Creates labels such as '[0, 500)' for all bins, the last bin is closed on both sides
+
+    Edges are shown with 6 significant digits, or with as many more as it takes to tell close edges apart.
+    """
+    precision = 6
+    # 17 significant digits are enough to tell any two different floats apart
+    while precision < 17 and len(set(f'{edge:.{precision}g}' for edge in edges)) < len(edges):
+        precision += 1
+    labels = [f'[{low:.{precision}g}, {high:.{precision}g})' for low, high in zip(edges[:-1], edges[1:])]
+    labels[-1] = labels[-1][:-1] + ']'
+    return labels
@@ -0,0 +1,161 @@
+from collections import namedtuple
+from functools import reduce
+from operator import mul
+from typing import List, Optional, TYPE_CHECKING
+
+import numpy
+import pandas
+
+from datapylot.data.attributes import Attribute, Dimension, Measure
+from datapylot.data.filters import Filter
+from datapylot.logger import log
+
+# static type analysis
+if TYPE_CHECKING:
+    from datapylot.data.datasource import Datasource
+    from datapylot.data.vizconfig import VizConfig
+
+# rough sizes of the generated document: every plot comes with its own models (axes, ranges, tools, ...)
+# and every glyph sends a value for x, y, color and size
+BYTES_PER_PLOT = 6000
+BYTES_PER_VALUE = 12
+VALUES_PER_GLYPH = 4
+
+CostEstimate = namedtuple('CostEstimate', ['rows', 'plots', 'glyphs', 'payload_bytes'])
+
+
+class CostLimitExceeded(Exception):
+    pass
+
+
+def estimate_cost(datasource: 'Datasource', config: 'VizConfig') -> CostEstimate:
+    """ Predicts how big a viz will be without aggregating anything, based on the cardinality of the columns
+
+    The amount of plots is the product of the cardinalities of the separators and the amount of glyphs
+    the product of the cardinalities of all dimensions, but never more than there are (filtered) rows.
+    """
+    rows = len(datasource.data)
+    for _filter in config.filters:
+        rows *= _filter.estimate_selectivity(datasource.get_statistics(_filter.attribute))
+    rows = int(rows)
+
+    separators = [s for s in config.x_separators + config.y_separators if isinstance(s, Dimension)]
+    plots = max(min(_get_combinations(datasource, config, separators), rows), 1)
+    glyphs = min(_get_combinations(datasource, config, config.dimensions), rows)
+    payload_bytes = plots * BYTES_PER_PLOT + glyphs * VALUES_PER_GLYPH * BYTES_PER_VALUE
+    return CostEstimate(rows, plots, glyphs, payload_bytes)
+
+
+def _get_combinations(datasource: 'Datasource', config: 'VizConfig', dimensions: List[Dimension]) -> int:
+    return reduce(mul, (_get_cardinality(datasource, config, d) for d in dimensions), 1)
+
+
+def _get_cardinality(datasource: 'Datasource', config: 'VizConfig', dimension: Attribute) -> int:
+    """ The amount of distinct values of a dimension, taking filters on the dimension's values into account
+    """
+    cardinality = datasource.get_statistics(dimension).distinct
+    for _filter in config.filters:
+        if _filter.attribute == dimension and _filter.values is not None:
+            cardinality = min(cardinality, len(_filter.values))
+    return max(cardinality, 1)
+
+
+class CostPolicy:
+    """ Limits for the size of a viz, and what to do with configs that exceed them
+
+    action can be one of:
+    reject: raise CostLimitExceeded before anything is aggregated
+    downsample: only keep evenly spaced values of the dimension that causes most plots or glyphs
+    top_n: only keep the values of that dimension with the highest values of the first measure
+    """
+
+    ACTIONS = ('reject', 'downsample', 'top_n')
+
+    def __init__(
+            self,
+            *,
+            max_plots: int = 500,
+            max_glyphs: int = 100000,
+            max_payload_bytes: int = 50 * 1024 * 1024,
+            action: str = 'reject'
+    ) -> None:
+        if action not in self.ACTIONS:
+            raise ValueError(f'Unknown action {action}, must be one of {self.ACTIONS}')
+        self.max_plots = max_plots
+        self.max_glyphs = max_glyphs
+        self.max_payload_bytes = max_payload_bytes
+        self.action = action
+
+    def get_violations(self, estimate: CostEstimate) -> List[str]:
+        violations = []
+        if estimate.plots > self.max_plots:
+            violations.append(f'{estimate.plots} plots (max. {self.max_plots})')
+        if estimate.glyphs > self.max_glyphs:
+            violations.append(f'{estimate.glyphs} glyphs (max. {self.max_glyphs})')
+        if estimate.payload_bytes > self.max_payload_bytes:
+            violations.append(f'{estimate.payload_bytes} bytes (max. {self.max_payload_bytes})')
+        return violations
+
+    def enforce(self, datasource: 'Datasource', config: 'VizConfig') -> 'VizConfig':
+        """ Returns the config itself if it is within the limits, otherwise rejects it or adds filters to reduce it
+        """
+        estimate = estimate_cost(datasource, config)
+        violations = self.get_violations(estimate)
+        # every round limits one dimension, so there can't be more rounds than dimensions
+        for _ in range(len(config.dimensions) + 1):
+            if len(violations) == 0:
+                return config
+            log(self, f'{config} exceeds the limits with {violations}')
+            if self.action == 'reject':
+                break
+            new_filter = self._get_limiting_filter(datasource, config, estimate)
+            if new_filter is None:
+                break
+            config = config.with_filters(config.filters + [new_filter])
+            estimate = estimate_cost(datasource, config)
+            violations = self.get_violations(estimate)
+
+        if len(violations) > 0:
+            raise CostLimitExceeded(f'Config {config} would create {", ".join(violations)}')
+        return config
+
+    def _get_limiting_filter(
+            self,
+            datasource: 'Datasource',
+            config: 'VizConfig',
+            estimate: CostEstimate
+    ) -> Optional[Filter]:
+        """ Creates a filter that reduces the dimension with the most values so that the viz fits the limits
+        """
+        separators = [s for s in config.x_separators + config.y_separators if isinstance(s, Dimension)]
+        if estimate.plots > self.max_plots and len(separators) > 0:
+            candidates, current, limit = separators, estimate.plots, self.max_plots
+        else:
+            candidates = [d for d in config.dimensions if d not in separators]
+            glyph_limit = min(self.max_glyphs, (self.max_payload_bytes // (VALUES_PER_GLYPH * BYTES_PER_VALUE)))
+            current, limit = estimate.glyphs, glyph_limit
+        # dimensions that are already reduced by a filter are left alone
+        filtered = [f.attribute for f in config.filters if f.values is not None]
+        candidates = [c for c in candidates if c not in filtered]
+        if len(candidates) == 0:
+            return None
+
+        dimension = max(candidates, key=lambda d: _get_cardinality(datasource, config, d))
+        cardinality = _get_cardinality(datasource, config, dimension)
+        # keep as many values as fit when all other dimensions stay as they are
+        amount = max(int(cardinality * limit / current), 1)
+
+        if self.action == 'top_n' and len(config.measures) > 0:
+            measure = config.measures[0]
+            totals = datasource.aggregate([dimension], Measure(measure.source_col, aggregation=measure.aggregation))
+            values = list(totals.sort_values(ascending=False).index[:amount])
+        else:
+            # missing values (eg. date parts of missing dates) are never kept and can't be sorted with the others
+            all_values = numpy.array(sorted(v for v in datasource.get_variations_of(dimension) if pandas.notnull(v)))
+            values = list(all_values[numpy.linspace(0, len(all_values) - 1, amount).astype(int)])
+        log(self, f'Limiting {dimension} to {amount} of {cardinality} values ({self.action})')
+        return Filter(dimension, values=values)
+
+    def __repr__(self) -> str:
+        return (f'<CostPolicy: {self.action} above {self.max_plots} plots, {self.max_glyphs} glyphs, '
+                f'{self.max_payload_bytes} bytes>')
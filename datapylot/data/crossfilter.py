@@ -0,0 +1,284 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union, TYPE_CHECKING
+
+import numpy
+import pandas
+from pandas.api.types import is_categorical_dtype
+
+from datapylot.data.attributes import Dimension, Measure
+from datapylot.data.filters import Filter
+from datapylot.data.table_calculations import apply_table_calculation
+from datapylot.logger import log
+
+# static type analysis
+if TYPE_CHECKING:
+    from datapylot.data.datasource import Datasource
+    from datapylot.data.vizconfig import VizConfig
+
+Selection = Union[Filter, Iterable[Any]]
+
+
+class ViewIndex:
+    """ Maps every row of the datasource to the group of a viz that it is aggregated into
+
+    Besides the group code of each row, the index keeps the running per-group totals of all rows that
+    currently pass the selections of the other views, so changing a selection only touches the rows
+    whose state actually changes.
+    """
+
+    def __init__(self, datasource: 'Datasource', config: 'VizConfig') -> None:
+        self.dimensions = config.dimensions  # type: List[Dimension]
+        self.measures = config.measures  # type: List[Measure]
+        self.codes, self.groups = _build_group_codes(datasource, self.dimensions)
+
+        # rows removed by the filters of the config itself, independent of any selection
+        self.filter_mask = numpy.ones(len(datasource.data), dtype=bool)
+        for _filter in config.filters:
+            self.filter_mask &= _filter.get_mask(datasource.get_column(_filter.attribute))
+
+        self.selection = None  # type: Optional[Selection]
+        # rows that are not part of the selection of this view, None if nothing is selected
+        self.rejected = None  # type: Optional[numpy.ndarray]
+
+        source_cols = OrderedDict.fromkeys(m.source_col for m in self.measures)
+        self._values: Dict[str, numpy.ndarray] = {}
+        self._valid: Dict[str, numpy.ndarray] = {}
+        for source_col in source_cols:
+            values = pandas.to_numeric(datasource.data[source_col], errors='coerce').values.astype('float64')
+            self._valid[source_col] = ~numpy.isnan(values)
+            self._values[source_col] = numpy.where(self._valid[source_col], values, 0.0)
+
+        self.rows = numpy.zeros(len(self.groups), dtype='int64')
+        self._sums = {col: numpy.zeros(len(self.groups)) for col in source_cols}
+        self._counts = {col: numpy.zeros(len(self.groups), dtype='int64') for col in source_cols}
+
+    def reset(self, passing: numpy.ndarray) -> None:
+        """ Recomputes all totals from the rows that pass all other selections
+        """
+        self.rows[:] = 0
+        for source_col in self._values:
+            self._sums[source_col][:] = 0
+            self._counts[source_col][:] = 0
+        self.update(numpy.flatnonzero(passing & self.filter_mask), 1)
+
+    def update(self, rows: numpy.ndarray, sign: int) -> None:
+        """ Adds (sign=1) or removes (sign=-1) the given rows to/from the totals of their groups
+        """
+        rows = rows[self.codes[rows] >= 0]
+        if len(rows) == 0:
+            return
+        codes = self.codes[rows]
+        size = len(self.groups)
+        self.rows += sign * numpy.bincount(codes, minlength=size)
+        for source_col, values in self._values.items():
+            valid = self._valid[source_col][rows]
+            self._sums[source_col] += sign * numpy.bincount(codes, weights=values[rows], minlength=size)
+            self._counts[source_col] += sign * numpy.bincount(codes[valid], minlength=size)
+
+    def get_aggregate(self, measure: Measure, passing: numpy.ndarray) -> pandas.Series:
+        """ Returns the aggregated measure for all groups that currently contain rows
+
+        Sums, counts and means come from the running totals, other aggregations are recomputed
+        from the passing rows.
+        """
+        present = self.rows > 0
+        source_col = measure.source_col
+        if measure.aggregation == 'sum':
+            values = self._sums[source_col]
+        elif measure.aggregation == 'count':
+            values = self._counts[source_col]
+        elif measure.aggregation == 'mean':
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                values = self._sums[source_col] / self._counts[source_col]
+        else:
+            rows = numpy.flatnonzero(passing & self.filter_mask & (self.codes >= 0))
+            column = pandas.Series(self._values[source_col][rows])
+            column[~self._valid[source_col][rows]] = numpy.nan
+            grouped = getattr(column.groupby(self.codes[rows]), measure.aggregation)()
+            values = grouped.reindex(numpy.arange(len(self.groups))).values
+
+        aggregated = pandas.Series(values[present], index=self.groups[present], name=source_col)
+        if measure.table_calculation is not None:
+            # there are no plots to partition by, so the calculation runs over all groups of the view
+            aggregated = apply_table_calculation(aggregated, [], measure.table_calculation, measure.window)
+        return aggregated
+
+
+class CrossFilter:
+    """ Links several vizzes over the same datasource, a selection in one of them filters all others
+
+    Every view keeps a ViewIndex, so a new selection is turned into a row mask with a single lookup
+    and only the rows that enter or leave the other views are added to or subtracted from their totals.
+    As with brushing in most dashboards, the selection of a view never filters the view itself.
+    """
+
+    def __init__(self, datasource: 'Datasource') -> None:
+        self.datasource = datasource
+        self._views: 'OrderedDict[str, ViewIndex]' = OrderedDict()
+        self._configs: Dict[str, 'VizConfig'] = {}
+        # per row: the amount of views whose selection does not contain it
+        self._rejections = numpy.zeros(len(datasource.data), dtype='int32')
+        self._version = datasource.version
+        log(self, 'Init CrossFilter')
+
+    @property
+    def views(self) -> List[str]:
+        return list(self._views.keys())
+
+    def add_view(self, name: str, config: 'VizConfig') -> None:
+        self._check_version()
+        if name in self._views:
+            raise ValueError(f'There already is a view named {name}')
+        log(self, f'adding view {name} for {config}')
+        view = ViewIndex(self.datasource, config)
+        view.reset(self._rejections == 0)
+        self._views[name] = view
+        self._configs[name] = config
+
+    def remove_view(self, name: str) -> None:
+        self.clear(name)
+        del self._views[name]
+        del self._configs[name]
+
+    def select(self, name: str, selection: Selection) -> None:
+        """ Selects a region of a view, either as a Filter or as the group labels of the view
+
+        Group labels are the index values of the view's aggregates, so tuples for views with
+        more than one dimension.
+        """
+        self._check_version()
+        view = self._get_view(name)
+        log(self, f'selecting {selection} in view {name}')
+        self._set_rejected(name, self._get_rejected(view, selection))
+        view.selection = selection
+
+    def clear(self, name: Optional[str] = None) -> None:
+        """ Removes the selection of a view, or of all views if no name is given
+        """
+        self._check_version()
+        for view_name in ([name] if name is not None else self.views):
+            self._set_rejected(view_name, None)
+            self._get_view(view_name).selection = None
+
+    def get_row_mask(self, name: str) -> numpy.ndarray:
+        """ Returns a boolean array that is True for every row that passes the selections of all other views
+        """
+        self._check_version()
+        view = self._get_view(name)
+        rejections = self._rejections if view.rejected is None else self._rejections - view.rejected
+        return rejections == 0
+
+    def get_aggregate(self, name: str, measure: Measure) -> pandas.Series:
+        """ Returns the measure of a view aggregated over its dimensions, filtered by the selections of all other views
+        """
+        self._check_version()
+        view = self._get_view(name)
+        if measure not in view.measures:
+            raise ValueError(f'Measure {measure} is not part of view {name}')
+        return view.get_aggregate(measure, self.get_row_mask(name))
+
+    def get_aggregates(self, name: str) -> 'OrderedDict[Measure, pandas.Series]':
+        return OrderedDict((m, self.get_aggregate(name, m)) for m in self._get_view(name).measures)
+
+    def _get_view(self, name: str) -> ViewIndex:
+        if name not in self._views:
+            raise ValueError(f'There is no view named {name}, must be one of {self.views}')
+        return self._views[name]
+
+    def _get_rejected(self, view: ViewIndex, selection: Selection) -> numpy.ndarray:
+        if isinstance(selection, Filter):
+            return ~selection.get_mask(self.datasource.get_column(selection.attribute))
+        is_selected = view.groups.isin(list(selection))
+        # rows without a group have the code -1, which picks the appended False
+        return ~numpy.append(is_selected, False)[view.codes]
+
+    def _set_rejected(self, name: str, rejected: Optional[numpy.ndarray]) -> None:
+        """ Replaces the rejected rows of a view and updates all other views with the rows that changed
+        """
+        view = self._views[name]
+        no_rows = numpy.zeros(len(self._rejections), dtype=bool)
+        old = no_rows if view.rejected is None else view.rejected
+        new = no_rows if rejected is None else rejected
+        changed = numpy.flatnonzero(old != new)
+        view.rejected = rejected
+        if len(changed) == 0:
+            return
+
+        # rejections by all views except the changed one, just for the rows that changed
+        other_rejections = self._rejections[changed] - old[changed]
+        self._rejections[changed] += new[changed].astype('int32') - old[changed]
+        for other_name, other in self._views.items():
+            if other_name == name:
+                continue
+            own = 0 if other.rejected is None else other.rejected[changed]
+            flipped = changed[(other_rejections - own == 0) & other.filter_mask[changed]]
+            other.update(flipped[~new[flipped]], 1)
+            other.update(flipped[new[flipped]], -1)
+        log(self, f'updated {len(self._views) - 1} views with {len(changed)} changed rows')
+
+    def _check_version(self) -> None:
+        """ Rebuilds all indexes and selections once the data of the datasource has changed
+        """
+        if self._version == self.datasource.version:
+            return
+        log(self, f'rebuilding indexes for data version {self.datasource.version}')
+        self._version = self.datasource.version
+        self._rejections = numpy.zeros(len(self.datasource.data), dtype='int32')
+        selections = {name: view.selection for name, view in self._views.items()}
+        for name, config in self._configs.items():
+            self._views[name] = ViewIndex(self.datasource, config)
+        for name, selection in selections.items():
+            if selection is not None:
+                view = self._views[name]
+                view.selection = selection
+                view.rejected = self._get_rejected(view, selection)
+                self._rejections += view.rejected
+        for name, view in self._views.items():
+            view.reset(self.get_row_mask(name))
+
+
+def _build_group_codes(datasource: 'Datasource', dimensions: List[Dimension]) -> Tuple[numpy.ndarray, pandas.Index]:
+    """ Returns the group code of every row and the labels of the groups, like the index of Datasource.aggregate()
+
+    Levels are named by the col_name of their dimension and categorical dimensions keep their categories, so
+    the labels can be aligned with aggregates of the datasource. Rows with a missing value in any dimension
+    get the code -1, just like groupby() drops them.
+    """
+    length = len(datasource.data)
+    if len(dimensions) == 0:
+        return numpy.zeros(length, dtype='int64'), pandas.Index([True])
+
+    group_ids = numpy.zeros(length, dtype='int64')
+    missing = numpy.zeros(length, dtype=bool)
+    level_codes: List[numpy.ndarray] = []
+    level_uniques: List[pandas.Index] = []
+    for dimension in dimensions:
+        codes, uniques = _factorize(datasource.get_column(dimension))
+        missing |= codes < 0
+        # combining and compacting per dimension keeps the keys small, no matter how many dimensions there are
+        combined = group_ids * len(uniques) + numpy.maximum(codes, 0)
+        group_ids, unique_combined = pandas.factorize(combined, sort=True)
+        level_codes = [lc[unique_combined // len(uniques)] for lc in level_codes]
+        level_codes.append(unique_combined % len(uniques))
+        level_uniques.append(uniques)
+
+    group_ids[missing] = -1
+    labels = [uniques.take(codes) for uniques, codes in zip(level_uniques, level_codes)]
+    names = [d.col_name for d in dimensions]
+    if len(dimensions) == 1:
+        return group_ids, pandas.Index(labels[0], name=names[0])
+    return group_ids, pandas.MultiIndex.from_arrays(labels, names=names)
+
+
+def _factorize(column: pandas.Series) -> Tuple[numpy.ndarray, pandas.Index]:
+    if is_categorical_dtype(column):
+        # the labels keep the categorical type, like the levels that groupby() creates for categorical columns
+        categories = column.cat.categories
+        uniques = pandas.CategoricalIndex(categories, categories=categories, ordered=column.cat.ordered)
+        return column.cat.codes.values.astype('int64'), uniques
+    try:
+        codes, uniques = pandas.factorize(column.values, sort=True)
+    except TypeError:
+        # mixed types can't be sorted
+        codes, uniques = pandas.factorize(column.values)
+    return codes.astype('int64'), pandas.Index(uniques)
@@ -1,15 +1,83 @@
-from typing import Callable, Optional, Union, List, Any, Dict
+import inspect
+from collections import OrderedDict
+from functools import wraps
+from threading import RLock
+from typing import Callable, Optional, Union, List, Any, Dict, Tuple
 
+import numpy
 import pandas
+from pandas.api.types import is_categorical_dtype, is_datetime64_any_dtype, is_numeric_dtype
 from pandas.core.groupby import DataFrameGroupBy
 
-from datapylot.data.attributes import Attribute, Dimension, Measure
+from datapylot.data.attributes import Attribute, Dimension, Measure, DerivedDimension
+from datapylot.data.filters import Filter
+from datapylot.data.statistics import ColumnStatistics
+from datapylot.data.table_calculations import apply_table_calculation
+from datapylot.data.tiles import TilePyramid
 from datapylot.logger import log
 
 
+# aggregations that can be computed from already aggregated values, and how to combine them
+ROLLUP_AGGREGATIONS = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+DimensionNames = Tuple[str, ...]
+AggregateKey = Tuple[DimensionNames, str, str, Optional[str], int, DimensionNames]
+MeasureColumn = Union[str, Measure]
+
+# pandas < 0.23 has no observed option, see group_observed()
+_OBSERVED = {'observed': True} if 'observed' in inspect.signature(pandas.DataFrame.groupby).parameters else {}
+
+
+def group_observed(
+        data: Union[pandas.DataFrame, pandas.Series],
+        by: Any = None,
+        level: Optional[List[int]] = None
+) -> Any:
+    """ Groups like data.groupby(by, level=level), but only into the combinations of values that occur in the data
+
+    Derived dimensions are categorical, and pandas makes a group of every combination of the categories of
+    categorical keys by default, including the ones without any rows. Their sums would be 0 and their means NaN.
+    """
+    if len(_OBSERVED) == 0 and isinstance(by, list):
+        by = [_drop_unused_categories(data, key) for key in by]
+    return data.groupby(by, level=level, **_OBSERVED)
+
+
+def _drop_unused_categories(data: Union[pandas.DataFrame, pandas.Series], key: Any) -> Any:
+    # without the observed option, old pandas only leaves out the empty groups of several keys when it aggregates
+    # single columns, a single categorical key needs its unused categories removed
+    column = data[key] if isinstance(key, str) else key
+    if isinstance(column, pandas.Series) and is_categorical_dtype(column):
+        return column.cat.remove_unused_categories().rename(column.name)
+    return key
+
+
+def _locked(method: Callable) -> Callable:
+    """ Runs the method while holding the lock of the datasource, see Datasource.lock
+    """
+    @wraps(method)
+    def locked(self: 'Datasource', *args: Any, **kwargs: Any) -> Any:
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+
 class Datasource:
+    # maximum amount of aggregation results that are kept in memory
+    aggregate_cache_size = 128
+
     def __init__(self, data: pandas.DataFrame) -> None:
+        # guards the data and all caches, so rows can be appended while other threads read or aggregate.
+        # Readers that need several calls to see the same data (eg. a whole query plan) hold it themselves.
+        self.lock = RLock()
         self.data = data
+        # bumped whenever self.data changes, invalidates all cached derived columns
+        self.version = 0
+        self._derived_columns: Dict[str, Tuple[int, pandas.Series]] = {}
+        self._statistics: Dict[str, Tuple[int, ColumnStatistics]] = {}
+        self._aggregates: 'OrderedDict[AggregateKey, pandas.Series]' = OrderedDict()
+        self._aggregates_version = 0
+        self._tile_pyramids: Dict[Tuple[str, str, Optional[str]], Tuple[int, TilePyramid]] = {}
         self._add_noc()
         log(self, 'Init Datasource')
 
@@ -25,8 +93,59 @@ class Datasource:
         output = {col: mapping(self.data[col].dtype) for col in self.data.columns}
         return output
 
+    @_locked
     def add_column(self, name: str, formula: Callable) -> None:
         self.data[name] = formula(self.data)
+        self.version += 1
+
+    @_locked
+    def append_rows(self, rows: pandas.DataFrame) -> None:
+        """ Adds rows at the end of the data, eg. for live vizzes that show new rows as they arrive
+
+        The columns of rows are converted to the types of the existing columns, columns that rows doesn't
+        have are left empty. Rows must not contain unknown columns.
+        """
+        unknown = set(rows.columns) - set(self.data.columns)
+        if unknown:
+            raise ValueError(f'Can not append rows with unknown columns {sorted(unknown)}')
+        rows = rows.reindex(columns=self.data.columns)
+        rows['Number of records'] = 1
+        for column, dtype in self.data.dtypes.items():
+            if is_datetime64_any_dtype(dtype):
+                rows[column] = pandas.to_datetime(rows[column])
+            elif is_numeric_dtype(dtype):
+                rows[column] = pandas.to_numeric(rows[column])
+        merged = self._merge_cached_aggregates(rows)
+        self.data = pandas.concat([self.data, rows], ignore_index=True)
+        self.version += 1
+        # the merged aggregates already contain the new rows, all other results are outdated
+        self._aggregates = merged
+        self._aggregates_version = self.version
+        log(self, f'appended {len(rows)} rows, data version {self.version}, kept {len(merged)} cached aggregates')
+
+    def _merge_cached_aggregates(self, rows: pandas.DataFrame) -> 'OrderedDict[AggregateKey, pandas.Series]':
+        """ Returns the cached aggregates that can be rolled up, with the aggregates of rows merged into them
+
+        Only the new rows are aggregated, so keeping the aggregates of a growing datasource up to date costs as much
+        as the new rows and the amount of groups. Aggregates over derived dimensions or with table calculations
+        and aggregations that can't be rolled up (eg. mean) are dropped and computed again when they are needed.
+        """
+        self._get_cached(None, touch=False)  # drops outdated results
+        merged = OrderedDict()  # type: OrderedDict[AggregateKey, pandas.Series]
+        for key, aggregated in self._aggregates.items():
+            dimension_names, source_col, aggregation, table_calculation = key[:4]
+            if table_calculation is not None or aggregation not in ROLLUP_AGGREGATIONS or \
+                    any(name not in rows.columns for name in dimension_names):
+                continue
+            if len(dimension_names) == 0:
+                grouped = rows.groupby(lambda _: True)
+            else:
+                grouped = group_observed(rows, list(dimension_names))
+            appended = getattr(grouped[source_col], aggregation)()
+            combined = pandas.concat([aggregated, appended])
+            rollup = ROLLUP_AGGREGATIONS[aggregation]
+            merged[key] = getattr(group_observed(combined, level=list(range(combined.index.nlevels))), rollup)()
+        return merged
 
     def _add_noc(self) -> None:
         """ Adds a default 'number of rows' column so things like counts are possible
@@ -43,25 +162,230 @@ class Datasource:
                     self.data[column] = pandas.to_datetime(self.data[column])
                 except ValueError:
                     pass
+        self.version += 1
+
+    @_locked
+    def get_column(self, column: Union[str, Attribute]) -> pandas.Series:
+        """ Returns the values of a column, derived columns are computed on first access and then cached
 
+        The cache is bound to the current version of the data, so derived values are recomputed
+        once after the data has changed and otherwise reused by all configs that need them.
+        Derived columns are named by the col_name of their dimension, like the columns of the data.
+        """
+        if isinstance(column, Measure):
+            return self.data[column.source_col]
+        if not isinstance(column, DerivedDimension):
+            return self.data[getattr(column, 'col_name', column)]
+
+        cached = self._derived_columns.get(column.col_name)
+        if cached is None or cached[0] != self.version:
+            log(self, f'deriving column {column.col_name} for data version {self.version}')
+            # grouping by the series names the index levels, which must match the ones of a projected frame
+            cached = (self.version, column.derive(self).rename(column.col_name))
+            self._derived_columns[column.col_name] = cached
+        return cached[1]
+
+    @_locked
+    def project(self, columns: List[Union[str, Attribute]], rows: Optional[numpy.ndarray] = None) -> pandas.DataFrame:
+        """ Returns a frame of the given columns and of the rows of the mask rows (or all), see get_column()
+
+        Measures are named by their source column, all others by their col_name. Categories that have no rows
+        left are removed, they would show up as empty groups.
+        """
+        data = OrderedDict()  # type: Dict[str, pandas.Series]
+        for column in columns:
+            values = self.get_column(column)
+            if rows is not None:
+                values = values[rows]
+                if is_categorical_dtype(values):
+                    values = values.cat.remove_unused_categories()
+            name = column.source_col if isinstance(column, Measure) else getattr(column, 'col_name', column)
+            data[name] = values
+        index = self.data.index if rows is None else self.data.index[rows]
+        return pandas.DataFrame(data, index=index, columns=list(data.keys()))
+
+    @_locked
+    def get_filter_mask(self, filters: List[Filter], rows: Optional[numpy.ndarray] = None) -> numpy.ndarray:
+        """ Returns the mask of the rows that pass all filters, relative to the rows of the mask rows (or all)
+        """
+        mask = numpy.ones(len(self.data) if rows is None else int(rows.sum()), dtype=bool)
+        for _filter in filters:
+            column = self.get_column(_filter.attribute)
+            if rows is not None:
+                column = column[rows]
+            mask &= _filter.get_mask(column)
+        return mask
+
+    @_locked
+    def get_statistics(self, column: Union[str, Attribute]) -> ColumnStatistics:
+        """ Returns count, cardinality, min/max (and lazily quantiles) of a column, cached per data version
+        """
+        col = getattr(column, 'col_name', column)
+        cached = self._statistics.get(col)
+        if cached is None or cached[0] != self.version:
+            cached = (self.version, ColumnStatistics(self.get_column(column)))
+            self._statistics[col] = cached
+        return cached[1]
+
+    @_locked
+    def get_tile_pyramid(
+            self,
+            x: MeasureColumn,
+            y: MeasureColumn,
+            values: Optional[MeasureColumn] = None
+    ) -> TilePyramid:
+        """ Returns the rows binned by two measures at several zoom levels (see TilePyramid), cached per data version
+
+        The rows are binned as they are, without aggregating them first. With values, every pixel also
+        stores the sum of that measure, so tiles can be colored by its mean.
+        """
+        key = tuple(getattr(col, 'source_col', col) for col in (x, y, values))
+        cached = self._tile_pyramids.get(key)
+        if cached is None or cached[0] != self.version:
+            log(self, f'building tile pyramid of {key} for data version {self.version}')
+            value_column = self.get_column(values).values if values is not None else None
+            pyramid = TilePyramid.build(self.get_column(x).values, self.get_column(y).values, value_column)
+            cached = (self.version, pyramid)
+            self._tile_pyramids[key] = cached
+        return cached[1]
+
+    @_locked
     def get_variations_of(self, column: Union[str, Attribute]) -> List[Any]:
         """Returns all possible values for a given column
 
         Only makes sense to call this for columns
         TODO: Must be adapted to work with filtered data
         """
-        col = getattr(column, 'col_name', column)
-        return list(set(self.data[col]))
+        return list(set(self.get_column(column)))
 
+    @_locked
     def group_by(self, dimensions: List[Dimension]) -> DataFrameGroupBy:
         """ Performs a grouping based on all given dimensions and returns the result
         """
         log(self, f'grouping data bases on {dimensions}')
-        dimension_names = [d.col_name for d in dimensions]
-        if len(dimension_names) == 0:
+        if len(dimensions) == 0:
             # If no dimensions are given to group by, create grouping object based on no filter at all
             return self.data.groupby(lambda _: True)
-        return self.data.groupby(dimension_names)
+        # derived dimensions are not part of self.data, so their cached values are passed to pandas directly
+        keys = [self.get_column(d) if isinstance(d, DerivedDimension) else d.col_name for d in dimensions]
+        return group_observed(self.data, keys)
+
+    @_locked
+    def aggregate(
+            self,
+            dimensions: List[Dimension],
+            measure: Measure,
+            partition: Optional[List[Dimension]] = None,
+            *,
+            cube: Optional[DimensionNames] = None
+    ) -> pandas.Series:
+        """ Returns the measure aggregated for each combination of the dimensions, including its table calculation
+
+        Table calculations are partitioned by the dimensions in partition (which must be a subset of dimensions)
+        and run along the order of the groups. Results are cached per data version, so repeated and
+        similar configs don't aggregate the same data twice. The returned series must not be modified.
+
+        If cube names the dimensions of a cached, finer aggregate of the same measure (see find_cube()),
+        the result is rolled up from that aggregate instead of grouping the raw data again.
+        """
+        dimension_names = tuple(d.col_name for d in dimensions)
+        key = self._get_aggregate_key(dimension_names, measure, partition)
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
+
+        plain_measure = Measure(measure.source_col, aggregation=measure.aggregation)
+        plain_key = self._get_aggregate_key(dimension_names, plain_measure)
+        aggregated = self._get_cached(plain_key)
+        if aggregated is None:
+            if cube is not None:
+                aggregated = self._roll_up(cube, dimension_names, measure)
+            else:
+                grouped_measure = self.group_by(dimensions)[measure.source_col]
+                aggregated = getattr(grouped_measure, measure.aggregation)()
+            self._store_cached(plain_key, aggregated)
+
+        if measure.table_calculation is not None:
+            levels = [dimension_names.index(d.col_name) for d in partition or []]
+            aggregated = apply_table_calculation(aggregated, levels, measure.table_calculation, measure.window)
+            self._store_cached(key, aggregated)
+        return aggregated
+
+    @_locked
+    def is_aggregate_cached(
+            self,
+            dimensions: List[Dimension],
+            measure: Measure,
+            partition: Optional[List[Dimension]] = None
+    ) -> bool:
+        key = self._get_aggregate_key(tuple(d.col_name for d in dimensions), measure, partition)
+        return self._get_cached(key, touch=False) is not None
+
+    @_locked
+    def find_cube(self, dimensions: List[Dimension], measure: Measure) -> Optional[DimensionNames]:
+        """ Finds the smallest cached aggregate of the measure over more dimensions that can be rolled up
+
+        Only aggregations that can be combined again (sum, count, min, max) can be rolled up.
+        Grouping drops the rows with a null dimension, so aggregates whose further dimensions have nulls miss
+        rows that the rolled up result would need and are not used.
+        Returns the dimension names of the found aggregate, which can be passed to aggregate() as cube.
+        """
+        if measure.aggregation not in ROLLUP_AGGREGATIONS:
+            return None
+        self._get_cached(None, touch=False)  # drops outdated results
+        wanted = set(d.col_name for d in dimensions)
+        plain_key = (measure.source_col, measure.aggregation, None, 0, ())
+        candidates = [(len(series), key[0]) for key, series in self._aggregates.items()
+                      if key[1:] == plain_key and wanted < set(key[0]) and
+                      not any(self._has_nulls(name) for name in set(key[0]) - wanted)]
+        return min(candidates)[1] if len(candidates) > 0 else None
+
+    def _has_nulls(self, col_name: str) -> bool:
+        if col_name in self.data.columns:
+            return self.get_statistics(col_name).count < len(self.data)
+        cached = self._derived_columns.get(col_name)
+        # a derived column that is not cached for this version can't be checked, so it is treated as incomplete
+        return cached is None or cached[0] != self.version or bool(cached[1].isnull().any())
+
+    def _roll_up(self, cube: DimensionNames, dimension_names: DimensionNames, measure: Measure) -> pandas.Series:
+        cube_key = self._get_aggregate_key(cube, Measure(measure.source_col, aggregation=measure.aggregation))
+        cube_data = self._get_cached(cube_key)
+        assert cube_data is not None, f'No cached aggregate for {cube_key} to roll up from'
+        rollup = ROLLUP_AGGREGATIONS[measure.aggregation]
+        log(self, f'rolling up {measure} from {cube} to {dimension_names}')
+        if len(dimension_names) == 0:
+            # same shape as grouping by no dimensions at all
+            return pandas.Series([getattr(cube_data, rollup)()], index=[True], name=cube_data.name)
+        levels = [cube.index(name) for name in dimension_names]
+        return getattr(group_observed(cube_data, level=levels), rollup)()
+
+    @staticmethod
+    def _get_aggregate_key(
+            dimension_names: DimensionNames,
+            measure: Measure,
+            partition: Optional[List[Dimension]] = None
+    ) -> AggregateKey:
+        if measure.table_calculation is None:
+            # partition and window only matter for table calculations
+            return dimension_names, measure.source_col, measure.aggregation, None, 0, ()
+        partition_names = tuple(d.col_name for d in partition or [])
+        return (dimension_names, measure.source_col, measure.aggregation, measure.table_calculation, measure.window,
+                partition_names)
+
+    def _get_cached(self, key: Optional[AggregateKey], touch: bool = True) -> Optional[pandas.Series]:
+        if self._aggregates_version != self.version:
+            self._aggregates.clear()
+            self._aggregates_version = self.version
+        if key not in self._aggregates:
+            return None
+        if touch:
+            self._aggregates.move_to_end(key)
+        return self._aggregates[key]
+
+    def _store_cached(self, key: AggregateKey, aggregated: pandas.Series) -> None:
+        self._aggregates[key] = aggregated
+        if len(self._aggregates) > self.aggregate_cache_size:
+            self._aggregates.popitem(last=False)
 
     @classmethod
     def from_csv(cls, filename: str, options: Optional[dict] = None) -> 'Datasource':
@@ -0,0 +1,96 @@
+from typing import Any, Callable, Dict
+
+import numpy
+import pandas
+from pandas.api.types import is_datetime64_any_dtype
+
+DATE_PARTS = ('year', 'quarter', 'month', 'week', 'day')
+# placeholder part that the aggregator replaces with one of DATE_PARTS, based on the available pixels
+AUTO_DATE_PART = 'auto'
+
+# average length of each period in days, used to estimate how many buckets a date range is split into
+_PART_DAYS = {'year': 365.25, 'quarter': 91.31, 'month': 30.44, 'week': 7, 'day': 1}
+
+# Labels are built from the integer keys and only once per distinct key, never per row.
+# Truncation labels sort lexicographically in chronological order, which keeps axes and panels ordered
+_TRUNCATION_LABELS: Dict[str, Callable[[int], str]] = {
+    'year': lambda key: str(1970 + key),
+    'quarter': lambda key: f'{1970 + key // 12}-Q{key % 12 // 3 + 1}',
+    'month': lambda key: f'{1970 + key // 12}-{key % 12 + 1:02d}',
+    'week': lambda key: str(numpy.datetime64(key, 'D')),
+    'day': lambda key: str(numpy.datetime64(key, 'D')),
+}
+
+_PART_LABELS: Dict[str, Callable[[int], str]] = {
+    'year': lambda key: str(key),
+    'quarter': lambda key: f'Q{key}',
+    'month': lambda key: f'{key:02d}',
+    'week': lambda key: f'W{key:02d}',
+    'day': lambda key: f'{key:02d}',
+}
+
+
+def derive_date_part(column: pandas.Series, part: str, truncate: bool = True) -> pandas.Series:
+    """ Maps every date of the column to its truncated period (eg. 2013-01) or date part (eg. 01 for january)
+
+    The result is a categorical series: one integer code per row plus a small list of ordered labels.
+    All row-wise work happens in numpy, labels are only formatted for the distinct keys.
+    """
+    if part not in DATE_PARTS:
+        raise ValueError(f'Unknown date part {part}, must be one of {DATE_PARTS}')
+    if not is_datetime64_any_dtype(column):
+        raise ValueError(f'Column {column.name} has type {column.dtype} and is not a datetime column')
+
+    valid = column.notnull().values
+    if truncate:
+        keys = _truncated_keys(column.values[valid], part)
+        label_for = _TRUNCATION_LABELS[part]
+    else:
+        keys = _part_keys(column[valid], part)
+        label_for = _PART_LABELS[part]
+
+    valid_codes, unique_keys = pandas.factorize(keys, sort=True)
+    # rows without a date get the code -1, which is the missing value for categoricals
+    codes = numpy.full(len(column), -1, dtype=valid_codes.dtype)
+    codes[valid] = valid_codes
+    labels = [label_for(int(key)) for key in unique_keys]
+
+    categorical = pandas.Categorical.from_codes(codes, labels, ordered=True)
+    return pandas.Series(categorical, index=column.index)
+
+
+def choose_date_part(start: Any, end: Any, max_buckets: int) -> str:
+    """ Returns the finest truncation that splits the range from start to end into at most max_buckets periods
+    """
+    if start is None or end is None:
+        return 'year'
+    days = (pandas.Timestamp(end) - pandas.Timestamp(start)).days + 1
+    for part in reversed(DATE_PARTS):
+        if days / _PART_DAYS[part] <= max_buckets:
+            return part
+    return 'year'
+
+
+def _truncated_keys(values: numpy.ndarray, part: str) -> numpy.ndarray:
+    """ Returns an integer key per date that is equal for all dates of the same period
+    """
+    if part == 'year':
+        return values.astype('datetime64[Y]').view('int64')
+
+    months = values.astype('datetime64[M]').view('int64')
+    if part == 'quarter':
+        return months - months % 3
+    if part == 'month':
+        return months
+
+    days = values.astype('datetime64[D]').view('int64')
+    if part == 'week':
+        # 1970-01-01 was a thursday, shift by three days so that weeks start on mondays
+        return days - (days + 3) % 7
+    return days
+
+
+def _part_keys(column: pandas.Series, part: str) -> numpy.ndarray:
+    """ Returns the date part of each date, ignoring all larger parts (eg. the month of the year)
+    """
+    return getattr(column.dt, part).values.astype('int64')
@@ -0,0 +1,71 @@
+from typing import Any, Iterable, Optional, TYPE_CHECKING
+
+import numpy
+import pandas
+
+# static type analysis
+if TYPE_CHECKING:
+    from datapylot.data.attributes import Attribute
+    from datapylot.data.statistics import ColumnStatistics
+
+# assumed share of rows that pass a range filter if the range of the column is unknown
+DEFAULT_RANGE_SELECTIVITY = 1 / 3
+
+
+class Filter:
+    """ Restricts the data to the rows whose value of an attribute is in a set of values and/or within a range
+
+    Filters work on single rows before any aggregation, so a filter on a measure compares the raw values.
+    """
+
+    def __init__(
+            self,
+            attribute: 'Attribute',
+            *,
+            values: Optional[Iterable[Any]] = None,
+            min_value: Any = None,
+            max_value: Any = None
+    ) -> None:
+        if values is None and min_value is None and max_value is None:
+            raise ValueError(f'Filter on {attribute} needs values, a min_value or a max_value')
+        self.attribute = attribute
+        self.values = None if values is None else list(values)
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def get_mask(self, column: pandas.Series) -> numpy.ndarray:
+        """ Returns a boolean array that is True for every value of the column that passes the filter
+        """
+        mask = numpy.ones(len(column), dtype=bool)
+        if self.values is not None:
+            mask &= column.isin(self.values).values
+        if self.min_value is not None:
+            mask &= (column >= self.min_value).values
+        if self.max_value is not None:
+            mask &= (column <= self.max_value).values
+        return mask
+
+    def estimate_selectivity(self, statistics: 'ColumnStatistics') -> float:
+        """ Estimates the share of rows that pass this filter, based on the statistics of its column
+        """
+        selectivity = 1.0
+        if self.values is not None:
+            selectivity *= min(len(self.values) / max(statistics.distinct, 1), 1.0)
+        if self.min_value is not None or self.max_value is not None:
+            try:
+                low = statistics.min if self.min_value is None else max(self.min_value, statistics.min)
+                high = statistics.max if self.max_value is None else min(self.max_value, statistics.max)
+                selectivity *= min(max((high - low) / (statistics.max - statistics.min), 0.0), 1.0)
+            except (TypeError, ZeroDivisionError):
+                selectivity *= DEFAULT_RANGE_SELECTIVITY
+        return selectivity
+
+    def __repr__(self) -> str:
+        conditions = []
+        if self.values is not None:
+            conditions.append(f'in {self.values}')
+        if self.min_value is not None:
+            conditions.append(f'>= {self.min_value}')
+        if self.max_value is not None:
+            conditions.append(f'<= {self.max_value}')
+        return f'<Filter: {self.attribute.col_name} {" and ".join(conditions)}>'
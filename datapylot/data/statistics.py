@@ -0,0 +1,37 @@
+from typing import Any, Dict
+
+import numpy
+import pandas
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+
+
+class ColumnStatistics:
+    """ Summary information about a single column
+
+    Instances are created and cached by Datasource.get_statistics(), so everything in here is computed
+    at most once per column and data version. Quantiles are computed lazily since they need a sort.
+    """
+
+    def __init__(self, column: pandas.Series) -> None:
+        self.count = int(column.count())
+        self.distinct = int(column.nunique())
+        self.is_numeric = is_numeric_dtype(column) and not is_datetime64_any_dtype(column)
+        self.min = None  # type: Any
+        self.max = None  # type: Any
+        if self.count > 0 and (self.is_numeric or is_datetime64_any_dtype(column)):
+            self.min, self.max = column.min(), column.max()
+        self._column = column
+        self._quantiles: Dict[int, numpy.ndarray] = {}
+
+    def quantiles(self, amount: int) -> numpy.ndarray:
+        """ Returns the amount+1 edges that split the column into amount equally filled buckets
+        """
+        if not self.is_numeric:
+            raise ValueError(f'Quantiles are only available for numeric columns, not {self._column.dtype}')
+        if amount not in self._quantiles:
+            values = self._column.dropna().values
+            self._quantiles[amount] = numpy.percentile(values, numpy.linspace(0, 100, amount + 1))
+        return self._quantiles[amount]
+
+    def __repr__(self) -> str:
+        return f'<ColumnStatistics: count={self.count}, distinct={self.distinct}, min={self.min}, max={self.max}>'
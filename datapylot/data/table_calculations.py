@@ -0,0 +1,87 @@
+from typing import List
+
+import numpy
+import pandas
+
+TABLE_CALCULATIONS = ('running_total', 'percent_of_total', 'rank', 'moving_average')
+
+
+def apply_table_calculation(
+        aggregated: pandas.Series,
+        partition_levels: List[int],
+        calculation: str,
+        window: int = 3
+) -> pandas.Series:
+    """ Applies a table calculation to already aggregated values
+
+    The values are partitioned by the given index levels (eg. one partition per plot) and the calculation
+    runs along the existing order of the index within each partition. Everything is done with numpy on the
+    whole array at once, no matter how many partitions there are.
+    """
+    if calculation not in TABLE_CALCULATIONS:
+        raise ValueError(f'Unknown table calculation {calculation}, must be one of {TABLE_CALCULATIONS}')
+    if len(aggregated) == 0:
+        return aggregated.astype('float64')
+
+    keys = _get_partition_keys(aggregated.index, partition_levels)
+    # a stable sort groups the partitions together and keeps the axis order inside of them
+    order = numpy.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    sorted_values = aggregated.values.astype('float64')[order]
+
+    is_start = numpy.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+    starts = numpy.flatnonzero(is_start)
+    partition_ids = numpy.cumsum(is_start) - 1
+    position_in_partition = numpy.arange(len(sorted_values)) - starts[partition_ids]
+
+    if calculation == 'running_total':
+        sums = numpy.concatenate(([0.0], numpy.cumsum(sorted_values)))
+        calculated = sums[1:] - sums[starts][partition_ids]
+    elif calculation == 'percent_of_total':
+        totals = numpy.add.reduceat(sorted_values, starts)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            calculated = sorted_values / totals[partition_ids]
+    elif calculation == 'rank':
+        calculated = _rank_descending(sorted_keys, sorted_values, starts, partition_ids)
+    else:
+        # trailing window, shorter at the start of each partition
+        sums = numpy.concatenate(([0.0], numpy.cumsum(sorted_values)))
+        sizes = numpy.minimum(position_in_partition + 1, window)
+        ends = numpy.arange(1, len(sorted_values) + 1)
+        calculated = (sums[ends] - sums[ends - sizes]) / sizes
+
+    result = numpy.empty_like(calculated)
+    result[order] = calculated
+    return pandas.Series(result, index=aggregated.index, name=aggregated.name)
+
+
+def _get_partition_keys(index: pandas.Index, levels: List[int]) -> numpy.ndarray:
+    """ Combines the values of all partitioning levels into one integer key per row
+    """
+    keys = numpy.zeros(len(index), dtype='int64')
+    for level in levels:
+        codes, uniques = pandas.factorize(index.get_level_values(level))
+        keys = keys * len(uniques) + codes
+    return keys
+
+
+def _rank_descending(
+        keys: numpy.ndarray,
+        values: numpy.ndarray,
+        starts: numpy.ndarray,
+        partition_ids: numpy.ndarray
+) -> numpy.ndarray:
+    """ Ranks the values within each partition, the largest value gets rank 1 and ties share the lowest rank
+    """
+    # lexsort sorts by the last key first: by partition, then by descending value
+    order = numpy.lexsort((-values, keys))
+    ranked_keys, ranked_values = keys[order], values[order]
+    positions = numpy.arange(len(values))
+
+    is_new_value = numpy.concatenate(([True], (ranked_keys[1:] != ranked_keys[:-1]) |
+                                      (ranked_values[1:] != ranked_values[:-1])))
+    # ties get the position of the first of their values
+    first_of_value = numpy.maximum.accumulate(numpy.where(is_new_value, positions, 0))
+    ranks = numpy.empty(len(values))
+    ranks[order] = first_of_value - starts[partition_ids[order]] + 1
+    return ranks
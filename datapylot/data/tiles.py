@@ -0,0 +1,212 @@
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+import numpy
+
+from datapylot.data_preparation.rasterizer import Extent, Raster
+
+# position of a tile within its level, tiles are counted from the bottom left
+TileIndex = Tuple[int, int]
+
+
+# the non-empty pixels of one zoom level, as sorted codes (row * resolution + column) with their aggregates
+Level = namedtuple('Level', ['resolution', 'codes', 'counts', 'sums'])
+
+
+class TilePyramid:
+    """ Points of two measures binned into pixels at several zoom levels, to serve the visible part of huge scatters
+
+    Level 0 covers the extents of the points with a single tile of tile_size x tile_size pixels, every further
+    level doubles the resolution in both directions. Only non-empty pixels are stored, so the finest levels of
+    sparse data stay small. The finest level is binned from the points once, coarser ones by merging 2x2 pixels.
+    If values are given, their sum per pixel is stored as well (see Raster.get_means()).
+    """
+
+    tile_size = 256
+
+    def __init__(
+            self,
+            levels: List[Level],
+            x_extent: Extent,
+            y_extent: Extent,
+            value_extent: Optional[Extent] = None
+    ) -> None:
+        self.levels = levels
+        self.x_extent = x_extent
+        self.y_extent = y_extent
+        self.value_extent = value_extent
+
+    @classmethod
+    def build(
+            cls,
+            x: numpy.ndarray,
+            y: numpy.ndarray,
+            values: Optional[numpy.ndarray] = None,
+            depth: int = 8
+    ) -> 'TilePyramid':
+        """ Bins the points into depth levels, points with a missing coordinate (or value) are dropped
+        """
+        if depth < 1:
+            raise ValueError(f'A pyramid needs at least one level, got depth {depth}')
+        x, y = numpy.asarray(x, dtype='float64'), numpy.asarray(y, dtype='float64')
+        valid = ~(numpy.isnan(x) | numpy.isnan(y))
+        if values is not None:
+            values = numpy.asarray(values, dtype='float64')
+            valid &= ~numpy.isnan(values)
+            values = values[valid]
+        x, y = x[valid], y[valid]
+        x_extent, y_extent = _get_extent(x), _get_extent(y)
+        value_extent = _get_extent(values) if values is not None else None
+
+        resolution = cls.tile_size * 2 ** (depth - 1)
+        columns, rows = _to_pixels(x, x_extent, resolution), _to_pixels(y, y_extent, resolution)
+        finest = _aggregate(rows * resolution + columns, resolution, numpy.ones(len(x), dtype='int64'), values)
+        levels = [finest]
+        for _ in range(depth - 1):
+            levels.append(_merge_pixels(levels[-1]))
+        return cls(levels[::-1], x_extent, y_extent, value_extent)
+
+    @property
+    def depth(self) -> int:
+        return len(self.levels)
+
+    def get_max_count(self, level: int) -> int:
+        """ The most points in any pixel of a level, to color all of its tiles with the same density scale
+        """
+        counts = self.levels[level].counts
+        return int(counts.max()) if len(counts) > 0 else 0
+
+    def get_level(self, x_range: Extent, y_range: Extent, width: int, height: int) -> int:
+        """ The coarsest level that has at least as many pixels in the visible window as the plot has
+
+        Pixels are counted per area, since the window can be stretched along one axis compared to the pyramid.
+        """
+        x_share = (x_range[1] - x_range[0]) / (self.x_extent[1] - self.x_extent[0])
+        y_share = (y_range[1] - y_range[0]) / (self.y_extent[1] - self.y_extent[0])
+        for level in range(self.depth):
+            resolution = self.levels[level].resolution
+            if resolution ** 2 * x_share * y_share >= width * height:
+                return level
+        return self.depth - 1
+
+    def get_tile(self, level: int, index: TileIndex) -> Raster:
+        """ The pixels of one tile as a raster, found with one binary search per row of the tile
+        """
+        resolution, codes, counts, sums = self.levels[level]
+        tile_x, tile_y = index
+        rows = tile_y * self.tile_size + numpy.arange(self.tile_size)
+        row_starts = rows * resolution + tile_x * self.tile_size
+        starts = numpy.searchsorted(codes, row_starts)
+        ends = numpy.searchsorted(codes, row_starts + self.tile_size)
+
+        # the positions of the pixels of all rows, each row is one contiguous run of codes
+        lengths = ends - starts
+        offsets = numpy.cumsum(lengths) - lengths
+        positions = numpy.arange(lengths.sum()) + numpy.repeat(starts - offsets, lengths)
+        in_tile = numpy.repeat(numpy.arange(self.tile_size), lengths) * self.tile_size
+        in_tile += codes[positions] % resolution - tile_x * self.tile_size
+
+        shape = (self.tile_size, self.tile_size)
+        tile_counts = numpy.zeros(self.tile_size ** 2, dtype='int64')
+        tile_counts[in_tile] = counts[positions]
+        tile_sums = None
+        if sums is not None:
+            tile_sums = numpy.zeros(self.tile_size ** 2, dtype='float64')
+            tile_sums[in_tile] = sums[positions]
+            tile_sums = tile_sums.reshape(shape)
+        x_extent, y_extent = self.get_tile_extents(level, index)
+        return Raster(tile_counts.reshape(shape), tile_sums, x_extent, y_extent)
+
+    def get_tile_extents(self, level: int, index: TileIndex) -> Tuple[Extent, Extent]:
+        tiles = self.levels[level].resolution // self.tile_size
+        return _get_tile_extent(self.x_extent, tiles, index[0]), _get_tile_extent(self.y_extent, tiles, index[1])
+
+    def get_tiles(self, x_range: Extent, y_range: Extent, width: int, height: int) -> Tuple[int, List[Raster]]:
+        """ Returns the level for the visible window of width x height pixels and its non-empty tiles in the window
+        """
+        level = self.get_level(x_range, y_range, width, height)
+        tiles = self.levels[level].resolution // self.tile_size
+        x_tiles = _get_visible_tiles(self.x_extent, x_range, tiles)
+        y_tiles = _get_visible_tiles(self.y_extent, y_range, tiles)
+        rasters = [self.get_tile(level, (tile_x, tile_y)) for tile_y in y_tiles for tile_x in x_tiles]
+        return level, [raster for raster in rasters if raster.counts.any()]
+
+    def save(self, filename: str) -> None:
+        """ Stores all levels in one compressed .npz file, with 32 bit codes, counts and sums to keep it small
+
+        Sums are only used to color the pixels by their mean, for that single precision is enough.
+        """
+        arrays = {
+            'extents': numpy.array([self.x_extent, self.y_extent, self.value_extent or (numpy.nan, numpy.nan)]),
+            'resolutions': numpy.array([level.resolution for level in self.levels])
+        }
+        for i, level in enumerate(self.levels):
+            arrays[f'codes_{i}'] = level.codes.astype('uint32' if level.resolution <= 2 ** 16 else 'int64')
+            arrays[f'counts_{i}'] = level.counts.astype('uint32')
+            if level.sums is not None:
+                arrays[f'sums_{i}'] = level.sums.astype('float32')
+        numpy.savez_compressed(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename: str) -> 'TilePyramid':
+        with numpy.load(filename) as stored:
+            x_extent, y_extent, value_extent = (tuple(extent) for extent in stored['extents'])
+            levels = []
+            for i, resolution in enumerate(stored['resolutions']):
+                # searching in the codes is faster if they have the same type as the searched values
+                codes, counts = stored[f'codes_{i}'].astype('int64'), stored[f'counts_{i}'].astype('int64')
+                sums = stored[f'sums_{i}'].astype('float64') if f'sums_{i}' in stored.files else None
+                levels.append(Level(int(resolution), codes, counts, sums))
+        has_values = not numpy.isnan(value_extent[0])
+        return cls(levels, x_extent, y_extent, value_extent if has_values else None)
+
+    def __repr__(self):
+        pixels = sum(len(level.codes) for level in self.levels)
+        return f'<TilePyramid: {self.depth} levels with {pixels} non-empty pixels>'
+
+
+def _get_extent(values: numpy.ndarray) -> Extent:
+    if len(values) == 0:
+        return 0.0, 1.0
+    _min, _max = float(values.min()), float(values.max())
+    if _min == _max:
+        # a single value still gets a pixel in the middle of the extent
+        return _min - 0.5, _max + 0.5
+    return _min, _max
+
+
+def _to_pixels(values: numpy.ndarray, extent: Extent, resolution: int) -> numpy.ndarray:
+    pixels = ((values - extent[0]) / (extent[1] - extent[0]) * resolution).astype('int64')
+    # the max of the extent would be the first pixel after the last one
+    return numpy.clip(pixels, 0, resolution - 1)
+
+
+def _aggregate(
+        codes: numpy.ndarray,
+        resolution: int,
+        counts: numpy.ndarray,
+        sums: Optional[numpy.ndarray]
+) -> Level:
+    """ Adds up the counts and sums of all entries with the same code, the result is sorted by code
+    """
+    unique_codes, inverse = numpy.unique(codes, return_inverse=True)
+    merged_counts = numpy.bincount(inverse, weights=counts, minlength=len(unique_codes)).astype('int64')
+    merged_sums = numpy.bincount(inverse, weights=sums, minlength=len(unique_codes)) if sums is not None else None
+    return Level(resolution, unique_codes, merged_counts, merged_sums)
+
+
+def _merge_pixels(level: Level) -> Level:
+    resolution = level.resolution // 2
+    rows, columns = level.codes // level.resolution, level.codes % level.resolution
+    return _aggregate((rows // 2) * resolution + columns // 2, resolution, level.counts, level.sums)
+
+
+def _get_tile_extent(extent: Extent, tiles: int, index: int) -> Extent:
+    tile_width = (extent[1] - extent[0]) / tiles
+    return extent[0] + index * tile_width, extent[0] + (index + 1) * tile_width
+
+
+def _get_visible_tiles(extent: Extent, visible: Extent, tiles: int) -> range:
+    start = (visible[0] - extent[0]) / (extent[1] - extent[0]) * tiles
+    end = (visible[1] - extent[0]) / (extent[1] - extent[0]) * tiles
+    return range(max(int(numpy.floor(start)), 0), min(int(numpy.ceil(end)), tiles))
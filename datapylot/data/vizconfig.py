@@ -1,10 +1,16 @@
 from itertools import chain
-from typing import List, TypeVar, Optional, Iterable, Union, Type
+from typing import List, TypeVar, Optional, Iterable, Union, Type, TYPE_CHECKING
 
 from datapylot.data.attributes import Attribute, Dimension, Measure
+from datapylot.data.cost import CostEstimate, estimate_cost
+from datapylot.data.filters import Filter
 from datapylot.logger import log
 from datapylot.utils import unique_list, MarkType
 
+# static type analysis
+if TYPE_CHECKING:
+    from datapylot.data.datasource import Datasource
+
 Number = Union[int, float]
 T = TypeVar('T')
 
@@ -28,7 +34,8 @@ class VizConfig:
             rows: List[Attribute],
             color: Optional[Attribute],
             size: Optional[Attribute],
-            mark_type: MarkType
+            mark_type: MarkType,
+            filters: Optional[List[Filter]] = None
     ) -> None:
         # non-writeable properties to ensure lists don't get switched out
         self._columns = columns  # type: List[Attribute]
@@ -36,6 +43,7 @@ class VizConfig:
         self.color = color  # type: Optional[Attribute]
         self.size = size  # type: Optional[Attribute]
         self.mark_type = mark_type  # type: MarkType
+        self.filters = [] if filters is None else filters  # type: List[Filter]
         log(self, 'Initializing VizConfig')
 
     @classmethod
@@ -52,11 +60,33 @@ class VizConfig:
         color = _dict.get('color', None)
         size = _dict.get('size', None)
         mark_type = _dict.get('mark_type', MarkType.CIRCLE)
+        filters = _dict.get('filters', [])
 
-        vc = cls(columns, rows, color, size, mark_type)
+        vc = cls(columns, rows, color, size, mark_type, filters)
 
         return vc
 
+    def with_replaced(self, old: Attribute, new: Attribute) -> 'VizConfig':
+        """ Returns a copy of this config in which every occurrence of an attribute is replaced by another one
+        """
+
+        def swap(attr: Optional[Attribute]) -> Optional[Attribute]:
+            return new if attr == old else attr
+
+        columns = [swap(attr) for attr in self.columns]
+        rows = [swap(attr) for attr in self.rows]
+        return VizConfig(columns, rows, swap(self.color), swap(self.size), self.mark_type, self.filters)  # type: ignore
+
+    def with_filters(self, filters: List[Filter]) -> 'VizConfig':
+        """ Returns a copy of this config with other filters
+        """
+        return VizConfig(self.columns, self.rows, self.color, self.size, self.mark_type, filters)
+
+    def estimate_cost(self, datasource: 'Datasource') -> CostEstimate:
+        """ Predicts the amount of plots and glyphs and the payload size of this config, see cost.estimate_cost()
+        """
+        return estimate_cost(datasource, self)
+
     @property
     def columns(self) -> List[Attribute]:
         return self._columns
@@ -1,17 +1,20 @@
-from collections import defaultdict
-from itertools import chain
-from typing import Dict, List, Union, Iterable, Any
+from functools import reduce
+from operator import mul
+from typing import List, Optional, Union
 
+import numpy
 from numpy import number
-from pandas.core.groupby import DataFrameGroupBy
 
-from datapylot.data.attributes import Measure, Attribute
+from datapylot.data.attributes import DateDimension
+from datapylot.data.cost import CostEstimate, CostPolicy
+from datapylot.data.dateparts import choose_date_part
 from datapylot.data.datasource import Datasource
 from datapylot.data.vizconfig import VizConfig
-from datapylot.data_preparation.avp import AVP
+from datapylot.data_preparation.layout import GridLayout
 from datapylot.data_preparation.plotinfo import PlotInfo
-from datapylot.data_preparation.plotinfobuilder import PlotInfoBuilder
+from datapylot.data_preparation.query_plan import QueryPlan
 from datapylot.logger import log
+from datapylot.utils import GRID_WIDTH, GRID_HEIGHT
 
 Number = Union[int, float]
 
@@ -24,35 +27,52 @@ class Aggregator:
     plots that is relevant for laying out the plot (number of columns and rows, min/max values, etc)
     """
 
-    def __init__(self, datasource: Datasource, config: VizConfig) -> None:
+    # minimal horizontal space per time bucket for DateDimensions with automatic resolution
+    pixels_per_time_bucket = 4
+
+    def __init__(self, datasource: Datasource, config: VizConfig, policy: Optional[CostPolicy] = None) -> None:
         log(self, f'Initializing aggregator with {datasource} and {config}')
         self.datasource = datasource
+        # the config as requested, self.config additionally has all automatic resolutions and limits applied
+        self.requested_config = config
         self.config = config
+        # limits the size of the viz before any data is aggregated, see CostPolicy
+        self.policy = policy
 
         self.data = None  # type: List['PlotInfo']
+        self.plan = None  # type: Optional[QueryPlan]
+        self.layout = GridLayout([])
         self.ncols, self.nrows, self.x_min, self.x_max, self.y_min, self.y_max = (0, 0, 0, 0, 0, 0)
 
+    @property
+    def plot_width(self) -> int:
+        return int(GRID_WIDTH / max(self.ncols, 1))
+
+    @property
+    def plot_height(self) -> int:
+        return int(GRID_HEIGHT / max(self.nrows, 1))
+
     def is_in_first_column(self, plot_info: 'PlotInfo') -> bool:
-        return self.data.index(plot_info) % self.ncols == 0
+        return self.layout.is_in_first_column(plot_info)
 
     def is_in_first_row(self, plot_info: 'PlotInfo') -> bool:
-        return self.data.index(plot_info) < self.ncols
+        return self.layout.is_in_first_row(plot_info)
 
     def is_in_last_row(self, plot_info: 'PlotInfo') -> bool:
-        return self.data.index(plot_info) >= len(self.data) - self.ncols
+        return self.layout.is_in_last_row(plot_info)
 
     def is_in_center_top_column(self, plot_info: 'PlotInfo') -> bool:
-        return self.data.index(plot_info) == (self.ncols - 1) // 2
+        return self.layout.is_in_center_top_column(plot_info)
 
     def update_data(self) -> None:
         """ Main interface. Will update all the data of self.data based on the config and datasource
         """
         # TODO: Trigger refresh here once implementing observer pattern for vizconfigs
         log(self, 'Updating data')
-        raw_data = self._get_prepared_data()
-        log(self, f'Found a total of {len(raw_data.keys())} data sets')
-        prepared = self._get_assigned_data(raw_data)
-        final_data = PlotInfoBuilder.create_all_plotinfos(prepared, self.config)
+        self.config = self._prepare_config()
+        self.plan = QueryPlan.compile(self.datasource, self.config).optimize()
+        final_data = self.plan.execute()
+        log(self, f'Executed query plan:\n{self.plan.explain()}')
         self._update_data_attributes(final_data)
 
         log(self, f'Aggregator reports following bounds: ncols:{self.ncols}, nrows:{self.nrows}, x_min:{self.x_min}, \\'
@@ -60,14 +80,35 @@ class Aggregator:
 
         self.data = final_data
 
+    def explain(self) -> str:
+        """ Describes how the data for the config is computed, with actual row counts and timings once executed
+        """
+        if self.plan is None:
+            return QueryPlan.compile(self.datasource, self._prepare_config()).optimize().explain()
+        return self.plan.explain()
+
+    def estimate_cost(self) -> CostEstimate:
+        """ Predicts the amount of plots and glyphs and the payload size of the requested config
+        """
+        config = self._resolve_time_buckets(self.requested_config)
+        return config.estimate_cost(self.datasource)
+
+    def _prepare_config(self) -> VizConfig:
+        """ Resolves automatic time buckets and applies the cost policy to the requested config
+        """
+        config = self._resolve_time_buckets(self.requested_config)
+        if self.policy is not None:
+            config = self.policy.enforce(self.datasource, config)
+        return config
+
     # get meta-info
     def _update_data_attributes(self, data: List['PlotInfo']) -> None:
         """ Updates meta information about the data, such as:
 
         Amount of columns and rows and min/max values (including buffer for displaying) for X and Y axes
         """
-        self.ncols = self._calculate_ncols(data)
-        self.nrows = len(data) // max(self.ncols, 1)
+        self.layout = GridLayout(data)
+        self.ncols, self.nrows = self.layout.ncols, self.layout.nrows
         self._update_min_max_values(data, 'x')
         self._update_min_max_values(data, 'y')
         min_max = f'[x: ({self.x_min}/{self.x_max}) | y: ({self.y_min}/{self.y_max})]'
@@ -78,14 +119,19 @@ class Aggregator:
         """
 
         _min_attr, _max_attr = f'{axis}_min', f'{axis}_max'
-        vals = [avp.val for pi in data for avp in getattr(pi, f'{axis}_coords')]
+        coords = [getattr(pi, f'{axis}_coords') for pi in data]
+        coords = [c for c in coords if len(c) > 0]
+        vals = numpy.concatenate(coords) if len(coords) > 0 else numpy.array([])
+        if numpy.issubdtype(vals.dtype, numpy.floating):
+            # measures without any value (eg. the mean of no rows) are NaN and have no position
+            vals = vals[~numpy.isnan(vals)]
         if len(vals) == 0:
             # This happens when there are no x_coords, such as for 0d0m_.... configurations
             setattr(self, _min_attr, None)
             setattr(self, _max_attr, None)
         else:
-            setattr(self, _min_attr, min(vals))
-            setattr(self, _max_attr, max(vals))
+            setattr(self, _min_attr, vals.min())
+            setattr(self, _max_attr, vals.max())
 
         # add some buffer for number varlues so the drawing looks better
         if isinstance(getattr(self, _min_attr), number):
@@ -100,47 +146,45 @@ class Aggregator:
                 # since the previous range difference & buffer is 0, add some buffer again
                 setattr(self, _max_attr, curr_max + (curr_max * 0.1))
 
-    def _calculate_ncols(self, data: List['PlotInfo']) -> int:
-        column_possibilities = []
-        for avp in data[0].x_seps:
-            possibilities = len(self.datasource.get_variations_of(avp.attr))
-            column_possibilities.append(possibilities)
-        ncols = sum(column_possibilities)
-        return max(ncols, 1)
-
-    # prepare data
-    def _get_assigned_data(self, data: Dict[Iterable[str], List[Number]]) -> List[List[AVP]]:
-        out = []
-        for key_tuple, val_list in data.items():
-            dims_and_measures: Iterable[Attribute] = chain(self.config.dimensions, self.config.measures)
-            # FIXME check typing here
-            keys_and_vals: Iterable[Any] = chain(key_tuple, val_list)
-            vals = [AVP(a, v) for a, v in zip(dims_and_measures, keys_and_vals)]
-            out.append(vals)
-        return out
-
-    def _get_prepared_data(self) -> Dict[Iterable[str], List[Number]]:
-        """ Returns a filtered and aggregated view on the data"""
-        dimensions, measures = self.config.dimensions, self.config.measures
-        grouped_data = self.datasource.group_by(dimensions)
-        out: Dict[Iterable[str], List[Number]] = defaultdict(list)  # using defaultdict to just append any measure
-        for measure in measures:
-            aggregated_data = self._get_measure_data(grouped_data, measure)
-            for key_tuple, value in aggregated_data.items():
-                # for 0d0m-configurations, key_tuple may be a string instead of a tuple -> normalize to tuple
-                if isinstance(key_tuple, str):
-                    key_tuple = (key_tuple,)
-                # for 0-Dimension-total configurations, key_tuple may be a bool (thats how panda does it)
-                # FIXME not working currently - need to find a way to deal with a missing
-                # FIXME y- or x-coord on a higher level and adapt here to reflect this
-                if isinstance(key_tuple, bool):
-                    key_tuple = tuple()
-                out[key_tuple].append(value)
-        return out
-
-    def _get_measure_data(self, data: DataFrameGroupBy, measure: Measure) -> Dict[Iterable[str], int]:
-        """ Helper for _get_prepared_data()"""
-        # TODO: is the return type maybe Dict[Union[Tuple[str], str, bool], int] ?? bool in case of no aggregation
-        grouped_measure = data[measure.col_name]
-        aggregated_data = getattr(grouped_measure, measure.aggregation)()  # is a pandas object
-        return aggregated_data.to_dict()
+    def _estimate_ncols(self, config: VizConfig) -> int:
+        """ The amount of columns if every combination of the x separators occurs, before any data is aggregated
+        """
+        col_possibilities = [len(self.datasource.get_variations_of(attr)) for attr in config.x_separators]
+        return max(reduce(mul, col_possibilities, 1), 1)
+
+    def _estimate_nrows(self, config: VizConfig) -> int:
+        row_possibilities = [len(self.datasource.get_variations_of(attr)) for attr in config.y_separators]
+        return max(reduce(mul, row_possibilities, 1), 1)
+
+    # automatic time resolution
+    def _resolve_time_buckets(self, config: VizConfig) -> VizConfig:
+        """ Replaces every DateDimension with automatic resolution by one with a fixed date part
+
+        The part is chosen so that the amount of time buckets fits into the pixels of the axis the dimension
+        is drawn on, which bounds the amount of groups no matter how wide the date range is.
+        Dimensions that are not drawn on an axis (separators, colors, sizes) get the space of the whole grid.
+        """
+        auto_dims = [dim for dim in config.dimensions if isinstance(dim, DateDimension) and dim.is_auto]
+        if len(auto_dims) == 0:
+            return config
+
+        # separators must be resolved first as they decide into how many plots the grid is split
+        axis_dims = config.columns[-1:] + config.rows[-1:]
+        for dim in auto_dims:
+            if dim not in axis_dims:
+                config = config.with_replaced(dim, self._resolve_date_dimension(dim, GRID_WIDTH))
+
+        plot_width = GRID_WIDTH / self._estimate_ncols(config)
+        plot_height = GRID_HEIGHT / self._estimate_nrows(config)
+        for dim in auto_dims:
+            if dim in config.columns[-1:]:
+                config = config.with_replaced(dim, self._resolve_date_dimension(dim, plot_width))
+            elif dim in config.rows[-1:]:
+                config = config.with_replaced(dim, self._resolve_date_dimension(dim, plot_height))
+        log(self, f'Resolved automatic time buckets of {auto_dims} to {config.dimensions}')
+        return config
+
+    def _resolve_date_dimension(self, dimension: DateDimension, pixels: float) -> DateDimension:
+        stats = self.datasource.get_statistics(dimension.source_col)
+        max_buckets = max(int(pixels / self.pixels_per_time_bucket), 1)
+        return dimension.with_part(choose_date_part(stats.min, stats.max, max_buckets))
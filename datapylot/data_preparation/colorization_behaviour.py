@@ -1,10 +1,10 @@
-from itertools import chain, cycle
-from typing import List, Any, Generator, TYPE_CHECKING
+from typing import List, Optional, TYPE_CHECKING
+
+import numpy
 
 from datapylot.data.attributes import Measure, Dimension
-from datapylot.data_preparation.avp import AVP
-from datapylot.data_preparation.colorizer import DEFAULT_COLOR, ALL_COLORS, adjust_brightness
-from datapylot.utils import reverse_lerp
+from datapylot.data_preparation.colorizer import DEFAULT_COLOR, ALL_COLORS, DEFAULT_RAMP, RAMPS, ColorRamp
+from datapylot.data_preparation.scales import Scale, LinearScale, OrdinalScale
 
 # static type analysis
 if TYPE_CHECKING:
@@ -20,6 +20,8 @@ class ColorizationBehaviour:
         self.vizconfig = vizconfig
         # needed in order to find the min/max ranges for measures and provide consistent colors for dimensions
         self.all_plotinfos = all_plotinfos
+        # maps color values to colors, computed once for all plots, see fit()
+        self.scale = None  # type: Optional[Scale]
 
     @staticmethod
     def get_correct_behaviour(vizconfig: 'VizConfig', all_plotinfos: List['PlotInfo']) -> 'ColorizationBehaviour':
@@ -51,11 +53,29 @@ class ColorizationBehaviour:
         else:
             assert False
 
-    def get_colors(self, plot_info: 'PlotInfo') -> List['AVP']:
+    def get_colors(self, plot_info: 'PlotInfo') -> numpy.ndarray:
         """ Will raise NotImplementedError to remind you to overwrite it in subclasses
         """
         raise NotImplementedError('get_colors() is only available in subclasses of ColorizationBehaviour')
 
+    def fit(self, values: numpy.ndarray) -> None:
+        """ Computes the scale from the color values of all plots, it is then shared by all of them
+        """
+        self.scale = self._make_scale(values)
+
+    def get_scale(self) -> Scale:
+        """ Returns the scale, fits it to the values of all plots first if that didn't happen yet
+        """
+        if self.scale is None:
+            color = self.vizconfig.color
+            self.fit(numpy.concatenate([pi.get_values(color) for pi in self.all_plotinfos]))
+        return self.scale
+
+    def _make_scale(self, values: numpy.ndarray) -> Scale:
+        """ Will raise NotImplementedError to remind you to overwrite it in subclasses
+        """
+        raise NotImplementedError('_make_scale() is only available in subclasses of ColorizationBehaviour')
+
     def __repr__(self):
         return f'{type(self).__name__}'
 
@@ -64,37 +84,25 @@ class NoColorColorizationBehaviour(ColorizationBehaviour):
     """ Colorization strategy for cases where no color at all is supplied in the configuration
     """
 
-    def get_colors(self, plot_info: 'PlotInfo') -> List['AVP']:
-        """ Will return a list of default colors matching the amount of glyphs
+    def get_colors(self, plot_info: 'PlotInfo') -> numpy.ndarray:
+        """ Will return an array of default colors matching the amount of glyphs
         """
-        # for 0d0m-configurations, the lengths of axes might differ
-        longest_axes = max(len(plot_info.x_coords), len(plot_info.y_coords))
-        return [AVP('Default Color', DEFAULT_COLOR)] * longest_axes
+        return numpy.full(plot_info.glyph_count, DEFAULT_COLOR, dtype=object)
 
 
 class ExistingDimensionColorizationBehaviour(ColorizationBehaviour):
     """ If the color is an already existing dimension, it will work straight forward and color every glyph
     """
 
-    def get_colors(self, plot_info: 'PlotInfo') -> List['AVP']:
-        """ Find all possible values that are in any plot of the screen
+    def get_colors(self, plot_info: 'PlotInfo') -> numpy.ndarray:
+        """ Looks up the color of every value, separators have the same value for all glyphs of the plot
         """
-        # find the variations of the dimensions value
-        conf_color = self.vizconfig.color
-        variations = [pi.variations_of(conf_color) for pi in self.all_plotinfos]
-        possible_vals = sorted(set(chain(*variations)))
-        attribute_vals = [avp.val for avp in plot_info.find_attributes(conf_color)]
-
-        # if this dimension is a plot separator, there might only be one value -> extend the list to match the amount
-        amount = len(plot_info.get_coord_values('x'))
-        if len(attribute_vals) < amount:
-            assert len(attribute_vals) == 1
-            attribute_vals *= amount
-
-        # create a avp with (Attribute, hex_of_color) for each value
-        avps = [AVP(conf_color, ALL_COLORS[possible_vals.index(curr_val)]) for curr_val in attribute_vals]
+        return self.get_scale()(plot_info.get_values(self.vizconfig.color))
 
-        return avps
+    def _make_scale(self, values: numpy.ndarray) -> Scale:
+        """ Every possible value that is in any plot of the screen gets its own color
+        """
+        return OrdinalScale(values, ALL_COLORS)
 
 
 class NewDimensionColorizationBehaviour(ColorizationBehaviour):
@@ -103,19 +111,15 @@ class NewDimensionColorizationBehaviour(ColorizationBehaviour):
     This strategy class will deal wit hthose cases
     """
 
-    def get_colors(self, plot_info: 'PlotInfo') -> List['AVP']:
-        # TODO FIXME: Need to consider ALL data in ALL plots here
-        # TODO FIXME: Do we need sorting here to ensure dimensions are colored the same?
-        color_data = plot_info.find_attributes(self.vizconfig.color)
+    def get_colors(self, plot_info: 'PlotInfo') -> numpy.ndarray:
+        color_data = plot_info.get_values(self.vizconfig.color)
         assert len(color_data) == len(plot_info.get_coord_values('x'))
-        return list(self.get_colors_for_color_separators(color_data))
+        return self.get_scale()(color_data)
 
-    @staticmethod
-    def get_colors_for_color_separators(col_seps: List['AVP']) -> Generator[AVP, None, None]:
-        all_values = set(avp.val for avp in col_seps)
-        val_to_color = dict(zip(all_values, cycle(ALL_COLORS)))
-        for avp in col_seps:
-            yield AVP(avp.attr, val_to_color[avp.val])
+    def _make_scale(self, values: numpy.ndarray) -> Scale:
+        """ The scale covers the values of all plots, so a value has the same color in every plot
+        """
+        return OrdinalScale(values, ALL_COLORS)
 
 
 class MeasureColorizationBehaviour(ColorizationBehaviour):
@@ -124,25 +128,31 @@ class MeasureColorizationBehaviour(ColorizationBehaviour):
     In those cases, it doesn't make a difference if the measure is already somewhere else on the plot.
     """
 
-    def get_colors(self, plot_info: 'PlotInfo') -> List['AVP']:
-        """ Find all possible values that are in any plot of the screen
+    # name of the color ramp (see colorizer.RAMPS) that the values are mapped to
+    ramp_name = DEFAULT_RAMP
+
+    @property
+    def ramp(self) -> ColorRamp:
+        return RAMPS[self.ramp_name]
+
+    def get_colors(self, plot_info: 'PlotInfo') -> numpy.ndarray:
+        """ Looks up the color of every value in the color ramp, based on the values of all plots of the screen
         """
-        conf_color = self.vizconfig.color
-        variations = [pi.variations_of(conf_color) for pi in self.all_plotinfos]
-        possible_vals = sorted(set(chain(*variations)))
-        # might have the same measure twice (1m/1m configs), so we need to filter that out
-        attributes = list(plot_info.find_attributes(conf_color))  # TODO set?
-        attribute_vals = [avp.val for avp in attributes]
-        # create a avp with (Attribute, hex_of_color) for each value
-        avps = [self._get_color_data(curr_val, possible_vals) for curr_val in attribute_vals]
-        return avps
-
-    def _get_color_data(self, curr_val: Any, possible_vals: List[Any]) -> AVP:
-        """ Reverse-lerp's a color value based on the possible values
+        return self.ramp(self.get_scale()(plot_info.get_values(self.vizconfig.color)))
+
+    def get_color_indices(self, plot_info: 'PlotInfo') -> numpy.ndarray:
+        """ Returns the position of every color in the palette of the ramp instead of the color itself
+
+        Used together with a color mapper on the client side, which then only needs the palette once.
+        """
+        return self.ramp.get_indices(self.get_scale()(plot_info.get_values(self.vizconfig.color)))
+
+    def _make_scale(self, values: numpy.ndarray) -> Scale:
+        """ Turns the values into their position between the smallest (0) and the largest (1) value
+
+        Diverging ramps are centered on zero instead, so positive and negative values get different colors.
         """
-        relative_in_range = reverse_lerp(curr_val, possible_vals)  # between 0 and 1
-        # turn into value from -0.5 and 0.5 with 0.5 for the smallest values
-        color_saturation = (relative_in_range - 0.5) * -1
-        color = adjust_brightness(DEFAULT_COLOR, color_saturation)
-        color_avp = AVP(self.vizconfig.color, color)
-        return color_avp
+        if self.ramp.kind == 'diverging':
+            limit = float(numpy.nanmax(numpy.abs(numpy.asarray(values, dtype='float64'))))
+            return LinearScale(-limit, limit, 0, 1)
+        return LinearScale.from_values(values, 0, 1)
@@ -1,4 +1,6 @@
-from typing import Tuple, Union
+from typing import List, Optional, Tuple, Union
+
+import numpy
 
 Number = Union[int, float]
 
@@ -38,3 +40,83 @@ def to_rgb(color: str) -> Tuple[int, int, int]:
 
 def to_valid_rgb_range(color: Number) -> int:
     return int(max(min(color, 255), 0))
+
+
+# amount of precomputed colors per ramp, values are quantized to one of them
+RAMP_STEPS = 256
+
+
+class ColorRamp:
+    """ A lookup table of colors that continuous values (between 0 and 1) are mapped to
+
+    All colors are computed once when the ramp is created, mapping values to colors is then
+    a single vectorized quantize-and-index operation. Sequential ramps go from low to high values,
+    diverging ramps have a neutral color in the middle and should be used for values around zero.
+    """
+
+    KINDS = ('sequential', 'diverging')
+
+    def __init__(self, name: str, palette: List[str], kind: str = 'sequential') -> None:
+        if kind not in self.KINDS:
+            raise ValueError(f'Unknown kind {kind}, must be one of {self.KINDS}')
+        self.name = name
+        self.kind = kind
+        self.palette = palette
+        self._colors = numpy.array(palette, dtype=object)
+        self._rgba = None  # type: Optional[numpy.ndarray]
+
+    @classmethod
+    def from_anchors(cls, name: str, anchors: List[str], kind: str = 'sequential',
+                     steps: int = RAMP_STEPS) -> 'ColorRamp':
+        """ Creates a ramp that interpolates evenly between the anchor colors
+        """
+        rgb = numpy.array([to_rgb(anchor) for anchor in anchors], dtype='float64')
+        positions = numpy.linspace(0, 1, len(anchors))
+        steps_at = numpy.linspace(0, 1, steps)
+        channels = [numpy.interp(steps_at, positions, rgb[:, channel]) for channel in range(3)]
+        palette = [to_hex(*(to_valid_rgb_range(round(c)) for c in color)) for color in zip(*channels)]
+        return cls(name, palette, kind)
+
+    @classmethod
+    def from_brightness(cls, name: str, color: str, start: float, end: float, steps: int = RAMP_STEPS) -> 'ColorRamp':
+        """ Creates a ramp that adjusts the brightness of a single color, see adjust_brightness()
+        """
+        return cls(name, [adjust_brightness(color, amount) for amount in numpy.linspace(start, end, steps)])
+
+    def get_indices(self, relative: numpy.ndarray) -> numpy.ndarray:
+        """ Quantizes values between 0 and 1 to the index of their color in the palette, missing values get 0
+        """
+        scaled = numpy.asarray(relative, dtype='float64') * (len(self.palette) - 1)
+        scaled[numpy.isnan(scaled)] = 0
+        numpy.clip(scaled, 0, len(self.palette) - 1, out=scaled)
+        # rounds to the nearest step, all values are positive
+        scaled += 0.5
+        return scaled.astype('int64')
+
+    def get_rgba(self, relative: numpy.ndarray) -> numpy.ndarray:
+        """ Like calling the ramp, but returns every color packed into one uint32 (as used by bokeh's ImageRGBA)
+
+        Missing values become fully transparent instead of getting the first color.
+        """
+        if self._rgba is None:
+            rgba = numpy.array([to_rgb(color) + (255,) for color in self.palette], dtype='uint8')
+            self._rgba = rgba.view('uint32').ravel()
+        relative = numpy.asarray(relative, dtype='float64')
+        return numpy.where(numpy.isnan(relative), numpy.uint32(0), self._rgba[self.get_indices(relative)])
+
+    def __call__(self, relative: numpy.ndarray) -> numpy.ndarray:
+        return self._colors[self.get_indices(relative)]
+
+    def __repr__(self):
+        return f'<ColorRamp: {self.name} ({self.kind}, {len(self.palette)} colors)>'
+
+
+RAMPS = {ramp.name: ramp for ramp in [
+    # the default: lighter for small values, darker for large values
+    ColorRamp.from_brightness('brightness', DEFAULT_COLOR, 0.5, -0.5),
+    ColorRamp.from_anchors('blues', ['#f7fbff', '#6baed6', '#08306b']),
+    ColorRamp.from_anchors('viridis', ['#440154', '#3b528b', '#21908d', '#5dc963', '#fde725']),
+    ColorRamp.from_anchors('red_blue', ['#b2182b', '#f7f7f7', '#2166ac'], 'diverging'),
+    ColorRamp.from_anchors('purple_green', ['#762a83', '#f7f7f7', '#1b7837'], 'diverging'),
+]}
+DEFAULT_RAMP = 'brightness'
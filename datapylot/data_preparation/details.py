@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy
+import pandas
+
+from datapylot.data.datasource import Datasource, group_observed
+from datapylot.data.vizconfig import VizConfig
+from datapylot.data_preparation.query_plan import QueryPlan
+from datapylot.logger import log
+
+# the name of the amount of underlying rows in the details of a point
+ROWS_LABEL = 'Number of records'
+
+
+class PointDetails:
+    """ The values of all dimensions and measures of every point of a viz, for tooltips that are loaded on hover
+
+    Points are the positions of the groups in the aggregated data (see PlotInfo.points), so the sources of
+    the plots only need to send one integer per glyph, no matter how much a tooltip shows. The config must
+    be the one the viz was created from after the cost policy was applied (Aggregator.config), otherwise the
+    points would refer to other groups. The aggregates are taken from the cache of the datasource where possible.
+    """
+
+    def __init__(self, datasource: Datasource, config: VizConfig) -> None:
+        self.datasource = datasource
+        self.config = config
+        self.columns = QueryPlan.compile(datasource, config).optimize().execute_aggregation()
+        self.length = len(next(iter(self.columns.values()))) if len(self.columns) > 0 else 0
+        # the amount of rows per group, only counted once the first point is requested
+        self._rows = None  # type: Optional[pandas.Series]
+
+    def get(self, point: int) -> Dict[str, Any]:
+        """ Returns the values of a point by their column name, including the amount of its underlying rows
+        """
+        if not 0 <= point < self.length:
+            raise ValueError(f'There is no point {point}, the viz has {self.length} points')
+        details = OrderedDict((attribute.col_name, _to_python(values[point]))
+                              for attribute, values in self.columns.items())
+        details[ROWS_LABEL] = int(self._get_rows().iloc[self._get_group(point)])
+        return details
+
+    def _get_group(self, point: int) -> int:
+        dimensions = self.config.dimensions
+        if len(dimensions) == 0:
+            return 0
+        key = tuple(self.columns[dimension][point] for dimension in dimensions)
+        return self._get_rows().index.get_loc(key[0] if len(key) == 1 else key)
+
+    def _get_rows(self) -> pandas.Series:
+        if self._rows is None:
+            log(self, f'Counting the rows of {self.length} points')
+            dimensions = self.config.dimensions
+            rows = None
+            if len(self.config.filters) > 0:
+                rows = self.datasource.get_filter_mask(self.config.filters)
+            if len(dimensions) == 0:
+                count = len(self.datasource.data) if rows is None else int(rows.sum())
+                self._rows = pandas.Series([count])
+            else:
+                frame = self.datasource.project(dimensions, rows)
+                self._rows = group_observed(frame, [d.col_name for d in dimensions]).size()
+        return self._rows
+
+
+def _to_python(value: Any) -> Any:
+    """ Details are sent as json, which needs plain python values instead of numpy scalars
+    """
+    if isinstance(value, float) and numpy.isnan(value):
+        return None
+    if isinstance(value, (numpy.datetime64, pandas.Timestamp)):
+        return pandas.Timestamp(value).isoformat()
+    if isinstance(value, numpy.generic):
+        return _to_python(value.item())
+    return value
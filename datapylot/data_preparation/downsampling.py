@@ -0,0 +1,73 @@
+from typing import Callable, Dict
+
+import numpy
+
+# takes the x and y values of a line and the maximal amount of points, returns the positions of the points to keep
+Downsampler = Callable[[numpy.ndarray, numpy.ndarray, int], numpy.ndarray]
+
+
+def lttb(x: numpy.ndarray, y: numpy.ndarray, amount: int) -> numpy.ndarray:
+    """ Largest-Triangle-Three-Buckets: keeps the points that best preserve the visual shape of a line
+
+    The first and last point are always kept. All other points are split into amount - 2 buckets of
+    (almost) equal size, from each the point is kept that forms the largest triangle with the point kept
+    from the previous bucket and the average of the next bucket.
+    """
+    length = len(x)
+    if amount >= length or amount < 3:
+        return numpy.arange(length)
+    x, y = numpy.asarray(x, dtype='float64'), numpy.asarray(y, dtype='float64')
+
+    # bucket i contains the points edges[i]:edges[i + 1], the last "bucket" is the last point
+    edges = numpy.append(numpy.linspace(1, length - 1, amount - 1).astype('int64'), length)
+    ends = edges[2:]
+    starts = edges[1:-1]
+    sums_x, sums_y = numpy.add.reduceat(x, starts), numpy.add.reduceat(y, starts)
+    average_x, average_y = sums_x / (ends - starts), sums_y / (ends - starts)
+
+    kept = numpy.empty(amount, dtype='int64')
+    kept[0], kept[-1] = 0, length - 1
+    previous = 0
+    for i in range(amount - 2):
+        bucket = slice(edges[i], edges[i + 1])
+        # twice the area of the triangle, the factor doesn't matter for finding the largest
+        areas = numpy.abs((x[previous] - average_x[i]) * (y[bucket] - y[previous]) -
+                          (x[previous] - x[bucket]) * (average_y[i] - y[previous]))
+        previous = edges[i] + int(numpy.nanargmax(areas)) if not numpy.isnan(areas).all() else edges[i]
+        kept[i + 1] = previous
+    return kept
+
+
+def min_max(x: numpy.ndarray, y: numpy.ndarray, amount: int) -> numpy.ndarray:
+    """ Splits the range of x into amount / 2 buckets of equal width and keeps the lowest and highest point of each
+
+    With one bucket per pixel, the line is drawn the same as with all points, including every spike.
+    The first and last point are always kept.
+    """
+    length = len(x)
+    buckets = amount // 2
+    if amount >= length or buckets < 1:
+        return numpy.arange(length)
+    x, y = numpy.asarray(x, dtype='float64'), numpy.asarray(y, dtype='float64')
+
+    x_min, x_max = x.min(), x.max()
+    if x_max > x_min:
+        bucket_ids = ((x - x_min) / (x_max - x_min) * buckets).astype('int64')
+    else:
+        bucket_ids = numpy.zeros(length, dtype='int64')
+    bucket_ids = numpy.clip(bucket_ids, 0, buckets - 1)
+
+    # sorted by bucket and then by y, so every bucket starts with its lowest and ends with its highest point
+    valid = numpy.flatnonzero(~numpy.isnan(y))
+    order = valid[numpy.lexsort((y[valid], bucket_ids[valid]))]
+    sorted_ids = bucket_ids[order]
+    is_first = numpy.append(True, sorted_ids[1:] != sorted_ids[:-1])
+    is_last = numpy.append(sorted_ids[1:] != sorted_ids[:-1], True)
+    kept = numpy.concatenate([[0, length - 1], order[is_first], order[is_last]])
+    return numpy.unique(kept)
+
+
+DOWNSAMPLERS: Dict[str, Downsampler] = {
+    'lttb': lttb,
+    'min_max': min_max
+}
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Optional
+
+import numpy
+import pandas
+
+from datapylot.data.datasource import Datasource
+from datapylot.data.vizconfig import VizConfig
+from datapylot.data_preparation.query_plan import QueryPlan
+from datapylot.logger import log
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# rows per chunk, only one chunk of rows is copied and encoded at a time
+CHUNK_ROWS = 50000
+
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+
+
+def export_aggregates(
+        datasource: Datasource,
+        config: VizConfig,
+        export_format: str = 'csv',
+        chunk_rows: int = CHUNK_ROWS
+) -> Iterator[bytes]:
+    """ Returns a generator of the encoded chunks of the aggregated data of a viz, one row per group
+
+    The columns are the dimensions and measures of the config, sliced directly from the aggregated arrays
+    without creating plots. Nothing is aggregated before the first chunk is requested.
+    """
+    encode = _get_encoder(export_format)
+
+    def chunks() -> Iterator[pandas.DataFrame]:
+        columns = QueryPlan.compile(datasource, config).optimize().execute_aggregation()
+        names = [attribute.col_name for attribute in columns]
+        arrays = list(columns.values())
+        length = len(arrays[0]) if len(arrays) > 0 else 0
+        log('export', f'Exporting {length} aggregated rows of {config}')
+        for start in _get_chunk_starts(length, chunk_rows):
+            yield pandas.DataFrame(OrderedDict(
+                (name, values[start:start + chunk_rows]) for name, values in zip(names, arrays)
+            ), columns=names)
+
+    return encode(chunks())
+
+
+def export_rows(
+        datasource: Datasource,
+        config: VizConfig,
+        export_format: str = 'csv',
+        chunk_rows: int = CHUNK_ROWS
+) -> Iterator[bytes]:
+    """ Returns a generator of the encoded chunks of all rows of the datasource that pass the filters of the config
+    """
+    encode = _get_encoder(export_format)
+
+    def chunks() -> Iterator[pandas.DataFrame]:
+        data = datasource.data
+        positions = None  # type: Optional[numpy.ndarray]
+        if len(config.filters) > 0:
+            positions = numpy.flatnonzero(datasource.get_filter_mask(config.filters))
+        length = len(data) if positions is None else len(positions)
+        log('export', f'Exporting {length} rows of {config}')
+        for start in _get_chunk_starts(length, chunk_rows):
+            if positions is None:
+                yield data.iloc[start:start + chunk_rows]
+            else:
+                yield data.iloc[positions[start:start + chunk_rows]]
+
+    return encode(chunks())
+
+
+def _get_chunk_starts(length: int, chunk_rows: int) -> range:
+    # an empty export still has one (empty) chunk, so the header or schema is written
+    return range(0, max(length, 1), chunk_rows)
+
+
+def _get_encoder(export_format: str) -> Callable[[Iterator[pandas.DataFrame]], Iterator[bytes]]:
+    """ Checks the format before anything is exported, so the caller can report errors before streaming
+    """
+    if export_format not in MIME_TYPES:
+        raise ValueError(f'Unknown export format {export_format}, must be one of {list(MIME_TYPES)}')
+    if export_format == 'arrow' and pyarrow is None:
+        raise ValueError('Exporting to arrow needs pyarrow, which is not installed')
+    return _encode_csv if export_format == 'csv' else _encode_arrow
+
+
+def _encode_csv(chunks: Iterator[pandas.DataFrame]) -> Iterator[bytes]:
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header).encode('utf-8')
+        header = False
+
+
+class _ChunkSink:
+    """ A file for the arrow writer that keeps the written bytes until they are taken
+    """
+
+    def __init__(self) -> None:
+        self.parts = []  # type: List[bytes]
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+
+def _encode_arrow(chunks: Iterator[pandas.DataFrame]) -> Iterator[bytes]:
+    """ Encodes the chunks as record batches of one arrow IPC stream
+    """
+    sink = _ChunkSink()
+    writer = None
+    for chunk in chunks:
+        batch = pyarrow.RecordBatch.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.RecordBatchStreamWriter(sink, batch.schema)
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from datapylot.data_preparation.plotinfo import PlotInfo
+
+SeparatorKey = Tuple[Any, ...]
+
+
+class GridLayout:
+    """ The position of every plot in the grid, computed once from the separator values of the plots
+
+    Columns are the combinations of x separator values and rows the combinations of y separator values
+    that actually occur in the data. Combinations without data are skipped, so nested separators
+    (eg. cities within states) don't create a column for every city in every state. Grid cells that
+    have a row and a column but no data stay empty.
+    """
+
+    def __init__(self, data: Sequence[PlotInfo]) -> None:
+        self.col_keys = _order_keys([_get_key(pi.x_seps) for pi in data])
+        self.row_keys = _order_keys([_get_key(pi.y_seps) for pi in data])
+        col_positions = {key: i for i, key in enumerate(self.col_keys)}
+        row_positions = {key: i for i, key in enumerate(self.row_keys)}
+
+        # plot infos don't define equality, so they are looked up by identity
+        self._positions: Dict[int, Tuple[int, int]] = {}
+        self.cells: List[List[Optional[PlotInfo]]] = [[None] * self.ncols for _ in range(self.nrows)]
+        for plot_info in data:
+            row, col = row_positions[_get_key(plot_info.y_seps)], col_positions[_get_key(plot_info.x_seps)]
+            assert self.cells[row][col] is None, f'{plot_info} has the same separators as {self.cells[row][col]}'
+            self.cells[row][col] = plot_info
+            self._positions[id(plot_info)] = (row, col)
+
+        # the outermost plots of every row and column, which get the labels and axes in sparse grids
+        self._first_col_of_row = [_first_filled(row) for row in self.cells]
+        columns = [[row[col] for row in self.cells] for col in range(self.ncols)]
+        self._first_row_of_col = [_first_filled(column) for column in columns]
+        self._last_row_of_col = [len(column) - 1 - _first_filled(column[::-1]) for column in columns]
+
+    @property
+    def ncols(self) -> int:
+        return len(self.col_keys)
+
+    @property
+    def nrows(self) -> int:
+        return len(self.row_keys)
+
+    def get_position(self, plot_info: PlotInfo) -> Tuple[int, int]:
+        """ Returns the (row, col) of a plot, raises a KeyError for plots that are not part of the grid
+        """
+        try:
+            return self._positions[id(plot_info)]
+        except KeyError:
+            raise KeyError(f'{plot_info} is not part of {self}')
+
+    def is_in_first_column(self, plot_info: PlotInfo) -> bool:
+        row, col = self.get_position(plot_info)
+        return col == self._first_col_of_row[row]
+
+    def is_in_first_row(self, plot_info: PlotInfo) -> bool:
+        row, col = self.get_position(plot_info)
+        return row == self._first_row_of_col[col]
+
+    def is_in_last_row(self, plot_info: PlotInfo) -> bool:
+        row, col = self.get_position(plot_info)
+        return row == self._last_row_of_col[col]
+
+    def is_in_center_top_column(self, plot_info: PlotInfo) -> bool:
+        row, col = self.get_position(plot_info)
+        center = (self.ncols - 1) // 2
+        return col == center and row == self._first_row_of_col[center]
+
+    def get_rows(self, start: int, stop: int) -> List[PlotInfo]:
+        """ Returns the plots of the rows start to stop (exclusive), row by row
+        """
+        return [plot_info for row in self.cells[start:stop] for plot_info in row if plot_info is not None]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ The size of the grid and the labels of its rows and columns, for clients that only get some rows
+        """
+        return {
+            'nrows': self.nrows,
+            'ncols': self.ncols,
+            'row_keys': [[str(value) for value in key] for key in self.row_keys],
+            'col_keys': [[str(value) for value in key] for key in self.col_keys]
+        }
+
+    def __repr__(self):
+        filled = len(self._positions)
+        return f'<GridLayout: {self.nrows} rows, {self.ncols} cols, {filled} plots>'
+
+
+def _get_key(separators: Sequence[Any]) -> SeparatorKey:
+    return tuple(avp.val for avp in separators)
+
+
+def _order_keys(keys: List[SeparatorKey]) -> List[SeparatorKey]:
+    """ Returns the distinct keys, sorted by their values like the plots are sorted by PlotInfoBuilder
+    """
+    unique_keys = list(OrderedDict.fromkeys(keys))
+    try:
+        return sorted(unique_keys, key=lambda key: key[::-1])
+    except TypeError:
+        # mixed types can't be sorted, keep the order in which they occur
+        return unique_keys
+
+
+def _first_filled(cells: Sequence[Optional[PlotInfo]]) -> int:
+    return next(i for i, cell in enumerate(cells) if cell is not None)
@@ -1,5 +1,7 @@
-from itertools import chain
-from typing import Dict, List, Any
+from typing import Collection, Dict, List, Optional
+
+import numpy
+import pandas
 
 from datapylot.data.attributes import Attribute
 from datapylot.data_preparation.avp import AVP
@@ -11,19 +13,35 @@ DEFAULT_AVP = AVP(Attribute(''), '')
 
 
 class PlotInfo:
+    """ The data of a single plot of the grid
+
+    Every attribute that varies between the glyphs of the plot is stored as one numpy array with a value
+    per glyph (x_coords, y_coords and the arrays in additional_data). The separators are the same for all
+    glyphs of a plot, so they are only stored once as the key of the plot. points holds the position of
+    every glyph in the aggregated data of the whole viz (see QueryPlan.execute_aggregation()).
+    """
+
+    __slots__ = ('x_attr', 'y_attr', 'x_coords', 'y_coords', 'x_seps', 'y_seps', 'additional_data',
+                 'colorization_behaviour', 'sizing_behaviour', 'points')
+
     def __init__(
             self,
-            x_coords: List[AVP],
-            y_coords: List[AVP],
+            x_attr: Optional[Attribute],
+            x_coords: numpy.ndarray,
+            y_attr: Optional[Attribute],
+            y_coords: numpy.ndarray,
             x_seps: List[AVP],
             y_seps: List[AVP],
-            additional_data: List[AVP],
+            additional_data: Dict[Attribute, numpy.ndarray],
             colorization_behaviour: ColorizationBehaviour,
-            sizing_behaviour: SizingBehaviour
+            sizing_behaviour: SizingBehaviour,
+            points: Optional[numpy.ndarray] = None
     ) -> None:
         # those two should be the same, or at least one is non-existent
         assert len(x_coords) == len(y_coords) or min(len(x_coords), len(y_coords)) == 0
 
+        self.x_attr = x_attr
+        self.y_attr = y_attr
         self.x_coords = x_coords
         self.y_coords = y_coords
         self.x_seps = x_seps
@@ -31,13 +49,19 @@ class PlotInfo:
         self.additional_data = additional_data
         self.colorization_behaviour = colorization_behaviour
         self.sizing_behaviour = sizing_behaviour
+        self.points = numpy.arange(self.glyph_count) if points is None else points
+
+    @property
+    def glyph_count(self) -> int:
+        # for 0d0m-configurations, the lengths of axes might differ
+        return max(len(self.x_coords), len(self.y_coords))
 
     @property
-    def colors(self) -> List[AVP]:
+    def colors(self) -> numpy.ndarray:
         return self.colorization_behaviour.get_colors(self)
 
     @property
-    def sizes(self) -> List[AVP]:
+    def sizes(self) -> numpy.ndarray:
         return self.sizing_behaviour.get_sizes(self)
 
     @property
@@ -54,14 +78,40 @@ class PlotInfo:
         col_names = ColumnNameCollection(x_colname, y_colname, color_colname, size_colname)
         return col_names
 
-    def find_attributes(self, attribute: Attribute) -> List[AVP]:
-        # might return the same attribute twice eg. if it's both in column and rows (1m/1m configs)
-        all_attributes = chain(self.x_coords, self.y_coords, self.x_seps, self.y_seps, self.additional_data)
-        return [avp for avp in all_attributes if avp.attr == attribute]
+    def get_values(self, attribute: Attribute) -> numpy.ndarray:
+        """ Returns the values of an attribute for every glyph of this plot
 
-    def variations_of(self, attribute: Attribute) -> List[Any]:
-        relevant_values = [avp.val for avp in self.find_attributes(attribute)]
-        return list(set(relevant_values))
+        Separators have the same value for all glyphs, for them the result is a read-only broadcast view.
+        Raises a KeyError if the attribute is not part of this plot.
+        """
+        if attribute == self.x_attr:
+            return self.x_coords
+        if attribute == self.y_attr:
+            return self.y_coords
+        if attribute in self.additional_data:
+            return self.additional_data[attribute]
+        for avp in self.x_seps + self.y_seps:
+            if avp.attr == attribute:
+                value = numpy.array([avp.val], dtype=object if isinstance(avp.val, str) else None)
+                return numpy.broadcast_to(value, (self.glyph_count,))
+        raise KeyError(f'{attribute} is not part of {self}')
+
+    def keep_glyphs(self, positions: numpy.ndarray) -> None:
+        """ Reduces the plot to the glyphs at the given positions, eg. after downsampling
+        """
+        if len(self.x_coords) > 0:
+            self.x_coords = self.x_coords[positions]
+        if len(self.y_coords) > 0:
+            self.y_coords = self.y_coords[positions]
+        for attribute, values in self.additional_data.items():
+            self.additional_data[attribute] = values[positions]
+        self.points = self.points[positions]
+
+    def variations_of(self, attribute: Attribute) -> numpy.ndarray:
+        for avp in self.x_seps + self.y_seps:
+            if avp.attr == attribute:
+                return numpy.array([avp.val])
+        return pandas.unique(self.get_values(attribute))
 
     def is_in_plot_of(self, other_x_seps: List[AVP], other_y_seps: List[AVP]) -> bool:
         return self.x_seps == other_x_seps and self.y_seps == other_y_seps
@@ -75,16 +125,14 @@ class PlotInfo:
         else:
             return attrs[-1].val
 
-    def get_coord_values(self, x_or_y: str) -> List[Any]:
+    def get_coord_values(self, x_or_y: str) -> numpy.ndarray:
         """ Will return all values for a given coords axis
-        If the axis is empty, will return a default AVP
+        If the axis is empty, will return the value of the default AVP for every glyph
         """
-        other = 'y' if x_or_y is 'x' else 'x'
         vals = getattr(self, f'{x_or_y}_coords')
         if len(vals) > 0:
-            return [avp.val for avp in vals]
-        else:
-            return [DEFAULT_AVP.val] * len(self.get_coord_values(other))
+            return vals
+        return numpy.full(self.glyph_count, DEFAULT_AVP.val, dtype=object)
 
     def get_example_avp_for_axis(self, x_or_y: str) -> AVP:
         """Returns an example AVP for the x- or y_coords
@@ -94,33 +142,47 @@ class PlotInfo:
 
         values = getattr(self, f'{x_or_y}_coords')
         if len(values) > 0:
-            return values[0]
+            return AVP(getattr(self, f'{x_or_y}_attr'), values[0])
         return DEFAULT_AVP
 
-    def get_viz_data(self) -> Dict[str, List[Any]]:
+    def get_viz_data(
+            self,
+            color_indices: bool = False,
+            constant_channels: Collection[str] = (),
+            with_points: bool = False
+    ) -> Dict[str, numpy.ndarray]:
         """ Returns the data that is supposed to be drawn in a fitting format
+
+        The coordinates are returned as they are stored, without copying them. With color_indices, the
+        color column contains the positions of the colors in the palette of the color ramp instead of the
+        colors, which only works for measure colors (see MeasureColorizationBehaviour.get_color_indices()).
+        Channels ('color', 'size') in constant_channels are left out, the glyph gets their value instead.
+        With with_points, the column '_point' contains the points of the glyphs.
         """
         x, y, color, size = self.column_names
         # x and y might be the same for 1m/1m configs, data then contains only 3 keys
         data = {
             x: self.get_coord_values('x'),  # default value for 0d0m_xd1m configs
             y: self.get_coord_values('y'),  # default value for xd1m_0d0m configs
-            color: [avp.val for avp in self.colors],
-            size: [avp.val for avp in self.sizes]
+            color: self.colorization_behaviour.get_color_indices(self) if color_indices else self.colors,
+            size: self.sizes
         }
+        for channel in constant_channels:
+            del data[{'color': color, 'size': size}[channel]]
+        if with_points:
+            data['_point'] = self.points
         self._check_data(data)
         return data
 
     @staticmethod
-    def _check_data(data: Dict[str, List[Any]]) -> None:
+    def _check_data(data: Dict[str, numpy.ndarray]) -> None:
         amounts = list(len(data[attr]) for attr in data.keys())
         if not min(amounts) == max(amounts):
             lengths = {k: len(v) for k, v in data.items()}
             raise ValueError(f'Columns not of the same length: {lengths}')
 
     def __repr__(self):
-        xvals = [x.val for x in self.x_coords]
-        yvals = [x.val for x in self.y_coords]
         col_b = self.colorization_behaviour
         size_b = self.sizing_behaviour
-        return f'<PlotInfo: [{xvals}|{yvals}] [[{self.x_seps}||{self.y_seps}]] ({repr(col_b)}|{repr(size_b)})'
+        return (f'<PlotInfo: [{self.x_coords}|{self.y_coords}] [[{self.x_seps}||{self.y_seps}]] '
+                f'({repr(col_b)}|{repr(size_b)})')
@@ -1,6 +1,10 @@
-from itertools import chain
-from typing import List
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
 
+import numpy
+import pandas
+
+from datapylot.data.attributes import Attribute
 from datapylot.data.vizconfig import VizConfig, NoSuchAttributeException
 from datapylot.data_preparation.avp import AVP
 from datapylot.data_preparation.colorization_behaviour import ColorizationBehaviour
@@ -11,69 +15,86 @@ from datapylot.logger import log
 
 class PlotInfoBuilder:
     @classmethod
-    def create_all_plotinfos(cls, data: List[List[AVP]], config: VizConfig):
+    def create_all_plotinfos(cls, columns: 'OrderedDict[Attribute, numpy.ndarray]', config: VizConfig):
         """ The single public interface of PlotInfoBuilder
 
-        Will take a list of AVP-Lists and create a list of PlotInfo objects from them
+        Will take one array per dimension and measure (with one value per aggregated group) and create
+        a list of PlotInfo objects from them, one per combination of separator values.
         """
-        log('PlotInfoBuilder_class', f'Creating all plot infos for {len(data)} rows of data [config is {config}]')
+        length = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+        log('PlotInfoBuilder_class', f'Creating all plot infos for {length} rows of data [config is {config}]')
         plotinfo_cache: List[PlotInfo] = []
+        if length == 0:
+            return plotinfo_cache
 
-        for dataset in data:
-            cls._make_plot_info(dataset, config, plotinfo_cache)
+        # the behaviours look at all plots, so they are shared and get the list that is filled below
+        col_behaviour = ColorizationBehaviour.get_correct_behaviour(config, plotinfo_cache)
+        size_behaviour = SizingBehaviour.get_correct_behaviour(config, plotinfo_cache)
+        # the scales are computed once from the values of all plots and shared by them
+        if config.color in columns:
+            col_behaviour.fit(columns[config.color])
+        if config.size in columns:
+            size_behaviour.fit(columns[config.size])
 
         # sort data so that dimensions and measures stay grouped
-        plotinfo_cache.sort(key=lambda x: [avp.val for avp in chain(x.y_seps[::-1], x.x_seps[::-1])])
-        return plotinfo_cache
+        sort_attributes = config.y_separators[::-1] + config.x_separators[::-1]
+        panel_ids = _get_panel_ids([columns[attr] for attr in sort_attributes], length)
 
-    @classmethod
-    def _make_plot_info(cls, plot_data: List[AVP], config: VizConfig, plotinfo_cache: List[PlotInfo]) -> None:
-        """ Gathers the data necessary for a single PlotInfo object and creates it
+        # a stable sort keeps the order of the groups within each panel, after it every panel is one slice
+        order = numpy.argsort(panel_ids, kind='mergesort')
+        sorted_columns = OrderedDict((attr, values[order]) for attr, values in columns.items())
+        sizes = numpy.bincount(panel_ids)
+        ends = numpy.cumsum(sizes)
+        starts = ends - sizes
 
-        Will not return an object but rather put it into the plotinfo_cache
-        """
-        dims_and_measures = list(chain(config.dimensions, config.measures))
-        find_index = dims_and_measures.index
-        x_coords: List[AVP] = []  # default value, in case no values are there
-        y_coords: List[AVP] = []  # default value, in case no values are there
+        x_attr, y_attr = cls._get_axis_attribute(config, 'x'), cls._get_axis_attribute(config, 'y')
+        # gather additional data that is not used for X/Y placement of glyphs (eg. for colors and sizes)
+        used_attributes = config.rows + config.columns
+        additional_attributes = [attr for attr in columns.keys() if attr not in used_attributes]
+        empty = numpy.array([])
 
+        for start, end in zip(starts, ends):
+            panel = slice(start, end)
+            x_seps = [AVP(attr, _to_python(sorted_columns[attr][start])) for attr in config.x_separators]
+            y_seps = [AVP(attr, _to_python(sorted_columns[attr][start])) for attr in config.y_separators]
+            x_coords = sorted_columns[x_attr][panel] if x_attr in sorted_columns else empty
+            y_coords = sorted_columns[y_attr][panel] if y_attr in sorted_columns else empty
+            additional_data = OrderedDict((attr, sorted_columns[attr][panel]) for attr in additional_attributes)
+            new_plotinfo = PlotInfo(x_attr, x_coords, y_attr, y_coords, x_seps, y_seps, additional_data,
+                                    col_behaviour, size_behaviour, order[panel])
+            plotinfo_cache.append(new_plotinfo)
+
+        log('PlotInfoBuilder_class', f'Created {len(plotinfo_cache)} PlotInfo objects')
+        return plotinfo_cache
+
+    @staticmethod
+    def _get_axis_attribute(config: VizConfig, x_or_y: str) -> Optional[Attribute]:
         try:
-            x_coords = [plot_data[find_index(config.x_data)]]
-        except NoSuchAttributeException:
-            pass
-        try:
-            y_coords = [plot_data[find_index(config.y_data)]]
+            return getattr(config, f'{x_or_y}_data')
         except NoSuchAttributeException:
-            pass
+            return None
 
-        x_seps = [plot_data[find_index(col)] for col in config.x_separators]
-        y_seps = [plot_data[find_index(col)] for col in config.y_separators]
 
-        # gather additional data that is not used for X/Y placement of glyphs (eg. for colors and sizes)
-        used_indicies = set(find_index(col) for col in config.rows + config.columns)
-        all_indicies = set(range(len(plot_data)))
-        additional_data_indicies = all_indicies - used_indicies
-        additional_data = [plot_data[i] for i in additional_data_indicies]
+def _get_panel_ids(columns: List[numpy.ndarray], length: int) -> numpy.ndarray:
+    """ Returns the panel of every row, panels are numbered in the lexicographic order of the given columns
+    """
+    panel_ids = numpy.zeros(length, dtype='int64')
+    for values in columns:
+        codes, uniques = _factorize(values)
+        # combining and compacting per column keeps the ids small and their order intact
+        panel_ids, _ = pandas.factorize(panel_ids * len(uniques) + codes, sort=True)
+    return panel_ids
 
-        col_behaviour = ColorizationBehaviour.get_correct_behaviour(config, plotinfo_cache)
-        size_behaviour = SizingBehaviour.get_correct_behaviour(config, plotinfo_cache)
 
-        # create new object and determine if there are already fitting existing objects
-        # TODO FIXME: Determine this without creating a new PlotInfo object for each
-        existing_plotinfos = list(filter(lambda ppi: ppi.is_in_plot_of(x_seps, y_seps), plotinfo_cache))
+def _factorize(values: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    try:
+        return pandas.factorize(values, sort=True)
+    except TypeError:
+        # mixed types can't be sorted
+        return pandas.factorize(values)
 
-        if len(existing_plotinfos) == 0:
-            new_plotinfo = PlotInfo(x_coords, y_coords, x_seps, y_seps, additional_data, col_behaviour, size_behaviour)
-            # use the new object
-            log('PlotInfoBuilder_class', f'Created a new PlotInfo object as {new_plotinfo}')
-            plotinfo_cache.append(new_plotinfo)
-        elif len(existing_plotinfos) == 1:
-            # use an existing object and discard the newly created one
-            existing = existing_plotinfos[0]
-            existing.x_coords.extend(x_coords)
-            existing.y_coords.extend(y_coords)
-            existing.additional_data.extend(additional_data)
-
-        else:
-            # There should never be more than 1 existing object
-            assert False, f'Already have {len(existing_plotinfos)} objects'
+
+def _to_python(value: Any) -> Any:
+    """ Separator values end up in labels and tooltips, which need plain python values instead of numpy scalars
+    """
+    return value.item() if isinstance(value, numpy.generic) else value
@@ -0,0 +1,536 @@
+from collections import OrderedDict
+from functools import reduce
+from itertools import chain
+from operator import mul
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import numpy
+import pandas
+
+from datapylot.data.attributes import Attribute, Dimension, Measure
+from datapylot.data.datasource import Datasource, group_observed
+from datapylot.data.filters import Filter
+from datapylot.data.table_calculations import apply_table_calculation
+from datapylot.data.vizconfig import VizConfig
+from datapylot.data_preparation.colorization_behaviour import NoColorColorizationBehaviour
+from datapylot.data_preparation.downsampling import DOWNSAMPLERS
+from datapylot.data_preparation.layout import GridLayout
+from datapylot.data_preparation.plotinfo import PlotInfo
+from datapylot.data_preparation.plotinfobuilder import PlotInfoBuilder
+from datapylot.data_preparation.sizing_behaviour import NoColorSizingBehaviour
+from datapylot.logger import log
+from datapylot.utils import GRID_WIDTH, MarkType
+
+Column = Union[str, Attribute]
+
+
+class PlanContext:
+    """ Holds the intermediate results that the operators of a QueryPlan hand to each other
+    """
+
+    def __init__(self, datasource: Datasource, config: VizConfig) -> None:
+        self.datasource = datasource
+        self.config = config
+        # the selected rows of the datasource as boolean mask, None while all rows are selected
+        self.rows = None  # type: Optional[numpy.ndarray]
+        self.frame = None  # type: Optional[pandas.DataFrame]
+        self.aggregated = OrderedDict()  # type: Dict[Measure, pandas.Series]
+        self.plotinfos = []  # type: List[PlotInfo]
+
+
+class Operator:
+    """ Base class for the steps of a QueryPlan, not useful to instantiate.
+
+    Operators estimate their amount of output rows before they are executed and record
+    the actual amount of rows and the time they took once they are.
+    """
+
+    def __init__(self) -> None:
+        self.estimated_rows = None  # type: Optional[int]
+        self.actual_rows = None  # type: Optional[int]
+        self.duration = None  # type: Optional[float]
+
+    @property
+    def name(self) -> str:
+        return type(self).__name__[:-len('Operator')]
+
+    def run(self, context: PlanContext) -> None:
+        start = perf_counter()
+        self.actual_rows = self.execute(context)
+        self.duration = perf_counter() - start
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        """ Will raise NotImplementedError to remind you to overwrite it in subclasses
+        """
+        raise NotImplementedError('estimate() is only available in subclasses of Operator')
+
+    def execute(self, context: PlanContext) -> int:
+        """ Will raise NotImplementedError to remind you to overwrite it in subclasses
+        """
+        raise NotImplementedError('execute() is only available in subclasses of Operator')
+
+    def describe(self) -> str:
+        return ''
+
+    def __repr__(self) -> str:
+        return f'<{type(self).__name__}: {self.describe()}>'
+
+
+class ScanOperator(Operator):
+    """ Reads the rows of the datasource, optionally only some columns (projection) and rows (filters)
+    """
+
+    def __init__(self, columns: Optional[List[Column]] = None, filters: Optional[List[Filter]] = None) -> None:
+        super().__init__()
+        self.columns = columns
+        self.filters = [] if filters is None else filters
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        return int(len(datasource.data) * _get_selectivity(datasource, self.filters))
+
+    def execute(self, context: PlanContext) -> int:
+        datasource = context.datasource
+        if len(self.filters) > 0:
+            context.rows = datasource.get_filter_mask(self.filters)
+        if self.columns is not None:
+            context.frame = datasource.project(self.columns, context.rows)
+        elif context.rows is not None:
+            context.frame = datasource.data[context.rows]
+        else:
+            context.frame = datasource.data
+        return len(context.frame)
+
+    def describe(self) -> str:
+        columns = 'all columns' if self.columns is None else f'columns {[_get_name(c) for c in self.columns]}'
+        filters = f' where {self.filters}' if len(self.filters) > 0 else ''
+        return f'{columns}{filters}'
+
+
+class FilterOperator(Operator):
+    """ Removes all rows that don't pass the filters
+    """
+
+    def __init__(self, filters: List[Filter]) -> None:
+        super().__init__()
+        self.filters = filters
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        return int(input_rows * _get_selectivity(datasource, self.filters))
+
+    def execute(self, context: PlanContext) -> int:
+        mask = context.datasource.get_filter_mask(self.filters, context.rows)
+        context.frame = context.frame[mask]
+        if context.rows is None:
+            context.rows = mask
+        else:
+            rows = context.rows.copy()
+            rows[context.rows] = mask
+            context.rows = rows
+        return len(context.frame)
+
+    def describe(self) -> str:
+        return str(self.filters)
+
+
+class ProjectOperator(Operator):
+    """ Reduces the data to the columns that are needed later on, computing derived columns if necessary
+    """
+
+    def __init__(self, columns: List[Column]) -> None:
+        super().__init__()
+        self.columns = columns
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        return input_rows
+
+    def execute(self, context: PlanContext) -> int:
+        context.frame = context.datasource.project(self.columns, context.rows)
+        return len(context.frame)
+
+    def describe(self) -> str:
+        return str([_get_name(c) for c in self.columns])
+
+
+class AggregateOperator(Operator):
+    """ Groups the rows by all dimensions and aggregates every measure, including table calculations
+    """
+
+    def __init__(self, dimensions: List[Dimension], measures: List[Measure], partition: List[Dimension]) -> None:
+        super().__init__()
+        self.dimensions = dimensions
+        self.measures = measures
+        self.partition = partition
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        return min(input_rows, _get_combinations(datasource, self.dimensions))
+
+    def execute(self, context: PlanContext) -> int:
+        frame = context.frame
+        if len(self.dimensions) == 0:
+            # same grouping as Datasource.group_by() uses for no dimensions at all
+            grouped = frame.groupby(lambda _: True)
+        else:
+            grouped = group_observed(frame, [d.col_name for d in self.dimensions])
+
+        for measure in self.measures:
+            aggregated = getattr(grouped[measure.source_col], measure.aggregation)()
+            if measure.table_calculation is not None:
+                levels = [self.dimensions.index(d) for d in self.partition]
+                aggregated = apply_table_calculation(aggregated, levels, measure.table_calculation, measure.window)
+            context.aggregated[measure] = aggregated
+        return _get_aggregated_rows(context)
+
+    def describe(self) -> str:
+        return f'by {[d.col_name for d in self.dimensions]} of {[m.col_name for m in self.measures]}'
+
+
+class CachedAggregateOperator(AggregateOperator):
+    """ Takes the aggregated measures from the cache of the datasource instead of reading the rows
+
+    Measures that are not cached yet are aggregated by the datasource (which then caches them), or rolled up
+    from a cached aggregate over more dimensions (a cube) if there is one.
+    """
+
+    def __init__(self, dimensions: List[Dimension], measures: List[Measure], partition: List[Dimension]) -> None:
+        super().__init__(dimensions, measures, partition)
+        self.cubes = {}  # type: Dict[Measure, Tuple[str, ...]]
+        self.cached = set()  # type: Set[Measure]
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        return _get_combinations(datasource, self.dimensions)
+
+    def execute(self, context: PlanContext) -> int:
+        for measure in self.measures:
+            cube = self.cubes.get(measure)
+            aggregated = context.datasource.aggregate(self.dimensions, measure, self.partition, cube=cube)
+            context.aggregated[measure] = aggregated
+        return _get_aggregated_rows(context)
+
+    def describe(self) -> str:
+        def source(measure: Measure) -> str:
+            if measure in self.cached:
+                return 'cached'
+            if measure in self.cubes:
+                return f'rolled up from {list(self.cubes[measure])}'
+            return 'not cached yet'
+
+        measures = ', '.join(f'{m.col_name}: {source(m)}' for m in self.measures)
+        return f'by {[d.col_name for d in self.dimensions]} of [{measures}]'
+
+
+class PartitionOperator(Operator):
+    """ Distributes the aggregated rows into one PlotInfo per combination of the x- and y-separators
+    """
+
+    def __init__(self, config: VizConfig) -> None:
+        super().__init__()
+        self.config = config
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        separators = [s for s in self.config.x_separators + self.config.y_separators if isinstance(s, Dimension)]
+        return max(min(input_rows, _get_combinations(datasource, separators)), 1)
+
+    def execute(self, context: PlanContext) -> int:
+        columns = self._get_columns(context.aggregated)
+        context.plotinfos = PlotInfoBuilder.create_all_plotinfos(columns, self.config)
+        return len(context.plotinfos)
+
+    def _get_columns(self, aggregated: Dict[Measure, pandas.Series]) -> 'OrderedDict[Attribute, numpy.ndarray]':
+        """ Turns the aggregated measures into one array per dimension and measure, with a value per group
+        """
+        columns = OrderedDict()  # type: OrderedDict[Attribute, numpy.ndarray]
+        if len(aggregated) == 0:
+            return columns
+        index = next(iter(aggregated.values())).index
+        # without dimensions, the index is the single group True that is only needed by pandas
+        for level, dimension in enumerate(self.config.dimensions):
+            columns[dimension] = numpy.asarray(index.get_level_values(level))
+        for measure, values in aggregated.items():
+            if not values.index.equals(index):
+                values = values.reindex(index)
+            columns[measure] = values.values
+        return columns
+
+    def describe(self) -> str:
+        x_seps = [s.col_name for s in self.config.x_separators]
+        y_seps = [s.col_name for s in self.config.y_separators]
+        return f'x: {x_seps} | y: {y_seps}'
+
+
+class DownsampleOperator(Operator):
+    """ Reduces the points of every line to a bounded amount that depends on the width of its plot
+
+    Lines can't be drawn with more detail than their plot has pixels, so points beyond points_per_pixel
+    per pixel are dropped with one of the DOWNSAMPLERS, which keep the visual shape of the line.
+    """
+
+    # one of DOWNSAMPLERS, None to keep all points
+    method = 'lttb'
+    points_per_pixel = 1
+
+    def __init__(self, config: VizConfig) -> None:
+        super().__init__()
+        self.config = config
+        self.max_points = None  # type: Optional[int]
+        self.points = (0, 0)  # amount of points before and after downsampling
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        return input_rows
+
+    def execute(self, context: PlanContext) -> int:
+        plotinfos = context.plotinfos
+        if self.method is None or len(plotinfos) == 0:
+            return len(plotinfos)
+        downsampler = DOWNSAMPLERS[self.method]
+        plot_width = GRID_WIDTH / max(GridLayout(plotinfos).ncols, 1)
+        self.max_points = max(int(plot_width * self.points_per_pixel), 3)
+
+        before = sum(pi.glyph_count for pi in plotinfos)
+        for plotinfo in plotinfos:
+            if plotinfo.glyph_count <= self.max_points or not _is_numeric(plotinfo.y_coords):
+                continue
+            x = plotinfo.x_coords if _is_numeric(plotinfo.x_coords) else numpy.arange(plotinfo.glyph_count)
+            plotinfo.keep_glyphs(downsampler(x, plotinfo.y_coords, self.max_points))
+        self.points = (before, sum(pi.glyph_count for pi in plotinfos))
+        return len(plotinfos)
+
+    def describe(self) -> str:
+        if self.method is None:
+            return 'disabled'
+        if self.max_points is None:
+            return f'{self.method} to {self.points_per_pixel} points per pixel'
+        return f'{self.method} to {self.max_points} points per plot, kept {self.points[1]} of {self.points[0]} points'
+
+
+class EncodeOperator(Operator):
+    """ Decides how colors and sizes are encoded, channels in constant_channels get one fixed value
+    """
+
+    def __init__(self, config: VizConfig) -> None:
+        super().__init__()
+        self.config = config
+        self.constant_channels = set()  # type: Set[str]
+
+    def estimate(self, datasource: Datasource, input_rows: int) -> int:
+        return input_rows
+
+    def execute(self, context: PlanContext) -> int:
+        plotinfos = context.plotinfos
+        if 'color' in self.constant_channels:
+            colorization = NoColorColorizationBehaviour(self.config, plotinfos)
+            for plotinfo in plotinfos:
+                plotinfo.colorization_behaviour = colorization
+        if 'size' in self.constant_channels:
+            sizing = NoColorSizingBehaviour(self.config, plotinfos)
+            for plotinfo in plotinfos:
+                plotinfo.sizing_behaviour = sizing
+        return len(plotinfos)
+
+    def describe(self) -> str:
+        def channel(name: str) -> str:
+            attr = getattr(self.config, name)
+            if name in self.constant_channels:
+                return f'{name}: constant'
+            return f'{name}: none' if attr is None else f'{name}: by {attr}'
+
+        return ', '.join([channel('color'), channel('size')])
+
+
+class QueryPlan:
+    """ The explicit sequence of operators that turns a VizConfig into PlotInfo objects
+
+    A plan is compiled from a config in its most straightforward form and can then be rewritten by
+    optimizer passes. explain() describes the plan with the estimated (and after execution the actual)
+    amount of rows as well as the time that every operator took.
+    """
+
+    def __init__(self, datasource: Datasource, config: VizConfig, operators: List[Operator]) -> None:
+        self.datasource = datasource
+        self.config = config
+        self.operators = operators
+        self.applied_passes = []  # type: List[str]
+        self._update_estimates()
+
+    @classmethod
+    def compile(cls, datasource: Datasource, config: VizConfig) -> 'QueryPlan':
+        """ Creates the plan that reads all data, filters it, reduces it to the needed columns and aggregates it
+        """
+        dimensions, measures = config.dimensions, config.measures
+        # table calculations are done separately for each plot
+        partition = [d for d in config.x_separators + config.y_separators if isinstance(d, Dimension)]
+
+        operators = [ScanOperator()]  # type: List[Operator]
+        if len(config.filters) > 0:
+            operators.append(FilterOperator(config.filters))
+        operators += [
+            ProjectOperator(_unique_columns(chain(dimensions, measures))),
+            AggregateOperator(dimensions, measures, partition),
+            PartitionOperator(config)
+        ]
+        if config.mark_type is MarkType.LINE:
+            operators.append(DownsampleOperator(config))
+        operators.append(EncodeOperator(config))
+        return cls(datasource, config, operators)
+
+    @property
+    def constant_channels(self) -> Set[str]:
+        return self._find(EncodeOperator).constant_channels
+
+    def optimize(self, passes: Optional[Iterable[str]] = None) -> 'QueryPlan':
+        """ Applies the given optimizer passes (all by default, in the order of OPTIMIZER_PASSES) and returns self
+        """
+        names = list(OPTIMIZER_PASSES.keys()) if passes is None else list(passes)
+        for name in names:
+            if OPTIMIZER_PASSES[name](self):
+                self.applied_passes.append(name)
+        self._update_estimates()
+        log(self, f'Optimized plan with {self.applied_passes} to {self.operators}')
+        return self
+
+    def execute(self) -> List[PlotInfo]:
+        context = PlanContext(self.datasource, self.config)
+        for operator in self.operators:
+            operator.run(context)
+        return context.plotinfos
+
+    def execute_aggregation(self) -> 'OrderedDict[Attribute, numpy.ndarray]':
+        """ Runs the plan up to the aggregation, returns one array per dimension and measure with a value per group
+
+        The arrays are the aggregates as they are cached, without splitting them into plots (eg. for exports).
+        """
+        context = PlanContext(self.datasource, self.config)
+        partition = self._find(PartitionOperator)
+        for operator in self.operators[:self.operators.index(partition)]:
+            operator.run(context)
+        return partition._get_columns(context.aggregated)
+
+    def explain(self) -> str:
+        """ Returns a description of the plan, starting with the last operator
+        """
+        lines = [f'QueryPlan for {self.config}']
+        for depth, operator in enumerate(reversed(self.operators)):
+            prefix = '  ' * depth + ('-> ' if depth > 0 else '')
+            actual = '?' if operator.actual_rows is None else operator.actual_rows
+            duration = '?' if operator.duration is None else f'{operator.duration * 1000:.2f}ms'
+            stats = f'(estimated rows: {operator.estimated_rows}, actual rows: {actual}, time: {duration})'
+            lines.append(f'{prefix}{operator.name} {operator.describe()} {stats}')
+        lines.append(f'Optimizer passes: {", ".join(self.applied_passes) or "none"}')
+        return '\n'.join(lines)
+
+    # optimizer passes, each returns whether it changed the plan
+    def _push_down_projections(self) -> bool:
+        """ Lets the scan read only the needed columns, so filters copy as little data as possible
+        """
+        project, scan = self._find(ProjectOperator), self._find(ScanOperator)
+        if project is None or scan is None or scan.columns is not None:
+            return False
+        scan.columns = project.columns
+        self.operators.remove(project)
+        return True
+
+    def _push_down_filters(self) -> bool:
+        """ Evaluates the filters while scanning, so only the selected rows are read at all
+        """
+        filter_op, scan = self._find(FilterOperator), self._find(ScanOperator)
+        if filter_op is None or scan is None:
+            return False
+        scan.filters = scan.filters + filter_op.filters
+        self.operators.remove(filter_op)
+        return True
+
+    def _substitute_cache(self) -> bool:
+        """ Replaces reading and aggregating the data by the aggregate cache of the datasource
+
+        The cache only holds aggregates of unfiltered data, so this works only for plans without filters
+        """
+        aggregate = self._find(AggregateOperator)
+        if aggregate is None or isinstance(aggregate, CachedAggregateOperator) or len(self.config.filters) > 0:
+            return False
+        cached = CachedAggregateOperator(aggregate.dimensions, aggregate.measures, aggregate.partition)
+        cached.cached = set(m for m in aggregate.measures
+                            if self.datasource.is_aggregate_cached(aggregate.dimensions, m, aggregate.partition))
+        position = self.operators.index(aggregate)
+        self.operators = [cached] + self.operators[position + 1:]
+        return True
+
+    def _substitute_cubes(self) -> bool:
+        """ Rolls up measures that are not cached from cached aggregates over more dimensions
+        """
+        aggregate = self._find(CachedAggregateOperator)
+        if aggregate is None:
+            return False
+        for measure in aggregate.measures:
+            # table calculations are applied on top of the rolled up plain aggregate
+            plain_measure = Measure(measure.source_col, aggregation=measure.aggregation)
+            if measure in aggregate.cached or self.datasource.is_aggregate_cached(aggregate.dimensions, plain_measure):
+                continue
+            cube = self.datasource.find_cube(aggregate.dimensions, measure)
+            if cube is not None:
+                aggregate.cubes[measure] = cube
+        return len(aggregate.cubes) > 0
+
+    def _fold_constant_encodings(self) -> bool:
+        """ Encodes colors and sizes with one fixed value if they are not set or can only have one value
+        """
+        encode = self._find(EncodeOperator)
+        for channel in ('color', 'size'):
+            attr = getattr(self.config, channel)
+            if attr is None or (isinstance(attr, Dimension) and self.datasource.get_statistics(attr).distinct <= 1):
+                encode.constant_channels.add(channel)
+        return len(encode.constant_channels) > 0
+
+    def _find(self, operator_class: type) -> Any:
+        matches = [op for op in self.operators if isinstance(op, operator_class)]
+        return matches[0] if len(matches) > 0 else None
+
+    def _update_estimates(self) -> None:
+        rows = 0
+        for operator in self.operators:
+            rows = operator.estimate(self.datasource, rows)
+            operator.estimated_rows = rows
+
+    def __repr__(self) -> str:
+        return f'<QueryPlan: {[op.name for op in self.operators]}>'
+
+
+OPTIMIZER_PASSES = OrderedDict([
+    ('projection_pushdown', QueryPlan._push_down_projections),
+    ('filter_pushdown', QueryPlan._push_down_filters),
+    ('cache_substitution', QueryPlan._substitute_cache),
+    ('cube_substitution', QueryPlan._substitute_cubes),
+    ('constant_folding', QueryPlan._fold_constant_encodings),
+])  # type: Dict[str, Callable[[QueryPlan], bool]]
+
+
+def _get_name(column: Column) -> str:
+    if isinstance(column, Measure):
+        return column.source_col
+    return getattr(column, 'col_name', column)
+
+
+def _unique_columns(columns: Iterable[Column]) -> List[Column]:
+    """ Measures with table calculations share their column with the plain measure, so columns can repeat
+    """
+    out = OrderedDict()  # type: Dict[str, Column]
+    for column in columns:
+        out.setdefault(_get_name(column), column)
+    return list(out.values())
+
+
+def _get_selectivity(datasource: Datasource, filters: List[Filter]) -> float:
+    return reduce(mul, (f.estimate_selectivity(datasource.get_statistics(f.attribute)) for f in filters), 1.0)
+
+
+def _get_combinations(datasource: Datasource, attributes: List[Attribute]) -> int:
+    """ Upper bound for the amount of groups when grouping by all attributes
+    """
+    return reduce(mul, (max(datasource.get_statistics(a).distinct, 1) for a in attributes), 1)
+
+
+def _is_numeric(values: numpy.ndarray) -> bool:
+    return len(values) > 0 and numpy.issubdtype(values.dtype, numpy.number)
+
+
+def _get_aggregated_rows(context: PlanContext) -> int:
+    return max((len(series) for series in context.aggregated.values()), default=0)
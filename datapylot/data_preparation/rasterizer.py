@@ -0,0 +1,75 @@
+from typing import Optional, Tuple
+
+import numpy
+
+from datapylot.utils import Number
+
+Extent = Tuple[Number, Number]
+
+
+class Raster:
+    """ Points binned into a grid of pixels, with the amount of points and the sum of their values per pixel
+
+    The first row of the grid is at the bottom (the start of y_extent), like bokeh draws images.
+    """
+
+    def __init__(
+            self,
+            counts: numpy.ndarray,
+            sums: Optional[numpy.ndarray],
+            x_extent: Extent,
+            y_extent: Extent
+    ) -> None:
+        self.counts = counts
+        self.sums = sums
+        self.x_extent = x_extent
+        self.y_extent = y_extent
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.counts.shape
+
+    def get_means(self) -> numpy.ndarray:
+        """ The mean of the values of all points in each pixel, NaN for empty pixels
+        """
+        if self.sums is None:
+            raise ValueError('The raster was created without values')
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(self.counts > 0, self.sums / self.counts, numpy.nan)
+
+    def get_density(self, max_count: int) -> numpy.ndarray:
+        """ The amount of points per pixel between 0 and 1 relative to max_count, NaN for empty pixels
+
+        Counts are compared logarithmically, otherwise few crowded pixels would make all others look empty.
+        """
+        density = numpy.log1p(self.counts) / numpy.log1p(max(max_count, 1))
+        return numpy.where(self.counts > 0, density, numpy.nan)
+
+    def __repr__(self):
+        return f'<Raster: {self.shape[1]}x{self.shape[0]} pixels of {int(self.counts.sum())} points>'
+
+
+def rasterize(
+        x: numpy.ndarray,
+        y: numpy.ndarray,
+        x_extent: Extent,
+        y_extent: Extent,
+        width: int,
+        height: int,
+        values: Optional[numpy.ndarray] = None
+) -> Raster:
+    """ Bins the points into width x height pixels that cover the given extents, points outside are dropped
+
+    If values are given, their sum per pixel is computed as well (see Raster.get_means()).
+    """
+    x, y = numpy.asarray(x, dtype='float64'), numpy.asarray(y, dtype='float64')
+    bins, extent = [height, width], [y_extent, x_extent]
+    sums = None
+    if values is not None:
+        values = numpy.asarray(values, dtype='float64')
+        # means only count the points that have a value
+        valid = ~numpy.isnan(values)
+        x, y = x[valid], y[valid]
+        sums, _, _ = numpy.histogram2d(y, x, bins=bins, range=extent, weights=values[valid])
+    counts, _, _ = numpy.histogram2d(y, x, bins=bins, range=extent)
+    return Raster(counts.astype('int64'), sums, x_extent, y_extent)
@@ -0,0 +1,79 @@
+from typing import Any, Iterable, Sequence
+
+import numpy
+import pandas
+
+from datapylot.utils import Number
+
+
+class Scale:
+    """ Base class for Scales, not useful to instantiate.
+
+    A scale maps the values of an attribute (its domain) to visual values like colors or sizes (its range).
+    Scales are computed once from the values of all plots and then shared by them, so a value gets the
+    same color or size in every plot of the grid.
+    """
+
+    def __call__(self, values: numpy.ndarray) -> numpy.ndarray:
+        """ Will raise NotImplementedError to remind you to overwrite it in subclasses
+        """
+        raise NotImplementedError('__call__() is only available in subclasses of Scale')
+
+    def __repr__(self):
+        return f'{type(self).__name__}'
+
+
+class OrdinalScale(Scale):
+    """ Maps each distinct value to one output, in sorted order of the values
+
+    If there are more values than outputs, the outputs are repeated.
+    """
+
+    def __init__(self, domain: Iterable[Any], outputs: Sequence[Any]) -> None:
+        self.domain = pandas.Index(sorted(pandas.unique(numpy.asarray(domain))))
+        self.outputs = numpy.array(outputs, dtype=object if isinstance(outputs[0], str) else None)
+
+    def get_positions(self, values: numpy.ndarray) -> numpy.ndarray:
+        """ Returns the position of every value in the sorted domain, looked up in a hash table
+        """
+        positions = self.domain.get_indexer(values)
+        assert (positions >= 0).all(), f'{self} got values that are not part of its domain'
+        return positions
+
+    def __call__(self, values: numpy.ndarray) -> numpy.ndarray:
+        return self.outputs[self.get_positions(values) % len(self.outputs)]
+
+    def __repr__(self):
+        return f'<OrdinalScale: {len(self.domain)} values to {len(self.outputs)} outputs>'
+
+
+class LinearScale(Scale):
+    """ Interpolates linearly between range_min for the smallest and range_max for the largest value
+    """
+
+    def __init__(self, domain_min: Number, domain_max: Number, range_min: Number, range_max: Number) -> None:
+        self.domain_min = domain_min
+        self.domain_max = domain_max
+        self.range_min = range_min
+        self.range_max = range_max
+
+    @classmethod
+    def from_values(cls, values: numpy.ndarray, range_min: Number, range_max: Number) -> 'LinearScale':
+        values = numpy.asarray(values, dtype='float64')
+        return cls(numpy.nanmin(values), numpy.nanmax(values), range_min, range_max)
+
+    def get_relative(self, values: numpy.ndarray) -> numpy.ndarray:
+        """ Returns the position of every value between the min (0) and the max (1) of the domain
+        """
+        values = numpy.asarray(values, dtype='float64')
+        if self.domain_max == self.domain_min:
+            # there is only one value, it counts as the max
+            return numpy.ones(len(values))
+        return (values - self.domain_min) / (self.domain_max - self.domain_min)
+
+    def __call__(self, values: numpy.ndarray) -> numpy.ndarray:
+        return self.range_min + self.get_relative(values) * (self.range_max - self.range_min)
+
+    def __repr__(self):
+        return (f'<LinearScale: ({self.domain_min}, {self.domain_max}) to '
+                f'({self.range_min}, {self.range_max})>')
@@ -1,11 +1,10 @@
-from itertools import chain
-from typing import List, Any, Union, TYPE_CHECKING
+from typing import List, Optional, TYPE_CHECKING
 
-from datapylot.data.attributes import Measure, Dimension
-from datapylot.data_preparation.avp import AVP
-from datapylot.utils import reverse_lerp
+import numpy
+import pandas
 
-Number = Union[int, float]
+from datapylot.data.attributes import Measure, Dimension
+from datapylot.data_preparation.scales import Scale, LinearScale, OrdinalScale
 
 # static type analysis
 if TYPE_CHECKING:
@@ -21,6 +20,8 @@ class SizingBehaviour:
         self.vizconfig = vizconfig
         # needed in order to find the min/max ranges for measures and provide consistent sizes for dimensions
         self.all_plotinfos = all_plotinfos
+        # maps size values to glyph sizes, computed once for all plots, see fit()
+        self.scale = None  # type: Optional[Scale]
 
     @staticmethod
     def get_correct_behaviour(vizconfig: 'VizConfig', all_plotinfos: List['PlotInfo']) -> 'SizingBehaviour':
@@ -48,11 +49,29 @@ class SizingBehaviour:
         else:
             assert False
 
-    def get_sizes(self, plot_info: 'PlotInfo') -> List['AVP']:
+    def get_sizes(self, plot_info: 'PlotInfo') -> numpy.ndarray:
         """ Will raise NotImplementedError to remind you to overwrite it in subclasses
         """
         raise NotImplementedError('get_sizes() is only available in subclasses of SizingBehaviour')
 
+    def fit(self, values: numpy.ndarray) -> None:
+        """ Computes the scale from the size values of all plots, it is then shared by all of them
+        """
+        self.scale = self._make_scale(values)
+
+    def get_scale(self) -> Scale:
+        """ Returns the scale, fits it to the values of all plots first if that didn't happen yet
+        """
+        if self.scale is None:
+            size = self.vizconfig.size
+            self.fit(numpy.concatenate([pi.get_values(size) for pi in self.all_plotinfos]))
+        return self.scale
+
+    def _make_scale(self, values: numpy.ndarray) -> Scale:
+        """ Will raise NotImplementedError to remind you to overwrite it in subclasses
+        """
+        raise NotImplementedError('_make_scale() is only available in subclasses of SizingBehaviour')
+
     def __repr__(self):
         return f'{type(self).__name__}'
 
@@ -61,54 +80,31 @@ class NoColorSizingBehaviour(SizingBehaviour):
     """ Sizing strategy for cases where no size at all is supplied in the configuration
     """
 
-    def get_sizes(self, plot_info: 'PlotInfo') -> List['AVP']:
-        """ Will return a list of default sizes matching the amount of glyphs
+    def get_sizes(self, plot_info: 'PlotInfo') -> numpy.ndarray:
+        """ Will return an array of default sizes matching the amount of glyphs
         """
-        # for 0d0m-configurations, the lengths of axes might differ
-        longest_axes = max(len(plot_info.x_coords), len(plot_info.y_coords))
-        return [AVP('Default Size', self.vizconfig.mark_type.value.glyph_size_factor)] * longest_axes
+        return numpy.full(plot_info.glyph_count, self.vizconfig.mark_type.value.glyph_size_factor, dtype=float)
 
 
 class DimensionSizingBehaviour(SizingBehaviour):
     """ If the size is an already existing dimension, it will work straight forward and size every glyph
     """
 
-    def get_sizes(self, plot_info: 'PlotInfo') -> List['AVP']:
-        """ Find all possible values that are in any plot of the screen
+    def get_sizes(self, plot_info: 'PlotInfo') -> numpy.ndarray:
+        """ Looks up the size of every value, separators have the same value for all glyphs of the plot
         """
-        # find the variations of the dimensions value
-        conf_size = self.vizconfig.size
-        base_size = self.vizconfig.mark_type.value.glyph_size_factor
+        return self.get_scale()(plot_info.get_values(self.vizconfig.size))
 
-        # find all variations
-        variations = [pi.variations_of(conf_size) for pi in self.all_plotinfos]
-        possible_vals = sorted(set(chain(*variations)))
-
-        attribute_vals = [avp.val for avp in plot_info.find_attributes(conf_size)]
-
-        # if this dimension is a plot separator, there might only be one value -> extend the list to match the amount
-        amount = len(plot_info.get_coord_values('x'))
-        if len(attribute_vals) < amount:
-            assert len(attribute_vals) == 1
-            attribute_vals *= amount
-
-        # create a avp with (Attribute, size) for each value
-        get_size = self._get_size_for_dimension
-        sizes = [get_size(curr_val, possible_vals, base_size) for curr_val in attribute_vals]
-
-        avps = [AVP(conf_size, size) for size in sizes]
-        return avps
-
-    @staticmethod
-    def _get_size_for_dimension(value: Number, all_values: List[Number], base_size: Number) -> Number:
-        index = all_values.index(value)
-        indicie_range = len(all_values) - 1
-        assert index > -1
-        zero_position = -1 * (indicie_range / 2)
-        current_position = zero_position + index  # can range from -(indicie_range/2) to (indicie_range/2)
-        scaling_factor_per_step = base_size / indicie_range
-        current_size = base_size + (current_position * scaling_factor_per_step)
-        return current_size
+    def _make_scale(self, values: numpy.ndarray) -> Scale:
+        """ Every possible value that is in any plot of the screen gets its own size around the base size
+        """
+        base_size = self.vizconfig.mark_type.value.glyph_size_factor
+        amount = len(pandas.unique(numpy.asarray(values)))
+        if amount == 1:
+            return OrdinalScale(values, [base_size])
+        # positions can range from -(amount-1)/2 to (amount-1)/2, each step changes the size by the same factor
+        positions = numpy.arange(amount) - (amount - 1) / 2
+        return OrdinalScale(values, list(base_size + positions * base_size / (amount - 1)))
 
 
 class MeasureSizingBehaviour(SizingBehaviour):
@@ -117,25 +113,13 @@ class MeasureSizingBehaviour(SizingBehaviour):
     In those cases, it doesn't make a difference if the measure is already somewhere else on the plot.
     """
 
-    def get_sizes(self, plot_info: 'PlotInfo') -> List['AVP']:
-        """ Find all possible values that are in any plot of the screen
+    def get_sizes(self, plot_info: 'PlotInfo') -> numpy.ndarray:
+        """ Interpolates the size of every value based on the values of all plots of the screen
         """
-        conf_size = self.vizconfig.size
-        variations = [pi.variations_of(conf_size) for pi in self.all_plotinfos]
-        possible_vals = sorted(set(chain(*variations)))
-        # might have the same measure twice (1m/1m configs), so we need to filter that out
-        attributes = list(plot_info.find_attributes(conf_size))  # TODO set?
-        attribute_vals = [avp.val for avp in attributes]
-        # create a avp with (Attribute, size) for each value
-        avps = [self._get_size_data(curr_val, possible_vals) for curr_val in attribute_vals]
-        return avps
-
-    def _get_size_data(self, curr_val: Any, possible_vals: List[Any]) -> AVP:
-        """ Reverse-lerp's a size value based on the possible values
+        return self.get_scale()(plot_info.get_values(self.vizconfig.size))
+
+    def _make_scale(self, values: numpy.ndarray) -> Scale:
+        """ The smallest values get half the base size, the largest values one and a half times the base size
         """
-        relative_in_range = reverse_lerp(curr_val, possible_vals)  # between 0 and 1
-        assert 0.0 <= relative_in_range <= 1.0
-        scale_factor = relative_in_range + 0.5  # Turn into range (0.5, 1.5)
-        size = self.vizconfig.mark_type.value.glyph_size_factor * scale_factor
-        size_avp = AVP(self.vizconfig.size, size)
-        return size_avp
+        base_size = self.vizconfig.mark_type.value.glyph_size_factor
+        return LinearScale.from_values(values, base_size * 0.5, base_size * 1.5)
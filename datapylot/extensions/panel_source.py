@@ -0,0 +1,22 @@
+from typing import Any
+
+from bokeh.core.properties import Instance, Int
+from bokeh.models import ColumnDataSource
+
+
+class PanelDataSource(ColumnDataSource):
+    """ The rows start to end of another ColumnDataSource, without copying them into the document
+
+    The data is only sent once with the shared source, the browser slices it for every panel.
+    """
+    __implementation__ = 'panel_source.coffee'
+
+    source = Instance(ColumnDataSource)
+    start = Int(default=0)
+    end = Int(default=0)
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # glyphs are validated against the column names, the data itself only exists in the browser
+        if self.source is not None:
+            self.column_names = list(self.source.column_names)
@@ -1,47 +1,159 @@
+import hashlib
+from collections import Counter
 from math import pi
-from typing import Any, Dict, Tuple, List
+from typing import Any, Callable, Dict, Hashable, Tuple, List, Optional
 
+import numpy
+import pandas
 from bokeh.layouts import Column as BokehColumn
 from bokeh.layouts import gridplot
-from bokeh.models import (BasicTicker, CategoricalAxis, CategoricalTicker, ColumnDataSource, FactorRange, Grid,
-                          LinearAxis, Plot, Range1d)
+from bokeh.models import (BasicTicker, BasicTickFormatter, CategoricalAxis, CategoricalTicker,
+                          CategoricalTickFormatter, ColorMapper, ColumnDataSource, FactorRange, GlyphRenderer, Grid,
+                          ImageRGBA, LinearAxis, Model, Plot, Range1d, ToolEvents)
 from bokeh.models.annotations import Label, Title
 from bokeh.models.axes import Axis
 from bokeh.models.ranges import Range
 from bokeh.models.tickers import Ticker
 
+from datapylot.data.cost import CostPolicy
 from datapylot.data.datasource import Datasource
 from datapylot.data.vizconfig import VizConfig
 from datapylot.data_preparation.aggregator import Aggregator
+from datapylot.data_preparation.colorization_behaviour import MeasureColorizationBehaviour
+from datapylot.data_preparation.colorizer import DEFAULT_RAMP, RAMPS
 from datapylot.data_preparation.plotinfo import PlotInfo
+from datapylot.data_preparation.rasterizer import Extent, Raster, rasterize
+from datapylot.extensions.panel_source import PanelDataSource
 from datapylot.logger import log
-from datapylot.plotting.glyph_factory import create_glyph
-from datapylot.plotting.tooltip_factory import generate_tooltip
-from datapylot.utils import unique_list
+from datapylot.plotting.glyph_factory import create_color_mapper, create_glyph
+from datapylot.plotting.tile_callback import create_tile_callback
+from datapylot.plotting.tooltip_factory import create_details_callback, generate_details_tooltip, generate_tooltip
+from datapylot.utils import MarkType
+
+# style of the grid lines of all plots
+GRID_STYLE = {'grid_line_dash': 'dotted'}
+
+# first and last (exclusive) row of the grid
+RowWindow = Tuple[int, int]
 
 
 class Plotter:
-    def __init__(self, datasource: Datasource, config: VizConfig) -> None:
-        self.aggregator = Aggregator(datasource, config)
+    # send palette indices and one shared color mapper instead of a hex string per glyph for measure colors
+    use_color_mapper = False
+    # send the data of all plots once in a shared source, every plot renders its slice of it
+    use_shared_source = False
+    # circle plots with more points than this are drawn as one image of binned points, None to never rasterize
+    rasterize_above = 100000
+    # url of the tile endpoint (see plotserver.tiles()), a rasterized single plot then loads finer tiles on zoom
+    tile_url = None  # type: Optional[str]
+    # url of the details endpoint (see plotserver.details()), tooltips then load the details of the hovered point
+    details_url = None  # type: Optional[str]
+
+    def __init__(self, datasource: Datasource, config: VizConfig, policy: Optional[CostPolicy] = None) -> None:
+        self.aggregator = Aggregator(datasource, config, policy)
         self.plots: List[Plot] = []
+        # the plot infos of self.plots and the rows of the grid they are in
+        self.data: List[PlotInfo] = []
+        self.rows: RowWindow = (0, 0)
+        self.color_mapper = None  # type: Optional[ColorMapper]
+        self.shared_source = None  # type: Optional[ColumnDataSource]
+        # colors and sizes that are the same for all glyphs are set on the glyph instead of sent per glyph
+        self.constants: Dict[str, Any] = {}
+        # the binned points of every plot that is drawn as an image, by id() of its plot info
+        self.rasters: Dict[int, Raster] = {}
+        # models that are the same for many plots, see _get_shared()
+        self._shared_models: Dict[Hashable, Model] = {}
+        # if set, shared models get ids made of it and their key, so plotters in other processes create the same ids
+        self.shared_id_prefix = None  # type: Optional[str]
         log(self, 'Initializing Plotter')
 
-    def create_viz(self) -> None:
-        """ The single external interface for consumers; will create all plots of this instance"""
+    def create_viz(self, rows: Optional[RowWindow] = None) -> None:
+        """ The single external interface for consumers; will create all plots of this instance
+
+        With rows (start, stop), only the plots in these rows of the grid are created, eg. for the first page
+        of a huge grid. All data is still aggregated, so scales and ranges are the same as for the whole grid
+        and further rows can be created by other instances (see get_layout_info()).
+        """
         self.aggregator.update_data()
-        data = self.aggregator.data
-        log(self, f'Creating {len(data)} plots')
-        for plotinfo in data:
-            plot = self._make_plot(plotinfo)
+        self.create_plots(rows)
+
+    def create_plots(self, rows: Optional[RowWindow] = None) -> None:
+        """ Creates the plots of the rows (or all) from the data that the aggregator already has, see create_viz()
+
+        Plotters can share an aggregator that was updated once, eg. to create the rows of a grid in parallel.
+        """
+        layout = self.aggregator.layout
+        start, stop = rows if rows is not None else (0, layout.nrows)
+        self.rows = (max(start, 0), min(stop, layout.nrows))
+        self.color_mapper = self._get_color_mapper(self.aggregator.data)
+        self.constants = self._get_constants(self.aggregator.data)
+        self._shared_models = {}
+        self.plots = []
+
+        self.data = layout.get_rows(*self.rows)
+        self.rasters = self._rasterize(self.data)
+        log(self, f'Creating {len(self.data)} of {len(self.aggregator.data)} plots, '
+                  f'{len(self.rasters)} of them as images')
+        sources = iter(self._create_sources([pi for pi in self.data if id(pi) not in self.rasters]))
+        for plotinfo in self.data:
+            raster = self.rasters.get(id(plotinfo))
+            source = next(sources) if raster is None else self._create_image_source(plotinfo, raster)
+            plot = self._make_plot(plotinfo, source)
             self.plots.append(plot)
 
-    def _make_plot(self, plot_info: PlotInfo) -> Plot:
+    def update_viz(self, update_source: Callable[[ColumnDataSource, Dict[str, Any]], None]) -> bool:
+        """ Aggregates the data again and brings the created plots up to date, without creating any models
+
+        update_source gets the source of every plot with its new data and updates only what changed, numeric
+        ranges get the new extents and categorical ranges the new factors. This only works while every plot
+        keeps its panel and its kind of glyphs (eg. no new separator values and no rasterized plots), otherwise
+        nothing is changed, False is returned and a new Plotter has to create the viz.
+        """
+        if len(self.rasters) > 0 or self.shared_source is not None:
+            return False
+        old_data = self.data
+        self.aggregator.update_data()
+        layout = self.aggregator.layout
+        data = layout.get_rows(*self.rows) if self.rows[1] <= layout.nrows else []
+        same_panels = len(data) == len(old_data) and all(
+            new.is_in_plot_of(old.x_seps, old.y_seps) and new.column_names == old.column_names
+            for new, old in zip(data, old_data))
+        if not same_panels or self._get_constants(self.aggregator.data) != self.constants or \
+                len(self._rasterize(data)) > 0:
+            return False
+
+        self.data = data
+        with_points = self.details_url is not None
+        users = Counter(model._id for plot in self.plots for model in (plot.x_range, plot.y_range))
+        for plot_info, plot in zip(data, self.plots):
+            source = plot.select_one(dict(type=GlyphRenderer)).data_source
+            update_source(source, plot_info.get_viz_data(self.color_mapper is not None, self.constants.keys(),
+                                                         with_points))
+            for axis in ('x', 'y'):
+                self._update_range(plot, plot_info, axis, users)
+        return True
+
+    def _update_range(self, plot: Plot, plot_info: PlotInfo, axis: str, users: Dict[str, int]) -> None:
+        """ Sets the new extent or factors of a range, plots that share a range with others get a new one"""
+        plot_range = getattr(plot, f'{axis}_range')
+        if isinstance(plot_range, Range1d):
+            # numeric ranges are the same for all plots
+            plot_range.start, plot_range.end = self._get_extent(axis)
+            return
+        factors = list(pandas.unique(getattr(plot_info, f'{axis}_coords')))
+        if len(factors) == 0 or list(plot_range.factors) == factors:
+            return
+        if users[plot_range._id] == 1:
+            plot_range.factors = factors
+        else:
+            setattr(plot, f'{axis}_range', FactorRange(*factors))
+
+    def _make_plot(self, plot_info: PlotInfo, source: ColumnDataSource) -> Plot:
         """ Main function that orchestrates the creation of a bokeh.Plot object.
 
         Will delegate the parts of plot creation to other methods
         """
         log(self, f'Creating plot for {plot_info}')
-        source = ColumnDataSource(data=plot_info.get_viz_data())
 
         # RANGES
         x_range, y_range = self._get_range(plot_info, 'x'), self._get_range(plot_info, 'y')
@@ -55,24 +167,143 @@ class Plotter:
         self._add_axes_and_grids(plot, plot_info)
 
         # GLYPH
-        glyph = create_glyph(self.aggregator.config.mark_type, plot_info.column_names)
+        if id(plot_info) in self.rasters:
+            # dense plots are drawn as one image, which has no points to hover over
+            plot.add_glyph(source, ImageRGBA(image='image', x='x', y='y', dw='dw', dh='dh'))
+            if self.tile_url is not None and len(self.aggregator.data) == 1:
+                self._add_tile_callback(plot_info, source, x_range, y_range)
+            return plot
+
+        # glyphs only describe which columns are drawn how, the renderers of all plots can share them
+        col_names = plot_info.column_names
+        mark_type = self.aggregator.config.mark_type
+        glyph = self._get_shared(('glyph', col_names),
+                                 lambda: create_glyph(mark_type, col_names, self.color_mapper, self.constants))
         renderer = plot.add_glyph(source, glyph)
 
-        # HOVER
-        hover = generate_tooltip(renderer, plot_info)
+        # HOVER, tools belong to a single plot, only the details callback can be shared
+        if self.details_url is not None:
+            details = self._get_shared('details', lambda: create_details_callback(self.details_url))
+            hover = generate_details_tooltip(renderer, details)
+        else:
+            hover = generate_tooltip(renderer, plot_info)
         plot.add_tools(hover)
         return plot
 
+    def _create_sources(self, data: List[PlotInfo]) -> List[ColumnDataSource]:
+        """ Creates the data source of every plot, either one per plot or slices of a single shared one"""
+        color_indices = self.color_mapper is not None
+        with_points = self.details_url is not None
+        viz_data = [pi.get_viz_data(color_indices, self.constants.keys(), with_points) for pi in data]
+        if not self.use_shared_source or len(data) == 0:
+            self.shared_source = None
+            return [ColumnDataSource(data=plot_data) for plot_data in viz_data]
+
+        lengths = [pi.glyph_count for pi in data]
+        ends = numpy.cumsum(lengths)
+        shared_data = {col: numpy.concatenate([plot_data[col] for plot_data in viz_data]) for col in viz_data[0]}
+        # the plot every row belongs to, to select or update the rows of single plots
+        shared_data['_panel'] = numpy.repeat(numpy.arange(len(data)), lengths)
+        self.shared_source = ColumnDataSource(data=shared_data)
+        log(self, f'Created a shared source with {ends[-1]} rows for {len(data)} plots')
+        return [PanelDataSource(source=self.shared_source, start=int(end - length), end=int(end))
+                for length, end in zip(lengths, ends)]
+
+    def _rasterize(self, data: List[PlotInfo]) -> Dict[int, Raster]:
+        """ Bins the points of every plot above rasterize_above into one pixel grid of the size of the plot"""
+        if self.rasterize_above is None or self.aggregator.config.mark_type is not MarkType.CIRCLE:
+            return {}
+        dense = [pi for pi in data if pi.glyph_count > self.rasterize_above and
+                 _is_numeric(pi.x_coords) and _is_numeric(pi.y_coords)]
+        if len(dense) == 0:
+            return {}
+
+        x_extent, y_extent = self._get_extent('x'), self._get_extent('y')
+        width, height = self.aggregator.plot_width, self.aggregator.plot_height
+        color = self.aggregator.config.color
+        rasters = {}
+        for plot_info in dense:
+            # measure colors show the mean value of each pixel, all others the amount of points
+            by_measure = isinstance(plot_info.colorization_behaviour, MeasureColorizationBehaviour)
+            values = plot_info.get_values(color) if by_measure else None
+            rasters[id(plot_info)] = rasterize(plot_info.x_coords, plot_info.y_coords, x_extent, y_extent,
+                                               width, height, values)
+        log(self, f'Rasterized {len(dense)} plots to {width}x{height} pixels')
+        return rasters
+
+    def _create_image_source(self, plot_info: PlotInfo, raster: Raster) -> ColumnDataSource:
+        """ Colors the pixels of a raster with the color scale of the viz, empty pixels stay transparent"""
+        colorization = plot_info.colorization_behaviour
+        if isinstance(colorization, MeasureColorizationBehaviour):
+            relative = colorization.get_scale()(raster.get_means())
+            relative[raster.counts == 0] = numpy.nan
+            image = colorization.ramp.get_rgba(relative)
+        else:
+            max_count = max(r.counts.max() for r in self.rasters.values())
+            image = RAMPS[DEFAULT_RAMP].get_rgba(raster.get_density(max_count))
+        # the tile callback replaces the image by several tiles, so the position is part of the data
+        (x_start, x_end), (y_start, y_end) = raster.x_extent, raster.y_extent
+        return ColumnDataSource(data={'image': [image], 'x': [x_start], 'y': [y_start],
+                                      'dw': [x_end - x_start], 'dh': [y_end - y_start]})
+
+    def _add_tile_callback(self, plot_info: PlotInfo, source: ColumnDataSource, x_range: Range,
+                           y_range: Range) -> None:
+        """ Loads the tiles of the visible window whenever the plot is panned or zoomed
+
+        Tiles are binned from the same aggregated points as the first image (see plotserver.tiles()), so the tile
+        url names the viz. Tiles are not split by separators, so only single plots get them.
+        """
+        query = {'width': self.aggregator.plot_width, 'height': self.aggregator.plot_height}
+        callback = create_tile_callback(self.tile_url, source, x_range, y_range, query)
+        x_range.callback = callback
+        y_range.callback = callback
+
+    def _get_constants(self, data: List[PlotInfo]) -> Dict[str, Any]:
+        """ Returns the value of every channel that the query plan encodes with one fixed value"""
+        if len(data) == 0:
+            return {}
+        constant_channels = self.aggregator.plan.constant_channels
+        constants: Dict[str, Any] = {}
+        if 'color' in constant_channels:
+            constants['color'] = str(data[0].colors[0])
+        if 'size' in constant_channels:
+            constants['size'] = float(data[0].sizes[0])
+        return constants
+
+    def _get_color_mapper(self, data: List[PlotInfo]) -> Optional[ColorMapper]:
+        """ Creates the color mapper that is shared by all plots, if palette indices can be used for this viz"""
+        if not self.use_color_mapper or len(data) == 0 or self.aggregator.config.mark_type is MarkType.LINE:
+            return None
+        colorization = data[0].colorization_behaviour
+        if not isinstance(colorization, MeasureColorizationBehaviour):
+            return None
+        return create_color_mapper(colorization.ramp.palette)
+
+    def _get_shared(self, key: Hashable, create: Callable[[], Model]) -> Model:
+        """ Returns the model for the key, creating it on first use so all plots of the grid reference the same one"""
+        if key not in self._shared_models:
+            model = create()
+            if self.shared_id_prefix is not None:
+                model._id = f'{self.shared_id_prefix}-{hashlib.md5(repr(key).encode()).hexdigest()}'
+            self._shared_models[key] = model
+        return self._shared_models[key]
+
+    def get_shared_ids(self) -> List[str]:
+        """ The ids of all models that are shared by the plots, see _get_shared()"""
+        return [model._id for model in self._shared_models.values()]
+
     def _get_plot_options(self, plot_info: PlotInfo, x_range: Range, y_range: Range) -> Dict[str, Any]:
         """ Create the configuration object to instantiate a bokeh.Plot object"""
 
         options = {
-            'plot_width': int(1200 / self.aggregator.ncols),
-            'plot_height': int(800 / self.aggregator.nrows),
+            'plot_width': self.aggregator.plot_width,
+            'plot_height': self.aggregator.plot_height,
             'toolbar_location': None,
             'x_range': x_range,
             'y_range': y_range,
             'min_border': 0,
+            'title': None,
+            'tool_events': self._get_shared('tool_events', ToolEvents),
             'min_border_left': 0 if self.aggregator.is_in_first_column(plot_info) else 0  # FIXME ???
         }
 
@@ -124,30 +355,38 @@ class Plotter:
         # TODO FIXME figure out how to do this the best way, is currently only based on IS_STRING
         value = plot_info.get_example_avp_for_axis('x').val
         if not isinstance(value, str):
-            grid = Grid(dimension=0, ticker=x_tick, grid_line_dash='dotted')
+            grid = Grid(dimension=0, ticker=x_tick, **GRID_STYLE)
             plot.add_layout(grid)
 
         value = plot_info.get_example_avp_for_axis('y').val
         if not isinstance(value, str):
-            grid = Grid(dimension=1, ticker=y_tick, grid_line_dash='dotted')
+            grid = Grid(dimension=1, ticker=y_tick, **GRID_STYLE)
             plot.add_layout(grid)
 
     def _get_range(self, plot_info: PlotInfo, axis: str) -> Range:
-        """ Creates a bokeh.Range object for the given axis & plot_info"""
+        """ Creates a bokeh.Range object for the given axis & plot_info
+
+        Plots with the same range share the range object, so their axes are linked when panning or zooming.
+        """
 
         # TODO FIXME check based on dimension/measure instead of IS_STR
-        values = unique_list([avp.val for avp in getattr(plot_info, f'{axis}_coords')])
+        values = list(pandas.unique(getattr(plot_info, f'{axis}_coords')))
         if len(values) == 0:
             # handle the case of 0d0m-configs
             values = [plot_info.get_example_avp_for_axis(axis).val]
 
         if isinstance(values[0], str):
-            return FactorRange(*values)
+            return self._get_shared((axis, 'factors', tuple(values)), lambda: FactorRange(*values))
         else:
-            _min, _max = getattr(self.aggregator, f'{axis}_min'), getattr(self.aggregator, f'{axis}_max')
-            if _min == _max:
-                _min = 0
-            return Range1d(_min, _max)
+            _min, _max = self._get_extent(axis)
+            return self._get_shared((axis, 'range'), lambda: Range1d(_min, _max))
+
+    def _get_extent(self, axis: str) -> Extent:
+        """ The min and max value of the numeric range of an axis, which is the same for all plots"""
+        _min, _max = getattr(self.aggregator, f'{axis}_min'), getattr(self.aggregator, f'{axis}_max')
+        if _min == _max:
+            _min = 0
+        return _min, _max
 
     def _get_axis(self, data: PlotInfo, axis: str) -> Tuple[Ticker, Axis]:
         """ Creates and returns the axies object for a given axis direction & data"""
@@ -162,17 +401,38 @@ class Plotter:
             options['axis_label'] = sample_colname
 
         sample_value = data.get_example_avp_for_axis(axis).val
+        # axes belong to a single plot, but their tickers and formatters are shared by all plots
         if isinstance(sample_value, str):
-            ticker = CategoricalTicker()
-            axis = CategoricalAxis(ticker=ticker, major_label_orientation=pi / 2, **options)
+            ticker = self._get_shared('categorical_ticker', CategoricalTicker)
+            formatter = self._get_shared('categorical_formatter', CategoricalTickFormatter)
+            axis = CategoricalAxis(ticker=ticker, formatter=formatter, major_label_orientation=pi / 2, **options)
         else:
-            ticker = BasicTicker(num_minor_ticks=0)
-            axis = LinearAxis(ticker=ticker, **options)
+            ticker = self._get_shared('basic_ticker', lambda: BasicTicker(num_minor_ticks=0))
+            formatter = self._get_shared('basic_formatter', BasicTickFormatter)
+            axis = LinearAxis(ticker=ticker, formatter=formatter, **options)
 
         return ticker, axis
 
-    def get_output(self) -> BokehColumn:
-        """ Displays all generated plots in a grid"""
+    def get_output(self, toolbar_location: Optional[str] = 'above') -> BokehColumn:
+        """ Displays all generated plots in a grid, with one toolbar for all plots unless toolbar_location is None"""
         log(self, f'Generating output grid')
-        grid = gridplot(self.plots, ncols=self.aggregator.ncols)
+        plots = {id(plot_info): plot for plot_info, plot in zip(self.data, self.plots)}
+        # empty cells of sparse grids are passed as None, gridplot fills them with spacers
+        cells = self.aggregator.layout.cells[self.rows[0]:self.rows[1]]
+        children = [[plots[id(pi)] if pi is not None else None for pi in row] for row in cells]
+        grid = gridplot(children, toolbar_location=toolbar_location)
         return grid
+
+    def get_layout_info(self) -> Dict[str, Any]:
+        """ Describes the whole grid and the rows that were created, so clients can request the missing rows"""
+        info = self.aggregator.layout.to_dict()
+        info.update({
+            'rows': list(self.rows),
+            'plot_width': self.aggregator.plot_width,
+            'plot_height': self.aggregator.plot_height
+        })
+        return info
+
+
+def _is_numeric(values: numpy.ndarray) -> bool:
+    return len(values) > 0 and numpy.issubdtype(values.dtype, numpy.number)
@@ -1,44 +1,78 @@
-from bokeh.core.properties import field
-from bokeh.models import Glyph, VBar, Circle
+from typing import Any, Dict, List, Optional
+
+from bokeh.core.properties import field, value
+from bokeh.models import Glyph, VBar, Circle, ColorMapper, LinearColorMapper
 
 from datapylot.extensions.flexline import FlexLine
 from datapylot.utils import MarkType, ColumnNameCollection
 
+# a field of the data source, optionally with a transform such as a color mapper, or a fixed value
+ColorSpec = Dict[str, Any]
+SizeSpec = Dict[str, Any]
+# fixed values of channels, by channel name ('color', 'size')
+Constants = Dict[str, Any]
+
 
-def create_glyph(mark_type: MarkType, col_names: ColumnNameCollection) -> Glyph:
-    """ Creates a glyph based on the configuration"""
+def create_glyph(
+        mark_type: MarkType,
+        col_names: ColumnNameCollection,
+        color_mapper: Optional[ColorMapper] = None,
+        constants: Optional[Constants] = None
+) -> Glyph:
+    """ Creates a glyph based on the configuration
+
+    With a color_mapper, the color column is expected to contain palette indices instead of colors.
+    Channels ('color', 'size') in constants are set to their value instead of reading a column of the data source.
+    """
     _mark_to_glyph = {
         MarkType.LINE: _make_line,
         MarkType.BAR: _make_bar,
         MarkType.CIRCLE: _make_circle
     }
-    return _mark_to_glyph[mark_type](col_names)
+    if color_mapper is not None and mark_type is MarkType.LINE:
+        raise ValueError('Lines need one color per segment and do not support color mappers')
+    constants = constants or {}
+    color = value(constants['color']) if 'color' in constants else _color_spec(col_names, color_mapper)
+    size = value(constants['size']) if 'size' in constants else field(col_names.size)
+    return _mark_to_glyph[mark_type](col_names, color, size)
+
+
+def create_color_mapper(palette: List[str]) -> LinearColorMapper:
+    """ Creates a color mapper that turns palette indices (as in ColorRamp.get_indices()) into colors
+    """
+    return LinearColorMapper(palette=palette, low=0, high=len(palette) - 1)
+
+
+def _color_spec(col_names: ColumnNameCollection, color_mapper: Optional[ColorMapper]) -> ColorSpec:
+    if color_mapper is None:
+        return field(col_names.color)
+    return {'field': col_names.color, 'transform': color_mapper}
 
 
-def _make_line(col_names: ColumnNameCollection) -> Glyph:
+def _make_line(col_names: ColumnNameCollection, color: ColorSpec, size: SizeSpec) -> Glyph:
     return FlexLine(
         x=field(col_names.x),
         y=field(col_names.y),
-        size=field(col_names.size),
-        colors=field(col_names.color)
+        size=size,
+        colors=color
     )
 
 
-def _make_bar(col_names: ColumnNameCollection) -> Glyph:
+def _make_bar(col_names: ColumnNameCollection, color: ColorSpec, size: SizeSpec) -> Glyph:
     return VBar(
         x=field(col_names.x),
         top=field(col_names.y),
-        fill_color=field(col_names.color),
-        line_color=field(col_names.color),
-        width=field(col_names.size)
+        fill_color=color,
+        line_color=color,
+        width=size
     )
 
 
-def _make_circle(col_names: ColumnNameCollection) -> Glyph:
+def _make_circle(col_names: ColumnNameCollection, color: ColorSpec, size: SizeSpec) -> Glyph:
     return Circle(
         x=field(col_names.x),
         y=field(col_names.y),
-        fill_color=field(col_names.color),
-        line_color=field(col_names.color),
-        size=field(col_names.size)
+        fill_color=color,
+        line_color=color,
+        size=size
     )
@@ -0,0 +1,173 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy
+from bokeh.application import Application
+from bokeh.application.handlers import FunctionHandler
+from bokeh.document import Document
+from bokeh.models import ColumnDataSource, LayoutDOM
+from bokeh.server.server import Server
+
+from datapylot.data.cost import CostPolicy
+from datapylot.data.datasource import Datasource
+from datapylot.data.vizconfig import VizConfig
+from datapylot.logger import log
+from datapylot.plotting.bokeh_plotter import Plotter
+from datapylot.plotting.session import ModelMerger
+
+# milliseconds between two updates of the open plots, all rows appended in between are sent in one update
+LIVE_INTERVAL = 1000
+
+
+class LiveViz:
+    """ A viz that follows the rows appended to its datasource, for the documents of a bokeh server
+
+    The datasource merges appended rows into its cached aggregates (see Datasource.append_rows()), so an update
+    only aggregates the new rows for measures that can be rolled up. While the grid keeps its panels, the plots
+    are updated in place (see Plotter.update_viz()): sources get their appended aggregates streamed and their
+    changed ones patched, so the work and the update sent to the clients grow with the amount of changed
+    aggregates and not with the size of the data or the plots. Sources whose rows moved are replaced. If panels
+    are added or removed, the viz is created again and merged into the current models like a VizSession.
+    """
+
+    def __init__(self, datasource: Datasource, config: VizConfig, policy: Optional[CostPolicy] = None) -> None:
+        self.datasource = datasource
+        self.config = config
+        self.policy = policy
+        with datasource.lock:
+            self.version = datasource.version
+            self.plotter = self._create_plotter()
+        self.root = self.plotter.get_output()
+        # stream() and patch() change the columns in place, which must not change the aggregates of the datasource
+        for source in self.root.select(dict(type=ColumnDataSource)):
+            source.data = _copy_columns(source.data)
+
+    def update(self) -> bool:
+        """ Brings the models up to date with the datasource, returns if there were new rows
+        """
+        # rows that are appended meanwhile wait, so the whole update sees the same data
+        with self.datasource.lock:
+            if self.datasource.version == self.version:
+                return False
+            self.version = self.datasource.version
+            merger = StreamingMerger()
+            if not self.plotter.update_viz(merger.update_source):
+                plotter = self._create_plotter()
+                merger.merge(self.root, plotter.get_output())
+                # the plots of the new plotter that were merged are the ones of the document now
+                plotter.plots = [merger.matches.get(id(plot), plot) for plot in plotter.plots]
+                self.plotter = plotter
+        log(self, f'Streamed {merger.streamed}, patched {merger.patched} and replaced {merger.replaced} rows')
+        return True
+
+    def _create_plotter(self) -> Plotter:
+        plotter = Plotter(self.datasource, self.config, self.policy)
+        plotter.create_viz()
+        return plotter
+
+
+class StreamingMerger(ModelMerger):
+    """ Updates the data of kept sources with stream() and patch(), see LiveViz
+    """
+
+    # sources with more changed rows than this share are replaced instead of patched
+    max_patch_share = 0.5
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.streamed = 0
+        self.patched = 0
+        self.replaced = 0
+
+    def merge_columns(self, old: ColumnDataSource, new: ColumnDataSource) -> None:
+        self.update_source(old, new.data)
+
+    def update_source(self, source: ColumnDataSource, data: Dict[str, Any]) -> None:
+        """ Streams the appended and patches the changed rows of data into source, or replaces all of its data
+        """
+        changes = _diff_columns(source.data, data)
+        changed_rows = set() if changes is None else {index for patch in changes[0].values() for index, _ in patch}
+        if changes is None or len(changed_rows) > self.max_patch_share * _get_length(source.data):
+            self.replaced += _get_length(data)
+            source.data = _copy_columns(data)
+            return
+        patches, appended = changes
+        if patches:
+            source.patch(patches)
+            self.patched += len(changed_rows)
+        if appended is not None:
+            source.stream(appended)
+            self.streamed += _get_length(appended)
+
+
+ColumnChanges = Tuple[Dict[str, List[Tuple[int, Any]]], Optional[Dict[str, numpy.ndarray]]]
+
+
+def _diff_columns(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[ColumnChanges]:
+    """ Returns the patches of the existing rows and the appended rows (or None), None if the data can't be patched
+
+    Only sources with the same one dimensional columns of the same types and at least as many rows as before
+    can be patched. Dates are always replaced, bokeh sends them differently in patches than in columns.
+    """
+    if old.keys() != new.keys() or len(old) == 0:
+        return None
+    for name, values in new.items():
+        if not isinstance(values, numpy.ndarray) or not isinstance(old[name], numpy.ndarray):
+            return None
+        if values.ndim != 1 or values.dtype != old[name].dtype or values.dtype.kind == 'M':
+            return None
+    length = _get_length(old)
+    if _get_length(new) < length:
+        return None
+
+    patches = {}
+    for name, values in new.items():
+        head, previous = values[:length], old[name]
+        differs = previous != head
+        if head.dtype.kind == 'f':
+            differs &= ~(numpy.isnan(previous) & numpy.isnan(head))
+        changed = numpy.flatnonzero(differs)
+        if len(changed) > 0:
+            patches[name] = list(zip(changed.tolist(), head[changed].tolist()))
+    appended = None
+    if _get_length(new) > length:
+        appended = {name: values[length:] for name, values in new.items()}
+    return patches, appended
+
+
+def _get_length(data: Dict[str, Any]) -> int:
+    return len(next(iter(data.values()), []))
+
+
+def _copy_columns(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: values.copy() if isinstance(values, numpy.ndarray) else values for name, values in data.items()}
+
+
+def create_live_application(
+        datasource: Datasource,
+        config: VizConfig,
+        policy: Optional[CostPolicy] = None,
+        interval: int = LIVE_INTERVAL
+) -> Application:
+    """ Creates a bokeh application that shows the viz in every session and updates it every interval milliseconds
+    """
+    def create_document(document: Document) -> None:
+        live = LiveViz(datasource, config, policy)
+        document.add_root(live.root)
+        document.add_periodic_callback(live.update, interval)
+
+    return Application(FunctionHandler(create_document))
+
+
+def serve_live(
+        datasource: Datasource,
+        config: VizConfig,
+        policy: Optional[CostPolicy] = None,
+        port: int = 5006
+) -> None:
+    """ Runs a bokeh server with a live viz on localhost until it is stopped
+
+    Rows can be appended from other threads, the lock of the datasource keeps them out of running updates.
+    """
+    server = Server({'/': create_live_application(datasource, config, policy)}, port=port)
+    log('live', f'Serving the live viz on http://localhost:{port}/')
+    server.run_until_shutdown()
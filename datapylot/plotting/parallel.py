@@ -0,0 +1,125 @@
+import json
+import os
+from collections import namedtuple
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Tuple
+
+from bokeh import __version__ as bokeh_version
+from bokeh.core.json_encoder import serialize_json
+from bokeh.core.templates import DOC_JS, PLOT_DIV
+from bokeh.document import Document
+from bokeh.util.compiler import bundle_all_models
+from bokeh.util.serialization import make_id
+
+from datapylot.data.cost import CostPolicy
+from datapylot.data.datasource import Datasource
+from datapylot.data.vizconfig import VizConfig
+from datapylot.data_preparation.aggregator import Aggregator
+from datapylot.logger import log
+from datapylot.plotting.bokeh_plotter import Plotter, RowWindow
+
+# every worker gets this many tasks on average, so workers that finish early can take over rows of slower ones
+TASKS_PER_PROCESS = 4
+
+
+# the models of some rows of the grid, as created by one task of the pool: the id of their root, the json
+# of the models that only belong to these rows and the json of the models that are shared with other rows by id
+Fragment = namedtuple('Fragment', ['root_id', 'references', 'shared'])
+
+
+# the aggregated data of the whole grid and the prefix of the shared ids, set once per process by _init_worker()
+_worker_args = None  # type: Optional[Tuple[Aggregator, str]]
+
+
+def create_components(
+        datasource: Datasource,
+        config: VizConfig,
+        policy: Optional[CostPolicy] = None,
+        processes: Optional[int] = None
+) -> Tuple[str, str]:
+    """ Returns the script and div of the grid like bokeh.embed.components(), with the rows created in parallel
+
+    The data is aggregated once, then the rows of the grid are split into windows whose plots are created and
+    serialized by a pool of processes (see Plotter.create_plots()), the main process only joins the models of
+    the windows into one document. The models that are shared by all plots get the same ids in every process,
+    so they are only sent once and the plots of all windows are still linked. Unlike Plotter.get_output(), the
+    tools of the plots are not merged into a toolbar. With processes=1, everything runs in this process.
+    """
+    aggregator = Aggregator(datasource, config, policy)
+    aggregator.update_data()
+    nrows = aggregator.layout.nrows
+    processes = processes or os.cpu_count() or 1
+    rows_per_task = max(1, -(-nrows // (processes * TASKS_PER_PROCESS)))
+    windows = [(start, start + rows_per_task) for start in range(0, nrows, rows_per_task)]
+    log('parallel', f'Creating {nrows} rows in {len(windows)} tasks on {processes} processes')
+
+    args = (aggregator, make_id())
+    if processes == 1:
+        _init_worker(*args)
+        fragments = [_create_fragment(window) for window in windows]
+    else:
+        # workers are forked, so the aggregated data is shared with them instead of being pickled
+        with Pool(processes, initializer=_init_worker, initargs=args) as pool:
+            fragments = pool.map(_create_fragment, windows)
+    return _join_fragments(fragments)
+
+
+def _init_worker(aggregator: Aggregator, shared_id_prefix: str) -> None:
+    global _worker_args
+    _worker_args = (aggregator, shared_id_prefix)
+
+
+def _create_fragment(window: RowWindow) -> Fragment:
+    aggregator, shared_id_prefix = _worker_args
+    plotter = Plotter(aggregator.datasource, aggregator.requested_config, aggregator.policy)
+    plotter.aggregator = aggregator
+    plotter.shared_id_prefix = shared_id_prefix
+    plotter.create_plots(rows=window)
+    grid = plotter.get_output(toolbar_location=None)
+
+    document = Document()
+    document.add_root(grid)
+    references = json.loads(document.to_json_string())['roots']['references']
+    shared_ids = set(plotter.get_shared_ids())
+    own = [ref for ref in references if ref['id'] not in shared_ids]
+    shared = {ref['id']: ref for ref in references if ref['id'] in shared_ids}
+    return Fragment(grid._id, own, shared)
+
+
+def _join_fragments(fragments: List[Fragment]) -> Tuple[str, str]:
+    """ Puts the models of all fragments into one document with a column of all fragments as root
+    """
+    root_id, doc_id, element_id = make_id(), make_id(), make_id()
+    shared = {}  # type: Dict[str, Dict[str, Any]]
+    for fragment in fragments:
+        shared.update(fragment.shared)
+    root = {
+        'type': 'Column',
+        'id': root_id,
+        'attributes': {'children': [{'type': 'Column', 'id': fragment.root_id} for fragment in fragments]}
+    }
+    references = [root] + list(shared.values()) + [ref for fragment in fragments for ref in fragment.references]
+    docs_json = {
+        doc_id: {
+            'roots': {'references': references, 'root_ids': [root_id]},
+            'title': 'Bokeh Application',
+            'version': bokeh_version
+        }
+    }
+    render_items = [{'docid': doc_id, 'elementid': element_id, 'modelid': root_id}]
+    return _embed_documents(docs_json, render_items), PLOT_DIV.render(elementid=element_id)
+
+
+def _embed_documents(docs_json: Dict[str, Any], render_items: List[Dict[str, str]]) -> str:
+    """ Returns the script tag of bokeh.embed.components() for documents that are already serialized
+
+    components() only takes models, which only exist in the worker processes. The wrappers it uses are internals
+    of bokeh 0.12, this is the only place that depends on them, so a bokeh upgrade only needs to be checked here.
+    """
+    try:
+        from bokeh.embed import _wrap_in_onload, _wrap_in_safely, _wrap_in_script_tag
+    except ImportError as e:
+        raise RuntimeError(f'Can not embed serialized documents with bokeh {bokeh_version}') from e
+    embed_js = DOC_JS.render(docs_json=json.dumps(docs_json), render_items=serialize_json(render_items))
+    script = bundle_all_models() + _wrap_in_onload(_wrap_in_safely(embed_js))
+    return _wrap_in_script_tag(script)
@@ -0,0 +1,147 @@
+from typing import Any, Dict, List, Optional, Set
+
+import numpy
+from bokeh.document import Document
+from bokeh.embed import components
+from bokeh.model import Model, collect_models
+from bokeh.models import ColumnDataSource, LayoutDOM
+
+from datapylot.logger import log
+
+
+class VizSession:
+    """ Keeps the document of the last viz that was sent to a client, so the next viz can be sent as a patch of it
+
+    The models of the next viz are merged into the models of the current document: models of the same type
+    at the same place in both vizzes are kept and only get the properties that changed, all other models are
+    added. Changed columns of data sources are sent on their own, so eg. changing the color of the viz only sends
+    the new color columns and the glyphs that use them, not the coordinates, axes and ranges of every plot.
+    """
+
+    def __init__(self) -> None:
+        self.document = None  # type: Optional[Document]
+
+    def get_update(self, root: LayoutDOM) -> Dict[str, Any]:
+        """ Returns the message that brings the client from the current to the new viz, to be sent with serialize_json()
+
+        The first viz (or one that doesn't fit the current document at all) is sent as 'script' and 'div' like
+        bokeh.embed.components() creates them. All others are sent as 'patch' for the document of the 'root' model
+        (see bokeh's Document.apply_json_patch()) and as 'columns' with the changed and 'removed' columns of
+        every data source by its id.
+        """
+        if self.document is None or type(self.document.roots[0]) is not type(root):
+            self.document = Document()
+            self.document.add_root(root)
+            script, div = components(root)
+            return {'script': script, 'div': div}
+
+        old_root = self.document.roots[0]
+        known_ids = {model._id for model in old_root.references()}
+        events = []
+
+        def collect(event):
+            events.append(event)
+
+        merger = ModelMerger()
+        self.document.on_change(collect)
+        try:
+            merger.merge(old_root, root)
+        finally:
+            self.document.remove_on_change(collect)
+
+        # data changes are sent as columns, the patch only contains the other properties
+        changes = [event for event in events if not (event.attr == 'data' and event.model._id in merger.columns)]
+        patch = _create_patch(changes, known_ids)
+        log(self, f'Patching {len(changes)} properties and the columns of {len(merger.columns)} sources')
+        return {'root': old_root._id, 'patch': patch, 'columns': merger.columns}
+
+
+class ModelMerger:
+    """ Merges the models of a new viz into the models of the current one, see VizSession
+
+    The data of kept sources is replaced and its changed columns are collected, subclasses can override
+    merge_columns() to update the sources differently.
+    """
+
+    def __init__(self) -> None:
+        # the kept model for every merged new model, by id() of the new model
+        self.matches: Dict[int, Model] = {}
+        # ids of the kept models, each is only merged with one new model
+        self.merged: Set[str] = set()
+        # the changed and removed columns of the kept data sources, by their id
+        self.columns: Dict[str, Dict[str, Any]] = {}
+
+    def merge(self, old: Model, new: Model) -> Model:
+        """ Sets the properties of old to the ones of new, returns the model to use instead of new
+        """
+        if id(new) in self.matches:
+            return self.matches[id(new)]
+        if type(old) is not type(new) or old._id in self.merged:
+            return new
+        self.matches[id(new)] = old
+        self.merged.add(old._id)
+        for name in sorted(new.properties()):
+            if name == 'data' and isinstance(new, ColumnDataSource):
+                self.merge_columns(old, new)
+                continue
+            old_value = getattr(old, name)
+            value = self._merge_value(old_value, getattr(new, name))
+            if not same_values(old_value, value):
+                setattr(old, name, value)
+        return old
+
+    def _merge_value(self, old_value: Any, new_value: Any) -> Any:
+        if isinstance(new_value, Model):
+            return self.merge(old_value, new_value) if isinstance(old_value, Model) else new_value
+        if isinstance(new_value, (list, tuple)) and isinstance(old_value, (list, tuple)):
+            # items are matched by their position
+            merged = [self._merge_value(old, new) for old, new in zip(old_value, new_value)]
+            merged += new_value[len(old_value):]
+            return tuple(merged) if isinstance(new_value, tuple) else merged
+        if isinstance(new_value, dict) and isinstance(old_value, dict):
+            return {key: self._merge_value(old_value.get(key), value) for key, value in new_value.items()}
+        return new_value
+
+    def merge_columns(self, old: ColumnDataSource, new: ColumnDataSource) -> None:
+        old_data, new_data = old.data, new.data
+        changed = {name: values for name, values in new_data.items()
+                   if name not in old_data or not same_values(old_data[name], values)}
+        removed = [name for name in old_data if name not in new_data]
+        if changed or removed:
+            self.columns[old._id] = {'data': changed, 'removed': removed}
+            old.data = dict(new_data)
+
+
+def same_values(old: Any, new: Any) -> bool:
+    """ Compares property values, arrays by their values and models by their identity
+    """
+    if isinstance(old, Model) or isinstance(new, Model):
+        return old is new
+    if isinstance(old, numpy.ndarray) or isinstance(new, numpy.ndarray):
+        return (isinstance(old, numpy.ndarray) and isinstance(new, numpy.ndarray) and old.dtype == new.dtype and
+                numpy.array_equal(old, new))
+    if isinstance(old, (list, tuple)) and isinstance(new, (list, tuple)):
+        return len(old) == len(new) and all(same_values(o, n) for o, n in zip(old, new))
+    if isinstance(old, dict) and isinstance(new, dict):
+        return old.keys() == new.keys() and all(same_values(old[key], new[key]) for key in old)
+    return type(old) is type(new) and old == new
+
+
+def _create_patch(events: List[Any], known_ids: Set[str]) -> Dict[str, Any]:
+    """ Like Document.create_json_patch_string(), but models that the client already has are only referenced
+
+    Bokeh sends every model that is reachable from a changed property, eg. all plots of a row if one of them is
+    replaced, including their data. Known models only need their id and type to be resolved by the client.
+    """
+    json_events = []
+    references: Dict[str, Dict[str, Any]] = {}
+    for event in events:
+        json_events.append({'kind': 'ModelChanged', 'model': event.model.ref, 'attr': event.attr,
+                            'new': event.serializable_new})
+        for model in collect_models(event.new):
+            if model._id in references:
+                continue
+            reference = model.ref
+            reference['attributes'] = {} if model._id in known_ids else model._to_json_like(include_defaults=False)
+            references[model._id] = reference
+    return {'events': json_events, 'references': list(references.values())}
@@ -0,0 +1,64 @@
+import json
+from typing import Any, Dict
+from urllib.parse import urlencode
+
+from bokeh.models import ColumnDataSource, CustomJS
+from bokeh.models.ranges import Range
+
+# waits until the ranges stopped changing for this many milliseconds before loading tiles
+TILE_DELAY = 100
+
+# the response contains the pixels of every tile as base64 encoded, little endian uint32 colors
+TILE_CODE = '''
+var url = %(url)s + '&' + [
+    'x_start=' + x_range.start, 'x_end=' + x_range.end,
+    'y_start=' + y_range.start, 'y_end=' + y_range.end
+].join('&');
+clearTimeout(source._tile_timeout);
+source._tile_timeout = setTimeout(function() {
+    var request = new XMLHttpRequest();
+    request.open('GET', url);
+    request.onload = function() {
+        if (request.status !== 200) {
+            return;
+        }
+        var data = {image: [], x: [], y: [], dw: [], dh: []};
+        JSON.parse(request.responseText).tiles.forEach(function(tile) {
+            var bytes = atob(tile.image);
+            var buffer = new Uint8Array(bytes.length);
+            for (var i = 0; i < bytes.length; i++) {
+                buffer[i] = bytes.charCodeAt(i);
+            }
+            var pixels = new Uint32Array(buffer.buffer);
+            var rows = [];
+            for (var row = 0; row < tile.shape[0]; row++) {
+                rows.push(Array.prototype.slice.call(pixels, row * tile.shape[1], (row + 1) * tile.shape[1]));
+            }
+            data.image.push(rows);
+            data.x.push(tile.x);
+            data.y.push(tile.y);
+            data.dw.push(tile.dw);
+            data.dh.push(tile.dh);
+        });
+        source.data = data;
+    };
+    request.send();
+}, %(delay)d);
+'''
+
+
+def create_tile_callback(
+        tile_url: str,
+        source: ColumnDataSource,
+        x_range: Range,
+        y_range: Range,
+        query: Dict[str, Any]
+) -> CustomJS:
+    """ Creates a callback for the ranges of a plot that replaces the images in source with the tiles of the new range
+
+    The url must already have a query that names the viz, the query (size of the plot) is appended to it,
+    see plotserver.tiles().
+    """
+    # callbacks only get models as arguments, the url is part of the code
+    code = TILE_CODE % {'url': json.dumps(f'{tile_url}&{urlencode(query)}'), 'delay': TILE_DELAY}
+    return CustomJS(code=code, args={'source': source, 'x_range': x_range, 'y_range': y_range})
@@ -1,30 +1,110 @@
+import json
 from itertools import chain
 
-from bokeh.models import HoverTool, GlyphRenderer
+from bokeh.models import CustomJS, HoverTool, GlyphRenderer
 
 from datapylot.data_preparation.plotinfo import PlotInfo
 
+# the same for all plots of a grid, only the separators of the plot are filled in
+TOOLTIP_TEMPLATE = """
+    <div>
+        <span style="font-size: 15px;">{x_colname}: @{x_colname}</span><br>
+        <span style="font-size: 15px;">{y_colname}: @{y_colname}</span>
+    </div>
+    <div>
+        <span style="font-size: 10px;">{separators}</span><br>
+        {channels}
+    </div>
+    """
+CHANNEL_TEMPLATE = '<span style="font-size: 15px;">{label}: @{column}</span><br>'
+
+# shows the details of the hovered point next to the mouse, they are loaded once per point from the server
+# the code is shared by the tooltips of all plots, they call it with their source as cb_obj
+DETAILS_CODE = '''
+var source = cb_obj;
+var box = document.getElementById('details-tooltip');
+if (box === null) {
+    box = document.createElement('div');
+    box.id = 'details-tooltip';
+    box.style.cssText = 'position: fixed; display: none; z-index: 100; padding: 4px 8px; font-size: 13px; ' +
+        'background: white; border: 1px solid #ccc; pointer-events: none;';
+    document.body.appendChild(box);
+    document.addEventListener('mousemove', function(event) {
+        box.style.left = (event.clientX + 15) + 'px';
+        box.style.top = (event.clientY + 15) + 'px';
+    });
+}
+var indices = cb_data.index['1d'].indices;
+if (indices.length === 0) {
+    box.style.display = 'none';
+    return;
+}
+var point = source.data._point[indices[0]];
+function show(details) {
+    box.innerHTML = '';
+    Object.keys(details).forEach(function(name) {
+        var line = document.createElement('div');
+        line.textContent = name + ': ' + details[name];
+        box.appendChild(line);
+    });
+    box.style.display = 'block';
+}
+source._details = source._details || {};
+if (point in source._details) {
+    show(source._details[point]);
+    return;
+}
+var request = new XMLHttpRequest();
+request.open('GET', %(url)s + '&point=' + point);
+request.onload = function() {
+    if (request.status === 200) {
+        source._details[point] = JSON.parse(request.responseText).details;
+        show(source._details[point]);
+    }
+};
+request.send();
+'''
+
 
 def generate_tooltip(renderer: GlyphRenderer, plot_info: PlotInfo) -> HoverTool:
-    """ Creates and returns the tooltip-template for this plot"""
+    """ Creates and returns the tooltip-template for this plot
+
+    Unlike tickers and glyphs, hover tools can't be shared by the plots of a grid: bokeh binds every tool to a
+    single plot and tooltips are a plain string, not a model. So every plot gets its own tool and tooltip html.
+    """
     # TODO FIXME: Figure out how to approach this, currently basically only a tech demo
     # TODO FIXME: need to hover it upwards of the point, otherwise it's shadowed by plots further down
-    x_colname = plot_info.x_coords[0].attr.col_name if len(plot_info.x_coords) > 0 else ''  # FIXME #25
-    y_colname = plot_info.y_coords[0].attr.col_name if len(plot_info.y_coords) > 0 else ''  # FIXME #25
+    x_colname = plot_info.get_example_avp_for_axis('x').attr.col_name  # FIXME #25
+    y_colname = plot_info.get_example_avp_for_axis('y').attr.col_name  # FIXME #25
 
     other_attributes = chain(plot_info.x_seps, plot_info.y_seps)
-    additional = set(f'{avp.attr.col_name}: {avp.val}' for avp in other_attributes)
+    # sorted, so the separators are listed in the same order in every plot
+    additional = sorted(set(f'{avp.attr.col_name}: {avp.val}' for avp in other_attributes))
 
-    tooltip = f"""
-    <div>
-        <span style="font-size: 15px;">{x_colname}: @{x_colname}</span><br>
-        <span style="font-size: 15px;">{y_colname}: @{y_colname}</span>
-    </div>
-    <div>
-        <span style="font-size: 10px;">{'<br>'.join(additional)}</span><br>
-        <span style="font-size: 15px;">Size: @_size</span><br>
-        <span style="font-size: 15px;">Color: @_color</span>
+    # constant colors and sizes are not part of the data, so they are only shown if they vary
+    column_names = renderer.data_source.column_names
+    channels = [CHANNEL_TEMPLATE.format(label=label, column=column)
+                for label, column in (('Size', '_size'), ('Color', '_color')) if column in column_names]
 
-    </div>
-    """
+    tooltip = TOOLTIP_TEMPLATE.format(x_colname=x_colname, y_colname=y_colname,
+                                      separators='<br>'.join(additional), channels='\n        '.join(channels))
     return HoverTool(tooltips=tooltip, anchor='top_center', renderers=[renderer])
+
+
+def create_details_callback(details_url: str) -> CustomJS:
+    """ Creates the callback that loads and shows the details of points from details_url, see PointDetails
+
+    The url must already have a query, the point is appended to it.
+    """
+    # callbacks only get models as arguments, the url is part of the code
+    return CustomJS(code=DETAILS_CODE % {'url': json.dumps(details_url)})
+
+
+def generate_details_tooltip(renderer: GlyphRenderer, details_callback: CustomJS) -> HoverTool:
+    """ Creates a tooltip that shows the details of the hovered point with a callback of create_details_callback()
+
+    The data source of the renderer only needs the column '_point', no matter how many details are shown.
+    """
+    code = 'details.execute(source, cb_data);'
+    callback = CustomJS(code=code, args={'details': details_callback, 'source': renderer.data_source})
+    return HoverTool(tooltips=None, callback=callback, renderers=[renderer])
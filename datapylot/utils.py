@@ -6,6 +6,10 @@ Number = Union[int, float]
 T = TypeVar('T')
 ColumnNameCollection = namedtuple('ColumnNameCollection', ['x', 'y', 'color', 'size'])
 
+# size of the whole grid of plots in pixels, each plot gets an equal share
+GRID_WIDTH = 1200
+GRID_HEIGHT = 800
+
 
 def make_unique_string_list(content: List[str]):
     s: set = set()
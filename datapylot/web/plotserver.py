@@ -1,25 +1,130 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+from bokeh.core.json_encoder import serialize_json
 from bokeh.embed import file_html, components
+from bokeh.models import LayoutDOM
 from bokeh.resources import CDN
-from flask import Flask, render_template, request
-from functools import lru_cache
-from typing import List, Dict
+from bokeh.util.serialization import make_id
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context, url_for
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from threading import RLock
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from datapylot.data.attributes import Dimension, Measure, Attribute
+from datapylot.data.cost import CostPolicy
 from datapylot.data.datasource import Datasource
+from datapylot.data.tiles import TilePyramid
 from datapylot.data.vizconfig import VizConfig
+from datapylot.data_preparation.colorization_behaviour import MeasureColorizationBehaviour
+from datapylot.data_preparation.colorizer import DEFAULT_RAMP, RAMPS
+from datapylot.data_preparation.details import PointDetails
+from datapylot.data_preparation.export import MIME_TYPES, export_aggregates, export_rows
+from datapylot.data_preparation.query_plan import QueryPlan
+from datapylot.data_preparation.rasterizer import Raster
+from datapylot.data_preparation.scales import LinearScale
 from datapylot.plotting.bokeh_plotter import Plotter
+from datapylot.plotting.session import VizSession
 
 app = Flask(__name__)
 
 # TODO: Only for developing the base implementation, replace this with filechooser
 TEST_DS = 'test/data/testdata.csv'
 
+# protects the workers from configs that would create huge vizzes, eg. by splitting plots by 'Order ID'
+# only PAGE_ROWS rows of plots are created per request, so the amount of plots can be higher than the glyphs allow
+SERVER_POLICY = CostPolicy(max_plots=5000, max_glyphs=50000, action='top_n')
 
+# rows of the grid that are created per request, the client loads further rows when they are scrolled to
+PAGE_ROWS = 10
+
+# tile pyramids are built once per viz and then loaded from here
+TILE_DIRECTORY = os.path.join(tempfile.gettempdir(), 'datapylot_tiles')
+
+# the documents of the clients by their session id, the least recently updated ones are dropped first
+SESSIONS = OrderedDict()  # type: OrderedDict[str, VizSession]
+MAX_SESSIONS = 32
+
+# the configs of the shown vizzes (after the cost policy) by the key of their form, to find the details of points
+VIZ_CONFIGS = OrderedDict()  # type: OrderedDict[str, VizConfig]
+MAX_VIZ_CONFIGS = 64
+
+# requests are handled by several threads, this guards the sessions, configs and caches of this module.
+# Datasources have their own lock, so long requests (eg. exports) only hold this one while they look things up
+LOCK = RLock()
+
+
+def _locked(function: Callable) -> Callable:
+    @wraps(function)
+    def locked(*args: Any, **kwargs: Any) -> Any:
+        with LOCK:
+            return function(*args, **kwargs)
+    return locked
+
+
+@_locked
 @lru_cache(maxsize=64)
 def get_cached_datasource(ds_name: str) -> Datasource:
     ds = Datasource.from_csv(ds_name)
     return ds
 
 
+@_locked
+@lru_cache(maxsize=16)
+def get_cached_tile_pyramid(viz_key: str) -> TilePyramid:
+    """ Bins the points of a single plot viz, the same aggregated and filtered points that its first image shows
+    """
+    filename = os.path.join(TILE_DIRECTORY, viz_key + '.npz')
+    # pyramids that are older than the datasource are outdated
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(TEST_DS):
+        return TilePyramid.load(filename)
+    config = VIZ_CONFIGS[viz_key]
+    plot_infos = QueryPlan.compile(get_cached_datasource(TEST_DS), config).optimize().execute()
+    if len(plot_infos) != 1:
+        raise ValueError(f'Only vizzes with a single plot have tiles, {config} has {len(plot_infos)} plots')
+    plot_info = plot_infos[0]
+    values = None
+    if isinstance(plot_info.colorization_behaviour, MeasureColorizationBehaviour):
+        values = plot_info.get_values(config.color)
+    pyramid = TilePyramid.build(plot_info.x_coords, plot_info.y_coords, values)
+    os.makedirs(TILE_DIRECTORY, exist_ok=True)
+    pyramid.save(filename)
+    return pyramid
+
+
+@_locked
+@lru_cache(maxsize=16)
+def get_cached_point_details(viz_key: str) -> PointDetails:
+    return PointDetails(get_cached_datasource(TEST_DS), VIZ_CONFIGS[viz_key])
+
+
+def get_viz_key(form: Dict[str, str]) -> str:
+    # the same for all pages of a grid, so the tooltips of all pages share the cached details
+    return hashlib.md5(repr(sorted(form.items())).encode()).hexdigest()
+
+
+def encode_tile(pyramid: TilePyramid, level: int, raster: Raster) -> Dict[str, Any]:
+    """ Colors the pixels of a tile like Plotter colors rasters and packs them for the tile callback
+    """
+    ramp = RAMPS[DEFAULT_RAMP]
+    if raster.sums is not None:
+        relative = LinearScale(*pyramid.value_extent, 0, 1)(raster.get_means())
+    else:
+        relative = raster.get_density(pyramid.get_max_count(level))
+    image = ramp.get_rgba(relative)
+    (x_start, x_end), (y_start, y_end) = raster.x_extent, raster.y_extent
+    return {
+        'x': x_start,
+        'y': y_start,
+        'dw': x_end - x_start,
+        'dh': y_end - y_start,
+        'shape': list(image.shape),
+        'image': base64.b64encode(image.astype('<u4').tobytes()).decode('ascii')
+    }
+
+
 def get_datasource_attributes(ds_name: str) -> Dict[str, str]:
     return get_cached_datasource(ds_name).columns
 
@@ -48,19 +153,52 @@ def make_conf_from_form(data: Dict[str, str]) -> VizConfig:
     return VizConfig.from_dict(viz_dict)
 
 
+def create_page(form: Dict[str, str], start: int) -> Tuple[LayoutDOM, Dict[str, Any]]:
+    """ Creates the plots of PAGE_ROWS rows of the grid from row start on, returns them with the info of the grid
+    """
+    config = make_conf_from_form(form)
+    ds = get_cached_datasource(TEST_DS)
+    plotter = Plotter(ds, config, SERVER_POLICY)
+    viz_key = get_viz_key(form)
+    plotter.tile_url = url_for('tiles', viz=viz_key)
+    plotter.details_url = url_for('details', viz=viz_key)
+    plotter.create_viz(rows=(start, start + PAGE_ROWS))
+    with LOCK:
+        VIZ_CONFIGS[viz_key] = plotter.aggregator.config
+        VIZ_CONFIGS.move_to_end(viz_key)
+        if len(VIZ_CONFIGS) > MAX_VIZ_CONFIGS:
+            VIZ_CONFIGS.popitem(last=False)
+    return plotter.get_output(), plotter.get_layout_info()
+
+
+@_locked
+def update_session(session_id: str, grid: LayoutDOM) -> Dict[str, Any]:
+    """ Returns the message that updates the viz of a session to the grid, see VizSession.get_update()
+    """
+    return get_session(session_id).get_update(grid)
+
+
+def get_session(session_id: str) -> VizSession:
+    if session_id not in SESSIONS:
+        SESSIONS[session_id] = VizSession()
+        if len(SESSIONS) > MAX_SESSIONS:
+            SESSIONS.popitem(last=False)
+    SESSIONS.move_to_end(session_id)
+    return SESSIONS[session_id]
+
+
 @app.route('/', methods=['GET', 'POST'])
 def root():
     # default values
-    script, div = '', ''
+    script, div, layout_info = '', '', None
+    session_id = make_id()
 
     if request.method == 'POST':
         try:
-            config = make_conf_from_form(request.form)
-            ds = get_cached_datasource(TEST_DS)
-            plotter = Plotter(ds, config)
-            plotter.create_viz()
-            grid = plotter.get_output()
-            script, div = components(grid)
+            grid, layout_info = create_page(request.form, 0)
+            # the first page is kept, so changes of the config can be sent as patches of it
+            update = update_session(session_id, grid)
+            script, div = update['script'], update['div']
         except Exception as e:
             div = f'Could not process request due to {e}. Is this a valid plot configuration?'
 
@@ -68,9 +206,98 @@ def root():
         'ui.html',
         attributes=get_cached_datasource(TEST_DS).columns,
         bokeh_script=script,
-        bokeh_div=div
+        bokeh_div=div,
+        # the client sends the form again to load the remaining rows of the grid
+        grid_layout=layout_info,
+        grid_form=request.form.to_dict(),
+        session_id=session_id
     )
 
 
+@app.route('/panels', methods=['POST'])
+def panels():
+    """ Returns the plots of the next rows of a grid, the form is the one that created the first rows plus 'start'
+    """
+    form = request.form.to_dict()
+    try:
+        start = int(form.pop('start'))
+        grid, layout_info = create_page(form, start)
+        script, div = components(grid)
+    except Exception as e:
+        return jsonify(error=f'Could not process request due to {e}'), 400
+    return jsonify(script=script, div=div, layout=layout_info)
+
+
+@app.route('/update', methods=['POST'])
+def update():
+    """ Returns the changes of the first page of a session for a new form, see VizSession.get_update()
+
+    Further rows of the new grid are loaded with /panels again.
+    """
+    form = request.form.to_dict()
+    try:
+        session_id = form.pop('session')
+        grid, layout_info = create_page(form, 0)
+        message = update_session(session_id, grid)
+    except Exception as e:
+        return jsonify(error=f'Could not process request due to {e}'), 400
+    message['layout'] = layout_info
+    message['form'] = form
+    return app.response_class(serialize_json(message), mimetype='application/json')
+
+
+@app.route('/export', methods=['POST'])
+def export():
+    """ Streams the aggregated data of a form or, with data=rows, the rows of the datasource that pass its filters
+
+    The format is csv or arrow, the data is encoded chunk by chunk while it is sent.
+    """
+    form = request.form.to_dict()
+    data, export_format = form.pop('data', 'aggregates'), form.pop('format', 'csv')
+    exporters = {'aggregates': export_aggregates, 'rows': export_rows}
+    try:
+        if data not in exporters:
+            raise ValueError(f'Unknown data {data}, must be one of {list(exporters)}')
+        chunks = exporters[data](get_cached_datasource(TEST_DS), make_conf_from_form(form), export_format)
+    except Exception as e:
+        return jsonify(error=f'Could not process export due to {e}'), 400
+    extension = 'arrows' if export_format == 'arrow' else export_format
+    headers = {'Content-Disposition': f'attachment; filename={data}.{extension}'}
+    return Response(stream_with_context(chunks), mimetype=MIME_TYPES[export_format], headers=headers)
+
+
+@app.route('/details')
+def details():
+    """ Returns the dimensions, measures and amount of rows of one point of a viz, for its tooltip
+    """
+    try:
+        point_details = get_cached_point_details(request.args['viz'])
+        values = point_details.get(int(request.args['point']))
+    except (KeyError, ValueError) as e:
+        return jsonify(error=f'Could not process details request due to {e}'), 400
+    # jsonify would sort the details by name
+    return app.response_class(json.dumps({'details': values}), mimetype='application/json')
+
+
+@app.route('/tiles')
+def tiles():
+    """ Returns the tiles of the visible window of a dense scatter, at the zoom level that fits the plot size
+
+    The viz must have been created by this server before, see get_cached_tile_pyramid().
+    """
+    args = request.args
+    try:
+        pyramid = get_cached_tile_pyramid(args['viz'])
+        x_range = float(args['x_start']), float(args['x_end'])
+        y_range = float(args['y_start']), float(args['y_end'])
+        width, height = int(args['width']), int(args['height'])
+    except (KeyError, ValueError) as e:
+        return jsonify(error=f'Could not process tile request due to {e}'), 400
+
+    level, rasters = pyramid.get_tiles(x_range, y_range, width, height)
+    return jsonify(level=level, tiles=[encode_tile(pyramid, level, raster) for raster in rasters])
+
+
 if __name__ == '__main__':
-    app.run(port=8081)
+    # long exports are streamed by their own thread, so they don't block other requests
+    app.run(port=8081, threaded=True)
@@ -68,7 +68,93 @@
     }
 
 
+    function runScript(container, html) {
+        // scripts inserted as html are not run, so the bokeh script is added as an element
+        let script = document.createElement('script');
+        script.text = html.replace(/<\/?script[^>]*>/g, '');
+        container.appendChild(script);
+    }
+
+    let loadingRows = false;
+
+    function loadNextRows() {
+        // the server only creates the first rows of a grid, the others are loaded once they are almost visible
+        if (loadingRows || gridLayout === null || gridLayout.rows[1] >= gridLayout.nrows) {
+            return;
+        }
+        if (window.scrollY + 2 * window.innerHeight < document.body.offsetHeight) {
+            return;
+        }
+        loadingRows = true;
+
+        let form = gridForm;
+        let body = new URLSearchParams();
+        Object.keys(form).forEach(key => body.set(key, form[key]));
+        body.set('start', gridLayout.rows[1]);
+        fetch(panelsUrl, {method: 'POST', body: body})
+            .then(response => response.json())
+            .then(page => {
+                // rows of a grid that was replaced in the meantime are dropped
+                if (page.error !== undefined || form !== gridForm) {
+                    return;
+                }
+                let container = document.getElementById('morerows');
+                container.insertAdjacentHTML('beforeend', page.div);
+                runScript(container, page.script);
+                gridLayout = page.layout;
+                loadingRows = false;
+                loadNextRows();
+            });
+    }
+
+    function applyPatch(update) {
+        // the first page is still shown, only the changed models and columns are sent
+        let doc = Bokeh.index[update.root].model.document;
+        Object.keys(update.columns).forEach(id => {
+            // the unchanged columns are taken from the client, bokeh decodes the new ones when applying the patch
+            let data = Object.assign({}, doc.get_model_by_id(id).data);
+            update.columns[id].removed.forEach(name => delete data[name]);
+            Object.assign(data, update.columns[id].data);
+            update.patch.events.push({
+                kind: 'ModelChanged',
+                model: {id: id, type: 'ColumnDataSource'},
+                attr: 'data',
+                new: data
+            });
+        });
+        doc.apply_json_patch(update.patch);
+    }
+
+    function updateViz(e) {
+        e.preventDefault();
+        let body = new URLSearchParams(new FormData(this));
+        body.set('session', sessionId);
+        fetch(updateUrl, {method: 'POST', body: body})
+            .then(response => response.json())
+            .then(update => {
+                if (update.error !== undefined) {
+                    document.getElementById('firstpage').textContent = update.error;
+                    return;
+                }
+                if (update.patch !== undefined) {
+                    applyPatch(update);
+                } else {
+                    let container = document.getElementById('firstpage');
+                    container.innerHTML = update.div;
+                    runScript(container, update.script);
+                }
+                // the further rows belong to the old grid, they are loaded again for the new one
+                document.getElementById('morerows').innerHTML = '';
+                gridForm = update.form;
+                gridLayout = update.layout;
+                loadingRows = false;
+                loadNextRows();
+            });
+    }
+
     function setupListeners() {
+        document.querySelector('#dropzone form').addEventListener('submit', updateViz, false);
+
         let columns = Array.from(document.getElementsByClassName("attribute"));
         columns.forEach((col) => {
             col.addEventListener('dragstart', handleDragStart, false);
@@ -91,5 +177,7 @@
     }
 
     document.addEventListener("DOMContentLoaded", setupListeners);
+    document.addEventListener("DOMContentLoaded", loadNextRows);
+    window.addEventListener("scroll", loadNextRows);
 
 })();
@@ -27,7 +27,14 @@ setup(
     keywords='data visualization development',
 
     packages=['datapylot'],
+    entry_points={
+        'console_scripts': ['datapylot-render=datapylot.batch:main'],
+    },
     install_requires=open('requirements.txt').read(),
+    extras_require={
+        # exports in the arrow IPC stream format
+        'arrow': ['pyarrow>=0.8'],
+    },
     python_requires='~=3.6',
 
 )
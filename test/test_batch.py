@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from datapylot.batch import config_from_spec, main
+from datapylot.data.attributes import DateDimension, Dimension, Measure
+from datapylot.utils import MarkType
+from .testutils import DATASOURCE, TEST_FILE
+
+
+def test_config_from_spec():
+    config = config_from_spec({
+        'columns': ['Category', {'type': 'measure', 'column': 'Sales', 'aggregation': 'mean'}],
+        'rows': [{'type': 'date', 'column': 'Order Date', 'part': 'year'}],
+        'color': 'Profit',
+        'mark_type': 'bar'
+    }, DATASOURCE)
+    assert config.columns == [Dimension('Category'), Measure('Sales', aggregation='mean')]
+    assert config.rows == [DateDimension('Order Date', 'year')]
+    assert config.color == Measure('Profit') and config.size is None
+    assert config.mark_type is MarkType.BAR
+
+    with pytest.raises(ValueError):
+        config_from_spec({'columns': [{'type': 'pie', 'column': 'Sales'}]}, DATASOURCE)
+    with pytest.raises(ValueError):
+        config_from_spec({'mark_type': 'pie'}, DATASOURCE)
+
+
+def test_config_from_spec_filters():
+    config = config_from_spec({
+        'columns': ['Category'],
+        'rows': ['Sales'],
+        'filters': [
+            {'column': 'Region', 'values': ['East', 'West']},
+            {'column': 'Sales', 'min_value': 10, 'max_value': 100},
+            {'type': 'date', 'column': 'Order Date', 'part': 'year', 'values': [2015]}
+        ]
+    }, DATASOURCE)
+    region, sales, year = config.filters
+    assert region.attribute == Dimension('Region') and region.values == ['East', 'West']
+    assert sales.attribute == Measure('Sales') and (sales.min_value, sales.max_value) == (10, 100)
+    assert year.attribute == DateDimension('Order Date', 'year') and year.values == [2015]
+
+    with pytest.raises(ValueError):
+        config_from_spec({'filters': [{'column': 'Region'}]}, DATASOURCE)
+
+
+def test_batch_render(tmpdir):
+    specs = [
+        {'name': 'sales_by_category', 'columns': ['Category'], 'rows': ['Sales'], 'mark_type': 'bar'},
+        {'name': 'profit_by_region', 'columns': ['Region', 'Sales'], 'rows': ['Segment', 'Profit']},
+        {'name': 'broken', 'columns': ['No such column']}
+    ]
+    specs_file = tmpdir.join('specs.json')
+    specs_file.write(json.dumps(specs))
+    output = tmpdir.join('reports')
+
+    assert main([str(TEST_FILE.absolute()), str(specs_file), '--output', str(output), '--processes', '2']) == 1
+    manifest = json.loads(output.join('manifest.json').read())
+    outputs = manifest['outputs']
+    assert [entry['name'] for entry in outputs] == [spec['name'] for spec in specs]
+    for entry in outputs[:2]:
+        assert 'error' not in entry and entry['seconds'] >= 0
+        assert output.join(f'{entry["name"]}.html').size() == entry['bytes'] > 0
+    assert outputs[1]['plots'] == 12
+    # a broken spec doesn't stop the others
+    assert 'error' in outputs[2] and not output.join('broken.html').exists()
+
+
+@pytest.mark.parametrize('name', ['../sales', 'reports/sales', '..', ''])
+def test_batch_rejects_paths_as_names(tmpdir, name):
+    specs_file = tmpdir.join('specs.json')
+    specs_file.write(json.dumps([{'name': name, 'columns': ['Category']}]))
+    with pytest.raises(SystemExit):
+        main([str(TEST_FILE.absolute()), str(specs_file), '--output', str(tmpdir.join('reports'))])
+    assert not tmpdir.join('reports').exists()
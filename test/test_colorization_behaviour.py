@@ -1,10 +1,16 @@
+import numpy
+import pytest
+
 from datapylot.data.attributes import Dimension, Measure
 from datapylot.data.vizconfig import VizConfig
+from datapylot.data_preparation.aggregator import Aggregator
 from datapylot.data_preparation.colorization_behaviour import (ColorizationBehaviour,
                                                                NoColorColorizationBehaviour,
                                                                ExistingDimensionColorizationBehaviour,
                                                                NewDimensionColorizationBehaviour,
                                                                MeasureColorizationBehaviour)
+from datapylot.data_preparation.scales import LinearScale, OrdinalScale
+from .testutils import DATASOURCE
 
 
 def test_colorization_behaviour_selection():
@@ -43,3 +49,41 @@ def test_colorization_behaviour_selection():
     for conf, _class in zip(vizconfigs, classes):
         behaviour = ColorizationBehaviour.get_correct_behaviour(conf, [])
         assert isinstance(behaviour, _class)
+
+
+def test_scales():
+    scale = OrdinalScale(numpy.array(['b', 'a', 'c', 'a'], dtype=object), ['red', 'blue'])
+    assert list(scale(numpy.array(['a', 'b', 'c', 'c'], dtype=object))) == ['red', 'blue', 'red', 'red']
+    with pytest.raises(AssertionError):
+        scale(numpy.array(['d'], dtype=object))
+
+    linear = LinearScale.from_values(numpy.array([2, 4, 6]), 10, 20)
+    assert list(linear(numpy.array([2, 3, 6]))) == [10, 12.5, 20]
+    # a single value counts as the max
+    assert list(LinearScale.from_values(numpy.array([5]), 10, 20)(numpy.array([5]))) == [20]
+
+
+def test_shared_scales():
+    pc = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Measure('Profit')],
+        'rows': [Measure('Sales')],
+        'color': Dimension('Region'),
+        'size': Dimension('Segment')
+    })
+    aggregator = Aggregator(DATASOURCE, pc)
+    aggregator.update_data()
+    colorization = aggregator.data[0].colorization_behaviour
+    assert isinstance(colorization, NewDimensionColorizationBehaviour)
+    assert colorization.scale is not None
+    assert all(pi.colorization_behaviour is colorization for pi in aggregator.data)
+
+    # every region and segment gets the same color and size in all plots
+    region_colors, segment_sizes = {}, {}
+    for plotinfo in aggregator.data:
+        regions = plotinfo.get_values(Dimension('Region'))
+        segments = plotinfo.get_values(Dimension('Segment'))
+        for region, segment, color, size in zip(regions, segments, plotinfo.colors, plotinfo.sizes):
+            assert region_colors.setdefault(region, color) == color
+            assert segment_sizes.setdefault(segment, size) == size
+    assert len(set(region_colors.values())) == len(region_colors)
+    assert sorted(segment_sizes.values()) == [5, 10, 15]
@@ -1,10 +1,26 @@
+import io
+from collections import OrderedDict
+
+import numpy
+import pandas
 import pytest
+from bokeh.models import ImageRGBA, Plot
 
 from datapylot.data import VizConfig, Datasource
-from datapylot.data.attributes import Dimension, Measure
-from datapylot.data_preparation.avp import AVP
-from datapylot.data_preparation.colorizer import adjust_brightness
+from datapylot.data.attributes import Dimension, Measure, DateDimension
+from datapylot.data.cost import CostLimitExceeded, CostPolicy
+from datapylot.data.filters import Filter
+from datapylot.data_preparation.colorizer import adjust_brightness, ColorRamp, DEFAULT_COLOR, RAMPS, RAMP_STEPS
+from datapylot.data_preparation.details import PointDetails
+from datapylot.data_preparation.downsampling import lttb, min_max
+from datapylot.data_preparation.export import export_aggregates, export_rows
+from datapylot.data_preparation.aggregator import Aggregator
+from datapylot.data_preparation.layout import GridLayout
+from datapylot.data_preparation.plotinfobuilder import PlotInfoBuilder
+from datapylot.data_preparation.rasterizer import rasterize
+from datapylot.data_preparation.query_plan import QueryPlan
 from datapylot.plotting import Plotter
+from datapylot.utils import MarkType
 from .testutils import TEST_FILE
 
 
@@ -29,13 +45,11 @@ def test_output_coloring_measures():
     plotter.aggregator.update_data()
     data = plotter.aggregator.data
 
-    assert isinstance(data[0].colors, list)
-    assert isinstance(data[0].colors[0], AVP)
+    assert isinstance(data[0].colors, numpy.ndarray)
 
     for plotinfo in data:
         assert len(plotinfo.colors) == len(plotinfo.x_coords) == len(plotinfo.y_coords)
-        for i, region_avp in enumerate(plotinfo.x_coords):
-            color = plotinfo.colors[i].val
+        for color in plotinfo.colors:
             assert isinstance(color, str) and len(color) == 7
 
 
@@ -51,8 +65,7 @@ def test_output_coloring_dimensions():
     plotter.aggregator.update_data()
     data = plotter.aggregator.data
 
-    assert isinstance(data[0].colors, list)
-    assert isinstance(data[0].colors[0], AVP)
+    assert isinstance(data[0].colors, numpy.ndarray)
     reg_col = {  # first colors from colorizer.py
         'Central': '#1f77b4',
         'East': '#ff7f0e',
@@ -61,8 +74,8 @@ def test_output_coloring_dimensions():
     }
     for plotinfo in data:
         assert len(plotinfo.colors) == len(plotinfo.x_coords) == len(plotinfo.y_coords)
-        for i, region_avp in enumerate(plotinfo.x_coords):
-            assert reg_col[region_avp.val] == plotinfo.colors[i].val
+        for region, color in zip(plotinfo.x_coords, plotinfo.colors):
+            assert reg_col[region] == color
 
 
 def test_output_ordering():
@@ -84,3 +97,469 @@ def test_output_ordering():
     assert all(x.x_seps[-1].val == 'Furniture' for x in data[0::3]), f'{x.x_seps[-1].val for x in data[0::3]}'
     assert all(x.x_seps[-1].val == 'Office Supplies' for x in data[1::3]), f'{x.x_seps[-1].val for x in data[1::3]}'
     assert all(x.x_seps[-1].val == 'Technology' for x in data[2::3]), f'{x.x_seps[-1].val for x in data[2::3]}'
+
+
+def test_automatic_time_buckets():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    resolutions = []
+    for columns in ([DateDimension('Order Date', 'auto')],
+                    [Dimension('Category'), DateDimension('Order Date', 'auto')],
+                    [Dimension('State'), DateDimension('Order Date', 'auto')]):
+        pc = VizConfig.from_dict({'columns': columns, 'rows': [Measure('Sales')], 'mark_type': MarkType.LINE})
+        aggregator = Aggregator(ds, pc)
+        aggregator.update_data()
+        x_data = aggregator.config.x_data
+        assert isinstance(x_data, DateDimension) and not x_data.is_auto
+        assert aggregator.requested_config is pc
+        # the amount of points never exceeds what the plot can display
+        max_points = aggregator.plot_width / aggregator.pixels_per_time_bucket
+        assert all(len(plotinfo.x_coords) <= max(max_points, 1) for plotinfo in aggregator.data)
+        resolutions.append(x_data.part)
+
+    # narrower plots get coarser time buckets
+    assert resolutions == ['week', 'month', 'year']
+
+
+def _plotinfo_values(plotinfos):
+    return [([avp.val for avp in pi.x_seps + pi.y_seps], list(pi.get_coord_values('x')), list(pi.get_coord_values('y')))
+            for pi in plotinfos]
+
+
+def test_query_plan_optimizations_keep_results():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    filtered = VizConfig.from_dict({
+        'columns': [Dimension('Category'), DateDimension('Order Date', 'year')],
+        'rows': [Dimension('Region'), Measure('Sales', table_calculation='percent_of_total')],
+        'filters': [Filter(Dimension('Segment'), values=['Consumer']), Filter(Measure('Quantity'), min_value=3)]
+    })
+    unfiltered = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Dimension('Region')],
+        'rows': [Dimension('Ship Mode'), Measure('Quantity')],
+    })
+    for pc in (filtered, unfiltered):
+        naive = QueryPlan.compile(ds, pc)
+        optimized = QueryPlan.compile(ds, pc).optimize()
+        assert len(optimized.operators) < len(naive.operators)
+        assert _plotinfo_values(naive.execute()) == _plotinfo_values(optimized.execute())
+
+    # filters remove the rows before aggregating
+    plotinfos = QueryPlan.compile(ds, filtered).optimize().execute()
+    for plotinfo in plotinfos:
+        assert abs(sum(plotinfo.get_coord_values('y')) - 1) < 1e-9
+
+
+def test_query_plan_cache_and_cube_substitution():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    fine = VizConfig.from_dict({'columns': [Dimension('Category'), Dimension('Region')],
+                                'rows': [Measure('Sales')]})
+    coarse = VizConfig.from_dict({'columns': [Dimension('Category')], 'rows': [Measure('Sales')]})
+
+    Aggregator(ds, fine).update_data()
+    aggregator = Aggregator(ds, coarse)
+    aggregator.update_data()
+    assert 'cube_substitution' in aggregator.plan.applied_passes
+    expected = ds.group_by([Dimension('Category')])['Sales'].sum()
+    assert all(abs(a - b) < 1e-6 for a, b in zip(aggregator.data[0].get_coord_values('y'), expected.values))
+
+    # the same config again is served from the cache
+    aggregator.update_data()
+    explanation = aggregator.explain()
+    assert 'CachedAggregate' in explanation and 'Sales: cached' in explanation
+    assert 'actual rows: 3' in explanation
+    assert aggregator.plan.constant_channels == {'color', 'size'}
+
+
+def test_cube_substitution_with_nulls():
+    data = Datasource.from_csv(TEST_FILE.absolute()).data
+    # the rows without a region would be missing from the finer aggregate
+    ds = Datasource(data.assign(Region=data['Region'].where(data.index % 7 != 0)))
+    fine = VizConfig.from_dict({'columns': [Dimension('Category'), Dimension('Region')],
+                                'rows': [Measure('Sales')]})
+    coarse = VizConfig.from_dict({'columns': [Dimension('Category')], 'rows': [Measure('Sales')]})
+
+    Aggregator(ds, fine).update_data()
+    aggregator = Aggregator(ds, coarse)
+    aggregator.update_data()
+    assert 'cube_substitution' not in aggregator.plan.applied_passes
+    expected = data.groupby('Category')['Sales'].sum()
+    assert numpy.allclose(aggregator.data[0].get_coord_values('y'), expected.values)
+
+    # nulls in the kept dimensions are dropped by grouping either way
+    assert ds.find_cube([Dimension('Category')], Measure('Sales')) is None
+    assert set(ds.find_cube([Dimension('Region')], Measure('Sales'))) == {'Category', 'Region'}
+
+
+def test_unobserved_derived_groups():
+    data = pandas.DataFrame({
+        'd': pandas.to_datetime(['2015-01-01', '2016-01-01', '2016-05-01']),
+        'r': ['a', 'b', 'a'],
+        'v': [1.0, 2.0, 3.0]
+    })
+    config = VizConfig([DateDimension('d', 'year'), Dimension('r')], [Measure('v', aggregation='mean')],
+                       None, None, MarkType.CIRCLE)
+    aggregator = Aggregator(Datasource(data), config)
+    aggregator.update_data()
+    # only the combinations in the data become glyphs
+    assert sorted(len(plot_info.x_coords) for plot_info in aggregator.data) == [1, 2]
+    assert aggregator.y_min is not None and not numpy.isnan(aggregator.y_min)
+    assert PointDetails(Datasource(data), config).length == 3
+
+
+def test_cost_policies():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    pc = VizConfig.from_dict({'columns': [Dimension('Order ID'), Dimension('Category')], 'rows': [Measure('Sales')]})
+    assert pc.estimate_cost(ds).plots == len(ds.get_variations_of('Order ID'))
+
+    with pytest.raises(CostLimitExceeded):
+        Aggregator(ds, pc, CostPolicy(max_plots=50)).update_data()
+
+    for action in ('downsample', 'top_n'):
+        aggregator = Aggregator(ds, pc, CostPolicy(max_plots=50, action=action))
+        aggregator.update_data()
+        assert len(aggregator.data) == 50
+        assert aggregator.requested_config.filters == []
+
+    # top_n keeps the orders with the highest sales
+    aggregator = Aggregator(ds, pc, CostPolicy(max_plots=10, action='top_n'))
+    aggregator.update_data()
+    top_orders = ds.group_by([Dimension('Order ID')])['Sales'].sum().sort_values(ascending=False).index[:10]
+    assert set(pi.x_seps[0].val for pi in aggregator.data) == set(top_orders)
+
+    # glyph limits reduce the dimensions within the plots
+    scatter = VizConfig.from_dict({'columns': [Measure('Profit')], 'rows': [Measure('Sales')],
+                                   'color': Dimension('Order ID')})
+    aggregator = Aggregator(ds, scatter, CostPolicy(max_glyphs=500, action='downsample'))
+    aggregator.update_data()
+    assert len(aggregator.data[0].x_coords) == 500
+
+    # derived dimensions with missing values can be downsampled as well
+    dates = ds.data['Order Date'].where(ds.data.index % 10 > 0)
+    missing_dates = Datasource(ds.data.assign(**{'Order Date': dates}))
+    days = VizConfig.from_dict({'columns': [DateDimension('Order Date', 'day'), Dimension('Category')],
+                                'rows': [Measure('Sales')]})
+    aggregator = Aggregator(missing_dates, days, CostPolicy(max_plots=20, action='downsample'))
+    aggregator.update_data()
+    assert len(aggregator.data) == 20
+
+
+def test_plotinfo_columns():
+    pc = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Dimension('Region')],
+        'rows': [Dimension('Ship Mode'), Measure('Quantity')],
+        'color': Dimension('Category'),
+        'size': Measure('Sales')
+    })
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    aggregator = Aggregator(ds, pc)
+    aggregator.update_data()
+    plotinfo = aggregator.data[0]
+
+    assert not hasattr(plotinfo, '__dict__')
+    assert plotinfo.x_attr == Dimension('Region') and plotinfo.y_attr == Measure('Quantity')
+    assert plotinfo.y_coords.dtype == numpy.int64
+    assert list(plotinfo.additional_data.keys()) == [Measure('Sales')]
+    # separators are stored once per plot and repeated for every glyph on access
+    categories = plotinfo.get_values(Dimension('Category'))
+    assert len(categories) == plotinfo.glyph_count and set(categories) == {plotinfo.x_seps[0].val}
+    assert list(plotinfo.variations_of(Dimension('Category'))) == [plotinfo.x_seps[0].val]
+    with pytest.raises(KeyError):
+        plotinfo.get_values(Dimension('State'))
+
+    # the coordinates are handed to the plotter without copying them
+    viz_data = plotinfo.get_viz_data()
+    assert viz_data['Quantity'] is plotinfo.y_coords
+    assert len(viz_data['_size']) == len(viz_data['_color']) == plotinfo.glyph_count
+
+
+def test_plotinfo_builder_panels():
+    outer, inner, measure = Dimension('Outer'), Dimension('Inner'), Measure('Value')
+    pc = VizConfig.from_dict({'columns': [outer, inner], 'rows': [measure]})
+    amount = 100000
+    # 10000 panels with 10 points each, in scrambled order
+    rows = numpy.random.RandomState(0).permutation(amount)
+    columns = OrderedDict([(outer, rows % 10000), (inner, (rows // 10000).astype(str)), (measure, rows * 0.5)])
+
+    plotinfos = PlotInfoBuilder.create_all_plotinfos(columns, pc)
+    assert len(plotinfos) == 10000
+    assert [pi.x_seps[0].val for pi in plotinfos] == list(range(10000))
+    for plotinfo in plotinfos[:100]:
+        expected = rows[rows % 10000 == plotinfo.x_seps[0].val]
+        assert list(plotinfo.x_coords) == list((expected // 10000).astype(str))
+        assert list(plotinfo.y_coords) == list(expected * 0.5)
+
+    assert PlotInfoBuilder.create_all_plotinfos(OrderedDict(), pc) == []
+
+
+def test_grid_layout():
+    outer, inner, row, measure = Dimension('Outer'), Dimension('Inner'), Dimension('Row'), Measure('Value')
+    pc = VizConfig.from_dict({'columns': [outer, inner, measure], 'rows': [row, measure]})
+    # inner values are nested in the outer ones and the second row only has data for a single column
+    columns = OrderedDict([
+        (outer, numpy.array(['b', 'a', 'a', 'a'], dtype=object)),
+        (inner, numpy.array(['z', 'y', 'x', 'x'], dtype=object)),
+        (row, numpy.array(['r1', 'r1', 'r1', 'r2'], dtype=object)),
+        (measure, numpy.array([1.0, 2.0, 3.0, 4.0]))
+    ])
+    plotinfos = PlotInfoBuilder.create_all_plotinfos(columns, pc)
+    layout = GridLayout(plotinfos)
+
+    # only the combinations that occur get a column
+    assert layout.col_keys == [('a', 'x'), ('a', 'y'), ('b', 'z')]
+    assert layout.row_keys == [('r1',), ('r2',)]
+    assert [[pi is not None for pi in cells] for cells in layout.cells] == [[True, True, True], [True, False, False]]
+    positions = {(pi.x_seps[0].val, pi.x_seps[1].val, pi.y_seps[0].val): layout.get_position(pi) for pi in plotinfos}
+    assert positions == {('a', 'x', 'r1'): (0, 0), ('a', 'y', 'r1'): (0, 1), ('b', 'z', 'r1'): (0, 2),
+                         ('a', 'x', 'r2'): (1, 0)}
+
+    # axes go to the lowest plot of every column, even if the rows below are empty
+    top_left, top_center, top_right = layout.cells[0]
+    bottom_left = layout.cells[1][0]
+    assert [layout.is_in_last_row(pi) for pi in plotinfos if pi is not top_left] == [True] * 3
+    assert not layout.is_in_last_row(top_left)
+    assert layout.is_in_first_column(bottom_left) and not layout.is_in_first_column(top_center)
+    assert layout.is_in_first_row(top_right) and not layout.is_in_first_row(bottom_left)
+    assert layout.is_in_center_top_column(top_center)
+    with pytest.raises(KeyError):
+        GridLayout(plotinfos[:1]).get_position(top_right)
+
+
+def test_grid_layout_of_plotter():
+    pc = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Dimension('Region')],
+        'rows': [Dimension('Segment'), Measure('Quantity')]
+    })
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    plotter = Plotter(ds, pc)
+    plotter.create_viz()
+    aggregator = plotter.aggregator
+    assert (aggregator.nrows, aggregator.ncols) == (3, 3)
+    for plot_info in aggregator.data:
+        row, col = aggregator.layout.get_position(plot_info)
+        assert aggregator.layout.cells[row][col] is plot_info
+        assert aggregator.is_in_first_column(plot_info) == (col == 0)
+        assert aggregator.is_in_last_row(plot_info) == (row == 2)
+    assert len(list(plotter.get_output().select(dict(type=Plot)))) == 9
+
+
+def test_grid_pages():
+    pc = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Dimension('Region')],
+        'rows': [Dimension('Segment'), Measure('Quantity')]
+    })
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    plotter = Plotter(ds, pc)
+    plotter.create_viz(rows=(1, 10))
+    layout = plotter.aggregator.layout
+    # only the plots of the requested rows are created, the info still describes the whole grid
+    assert plotter.rows == (1, 3) and len(plotter.plots) == 6
+    assert all(layout.get_position(plot_info)[0] >= 1 for plot_info in plotter.data)
+    info = plotter.get_layout_info()
+    assert (info['nrows'], info['ncols'], info['rows']) == (3, 3, [1, 3])
+    assert info['row_keys'] == [[str(value) for value in key] for key in layout.row_keys]
+    grid = plotter.get_output()
+    assert len(list(grid.select(dict(type=Plot)))) == 6
+
+    # the plots of another window replace the ones of the first
+    plotter.create_plots(rows=(0, 1))
+    assert plotter.rows == (0, 1) and len(plotter.plots) == len(plotter.data) == 3
+    assert all(layout.get_position(plot_info)[0] == 0 for plot_info in plotter.data)
+
+
+def test_color_ramps():
+    ramp = RAMPS['brightness']
+    assert len(ramp.palette) == RAMP_STEPS
+    # same colors as adjusting the brightness of each value on its own
+    assert ramp.palette[0] == adjust_brightness(DEFAULT_COLOR, 0.5)
+    assert ramp.palette[-1] == adjust_brightness(DEFAULT_COLOR, -0.5)
+    assert list(ramp.get_indices(numpy.array([0, 0.5, 1, 2, -1, numpy.nan]))) == [0, 128, 255, 255, 0, 0]
+    assert list(ramp(numpy.array([0, 1]))) == [ramp.palette[0], ramp.palette[-1]]
+
+    diverging = ColorRamp.from_anchors('test', ['#ff0000', '#ffffff', '#0000ff'], 'diverging', steps=3)
+    assert diverging.palette == ['#ff0000', '#ffffff', '#0000ff']
+    with pytest.raises(ValueError):
+        ColorRamp('test', ['#ffffff'], 'circular')
+
+
+def test_color_mapper():
+    pc = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Dimension('Region')],
+        'rows': [Measure('Profit')],
+        'color': Measure('Profit')
+    })
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    plotter = Plotter(ds, pc)
+    plotter.use_color_mapper = True
+    plotter.create_viz()
+    assert plotter.color_mapper.palette == RAMPS['brightness'].palette
+
+    colors = numpy.concatenate([pi.colors for pi in plotter.aggregator.data])
+    sources = [r.data_source for plot in plotter.plots for r in plot.renderers if hasattr(r, 'data_source')]
+    indices = numpy.concatenate([source.data['_color'] for source in sources])
+    assert indices.dtype == numpy.int64
+    assert list(numpy.array(plotter.color_mapper.palette)[indices]) == list(colors)
+
+    # diverging ramps keep zero in the middle of the palette
+    behaviour = plotter.aggregator.data[0].colorization_behaviour
+    behaviour.ramp_name = 'red_blue'
+    behaviour.fit(numpy.array([-10.0, 5.0, 0.0]))
+    assert list(behaviour.get_scale()(numpy.array([-10.0, 0.0, 10.0]))) == [0, 0.5, 1]
+
+
+def test_constant_channels():
+    pc = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Dimension('Region')],
+        'rows': [Measure('Profit')],
+        'size': Measure('Sales')
+    })
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    plotter = Plotter(ds, pc)
+    plotter.create_viz()
+    assert plotter.constants == {'color': DEFAULT_COLOR}
+
+    # the color is set on the glyph, only the varying size is sent for every glyph
+    renderers = [r for plot in plotter.plots for r in plot.renderers if hasattr(r, 'data_source')]
+    assert renderers[0].glyph.fill_color == {'value': DEFAULT_COLOR}
+    assert renderers[0].glyph.size == {'field': '_size'}
+    for renderer in renderers:
+        data = renderer.data_source.data
+        assert '_color' not in data and data['_size'].dtype == numpy.float64
+        assert data['Profit'].dtype == numpy.float64
+
+
+def test_line_downsampling():
+    x = numpy.arange(10000)
+    y = numpy.sin(x / 500) + numpy.where(x == 1234, 5, 0)
+
+    for downsampler in (lttb, min_max):
+        kept = downsampler(x, y, 200)
+        assert len(kept) <= 202 and kept[0] == 0 and kept[-1] == 9999
+        assert (numpy.diff(kept) > 0).all()
+        # the spike is part of the shape of the line
+        assert 1234 in kept
+    assert list(lttb(x[:5], y[:5], 200)) == list(range(5))
+
+    timestamps = numpy.arange(30000)
+    groups = numpy.array(['a', 'b', 'c'])[timestamps % 3]
+    data = pandas.DataFrame({'T': timestamps, 'G': groups, 'V': y[timestamps % 10000]})
+    pc = VizConfig.from_dict({'columns': [Dimension('G'), Dimension('T')], 'rows': [Measure('V')],
+                              'mark_type': MarkType.LINE})
+    aggregator = Aggregator(Datasource(data), pc)
+    aggregator.update_data()
+    assert 'Downsample lttb to 400 points per plot, kept 1200 of 30000 points' in aggregator.explain()
+    for plotinfo in aggregator.data:
+        assert plotinfo.glyph_count == len(plotinfo.y_coords) == 400
+        assert (numpy.diff(plotinfo.x_coords) > 0).all()
+
+
+def test_rasterization():
+    x, y = numpy.array([0.5, 0.5, 3.5, 9.0]), numpy.array([0.5, 0.5, 1.5, 9.0])
+    raster = rasterize(x, y, (0, 4), (0, 2), 4, 2, values=numpy.array([1.0, 3.0, 5.0, 7.0]))
+    # the first row is at the bottom, the point outside of the extents is dropped
+    assert raster.counts.tolist() == [[2, 0, 0, 0], [0, 0, 0, 1]]
+    means = raster.get_means()
+    assert means[0, 0] == 2.0 and means[1, 3] == 5.0 and numpy.isnan(means[0, 1])
+    assert raster.get_density(2)[0, 0] == 1.0
+
+    pc = VizConfig.from_dict({
+        'columns': [Measure('Sales')],
+        'rows': [Measure('Profit')],
+        'color': Dimension('Order ID')
+    })
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    plotter = Plotter(ds, pc)
+    plotter.rasterize_above = 100
+    plotter.create_viz()
+    plot_info = plotter.aggregator.data[0]
+    raster = plotter.rasters[id(plot_info)]
+    assert raster.shape == (plotter.aggregator.plot_height, plotter.aggregator.plot_width)
+    assert raster.counts.sum() == plot_info.glyph_count
+
+    # a single image with a color per pixel replaces the circles, empty pixels are transparent
+    renderers = [r for r in plotter.plots[0].renderers if hasattr(r, 'glyph')]
+    assert len(renderers) == 1 and isinstance(renderers[0].glyph, ImageRGBA)
+    image = renderers[0].data_source.data['image'][0]
+    assert image.dtype == numpy.uint32 and image.shape == raster.shape
+    assert ((image == 0) == (raster.counts == 0)).all()
+
+    # with a tile endpoint, zooming loads finer tiles of the same viz
+    plotter = Plotter(ds, pc)
+    plotter.rasterize_above = 100
+    plotter.tile_url = '/tiles?viz=scatter'
+    plotter.create_viz()
+    plot = plotter.plots[0]
+    assert plot.x_range.callback is plot.y_range.callback
+    assert '/tiles?viz=scatter&width=' in plot.x_range.callback.code
+
+
+def test_export():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    config = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Dimension('Region')],
+        'rows': [Measure('Sales')],
+        'color': Measure('Profit')
+    })
+    chunks = list(export_aggregates(ds, config, chunk_rows=5))
+    assert len(chunks) == 3 and chunks[0].startswith(b'Category,Region,Sales,Profit\n')
+    exported = pandas.read_csv(io.BytesIO(b''.join(chunks)))
+    expected = ds.data.groupby(['Category', 'Region'])[['Sales', 'Profit']].sum().reset_index()
+    assert exported[['Category', 'Region']].values.tolist() == expected[['Category', 'Region']].values.tolist()
+    assert numpy.allclose(exported[['Sales', 'Profit']].values, expected[['Sales', 'Profit']].values)
+
+    west = config.with_filters([Filter(Dimension('Region'), values=['West'])])
+    chunks = list(export_rows(ds, west, chunk_rows=1000))
+    exported = pandas.read_csv(io.BytesIO(b''.join(chunks)))
+    assert len(chunks) == -(-len(exported) // 1000)
+    assert list(exported.columns) == list(ds.data.columns)
+    assert len(exported) == (ds.data['Region'] == 'West').sum() and set(exported['Region']) == {'West'}
+
+    # an empty export still has its header
+    nothing = config.with_filters([Filter(Dimension('Region'), values=['Nowhere'])])
+    assert b''.join(export_rows(ds, nothing)).decode().count('\n') == 1
+    with pytest.raises(ValueError):
+        export_rows(ds, config, 'xlsx')
+
+
+def test_export_arrow():
+    pyarrow = pytest.importorskip('pyarrow')
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    config = VizConfig.from_dict({'columns': [Dimension('Category'), Dimension('Region')], 'rows': [Measure('Sales')]})
+    chunks = list(export_aggregates(ds, config, 'arrow', chunk_rows=5))
+    # a record batch per chunk of rows plus the end of the stream
+    assert len(chunks) == 4
+    exported = pyarrow.ipc.open_stream(b''.join(chunks)).read_all().to_pandas()
+    expected = ds.data.groupby(['Category', 'Region'])['Sales'].sum().reset_index()
+    assert list(exported.columns) == ['Category', 'Region', 'Sales']
+    assert exported[['Category', 'Region']].values.tolist() == expected[['Category', 'Region']].values.tolist()
+    assert numpy.allclose(exported['Sales'].values, expected['Sales'].values)
+
+    west = config.with_filters([Filter(Dimension('Region'), values=['West'])])
+    reader = pyarrow.ipc.open_stream(b''.join(export_rows(ds, west, 'arrow', chunk_rows=1000)))
+    batches = list(reader)
+    assert all(batch.num_rows <= 1000 for batch in batches)
+    assert sum(batch.num_rows for batch in batches) == (ds.data['Region'] == 'West').sum()
+    assert reader.schema.names == list(ds.data.columns)
+
+
+def test_point_details():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    config = VizConfig.from_dict({
+        'columns': [Dimension('Category'), DateDimension('Order Date', 'year')],
+        'rows': [Dimension('Segment'), Measure('Sales')],
+        'filters': [Filter(Dimension('Region'), values=['West'])]
+    })
+    aggregator = Aggregator(ds, config)
+    aggregator.update_data()
+    details = PointDetails(ds, aggregator.config)
+    west = ds.data[ds.data['Region'] == 'West']
+    for plot_info in aggregator.data:
+        for position, point in enumerate(plot_info.points):
+            values = details.get(int(point))
+            assert values['Category'] == plot_info.x_seps[0].val and values['Segment'] == plot_info.y_seps[0].val
+            assert values['YEAR(Order Date)'] == plot_info.x_coords[position]
+            assert values['Sales'] == plot_info.y_coords[position]
+            rows = west[(west['Category'] == values['Category']) & (west['Segment'] == values['Segment']) &
+                        (west['Order Date'].dt.year == int(values['YEAR(Order Date)']))]
+            assert values['Number of records'] == len(rows)
+    assert sum(len(pi.points) for pi in aggregator.data) == details.length
+    with pytest.raises(ValueError):
+        details.get(details.length)
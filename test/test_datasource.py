@@ -1,9 +1,12 @@
 from functools import reduce
 
+import numpy
+import pandas
 import pytest
 
-from datapylot.data import Datasource
-from datapylot.data.attributes import Dimension
+from datapylot.data import Datasource, CrossFilter, Filter, TilePyramid, VizConfig
+from datapylot.data.attributes import Dimension, DateDimension, BinnedDimension, Measure
+from datapylot.utils import MarkType
 from .testutils import TEST_FILE, DATASOURCE
 
 
@@ -64,5 +67,253 @@ def test_datasource_data_preparation():
     # TODO More validation
     assert True
 
+
+def test_datasource_date_dimensions():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    dates = ds.data['Order Date']
+    years = DateDimension('Order Date', 'year')
+    months = DateDimension('Order Date', 'month')
+    months_of_year = DateDimension('Order Date', 'month', truncate=False)
+
+    assert len(ds.group_by([years])) == dates.dt.year.nunique()
+    assert len(ds.group_by([months])) == (dates.dt.year * 12 + dates.dt.month).nunique()
+    assert sorted(ds.get_variations_of(months_of_year)) == [f'{m:02d}' for m in sorted(dates.dt.month.unique())]
+    # truncation labels sort chronologically
+    assert min(ds.get_variations_of(months)) == dates.min().strftime('%Y-%m')
+    # can be mixed with regular dimensions
+    assert len(ds.group_by([years, Dimension('Region')])) <= len(ds.get_variations_of(years)) * 4
+
+    with pytest.raises(ValueError):
+        DateDimension('Order Date', 'decade')
+    with pytest.raises(ValueError):
+        ds.get_column(DateDimension('Region', 'year'))
+
+
+def test_datasource_derived_column_cache():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    years = DateDimension('Order Date', 'year')
+    first = ds.get_column(years)
+    assert ds.get_column(DateDimension('Order Date', 'year')) is first
+    # derived columns are named like their dimension, so grouped levels are named the same on every path
+    assert first.name == years.col_name
+    assert ds.group_by([years, Dimension('Region')]).size().index.names == [years.col_name, 'Region']
+    # changing the data invalidates derived columns
+    ds.add_column('Test_Double', lambda x: 2)
+    assert ds.get_column(years) is not first
+    assert list(ds.get_column(years)) == list(first)
+
+
+def test_datasource_unobserved_derived_groups():
+    data = pandas.DataFrame({
+        'd': pandas.to_datetime(['2015-01-01', '2016-01-01', '2016-05-01']),
+        'r': ['a', 'b', 'a'],
+        'v': [1.0, 2.0, 3.0]
+    })
+    ds = Datasource(data)
+    years = DateDimension('d', 'year')
+    # (2015, 'b') and a year without any rows are not groups
+    expected = [('2015', 'a'), ('2016', 'a'), ('2016', 'b')]
+    assert list(ds.group_by([years, Dimension('r')]).size().index) == expected
+    assert list(ds.group_by([years]).size()) == [1, 2]
+    assert list(ds.aggregate([years, Dimension('r')], Measure('v')).index) == expected
+    means = ds.aggregate([years, Dimension('r')], Measure('v', aggregation='mean'))
+    assert list(means.index) == expected and not means.isnull().any()
+    # rolled up from the finer aggregate
+    cube = ds.find_cube([years], Measure('v'))
+    assert cube == (years.col_name, 'r')
+    assert list(ds.aggregate([years], Measure('v'), cube=cube)) == [1.0, 5.0]
+
+
+def test_datasource_project():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    years, region = DateDimension('Order Date', 'year'), Dimension('Region')
+    west = ds.get_filter_mask([Filter(region, values=['West'])])
+    assert west.sum() == (ds.data['Region'] == 'West').sum()
+    # masks of further filters are relative to the already selected rows
+    big = ds.get_filter_mask([Filter(Measure('Sales'), min_value=100)], west)
+    assert len(big) == west.sum() and big.sum() == ((ds.data['Region'] == 'West') & (ds.data['Sales'] >= 100)).sum()
+    assert ds.get_filter_mask([]).all()
+
+    frame = ds.project([years, region, Measure('Sales', aggregation='mean')], west)
+    assert list(frame.columns) == [years.col_name, 'Region', 'Sales'] and len(frame) == west.sum()
+    assert set(frame['Region']) == {'West'}
+
+
+def test_datasource_append_rows():
+    ds = Datasource(DATASOURCE.data.iloc[:100].copy())
+    sales = ds.aggregate([Dimension('Category')], Measure('Sales'))
+    ds.aggregate([Dimension('Category')], Measure('Sales', aggregation='mean'))
+    version = ds.version
+    # rows arrive as text, eg. from a csv stream
+    rows = DATASOURCE.data.iloc[100:110].drop(['Number of records', 'Profit'], axis=1).astype(str)
+    ds.append_rows(rows)
+    assert ds.version == version + 1 and len(ds.data) == 110
+    assert (ds.data.dtypes == DATASOURCE.data.dtypes).all()
+    assert ds.data['Profit'].iloc[100:].isnull().all() and (ds.data['Number of records'] == 1).all()
+    # sums are merged with the sums of the new rows, means can't be merged and are aggregated again
+    assert ds.is_aggregate_cached([Dimension('Category')], Measure('Sales'))
+    assert not ds.is_aggregate_cached([Dimension('Category')], Measure('Sales', aggregation='mean'))
+    expected = DATASOURCE.data.iloc[:110].groupby('Category')['Sales'].sum()
+    assert numpy.allclose(ds.aggregate([Dimension('Category')], Measure('Sales')), expected)
+    assert not sales.equals(expected)
+    with pytest.raises(ValueError):
+        ds.append_rows(rows.assign(Unknown=1))
+
+
+def test_datasource_binned_dimensions():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    quantity = ds.data['Quantity']
+    stats = ds.get_statistics('Quantity')
+    assert (stats.min, stats.max, stats.distinct) == (quantity.min(), quantity.max(), quantity.nunique())
+    assert ds.get_statistics('Quantity') is stats
+
+    # every row ends up in exactly one bin
+    for binned in (BinnedDimension('Quantity', width=2), BinnedDimension('Quantity', count=5),
+                   BinnedDimension('Quantity', quantiles=4)):
+        counts = ds.group_by([binned])['Number of records'].sum()
+        assert counts.sum() == len(ds.data)
+        assert (counts > 0).all()
+
+    counts = ds.group_by([BinnedDimension('Quantity', width=2)])['Number of records'].sum()
+    assert counts.iloc[0] == (quantity < (quantity.min() // 2) * 2 + 2).sum()
+
+    # a constant column still has one bin
+    constant = Datasource(ds.data.assign(Quantity=3))
+    counts = constant.group_by([BinnedDimension('Quantity', quantiles=4)])['Number of records'].sum()
+    assert list(counts) == [len(ds.data)]
+    # close edges get labels that are precise enough to be unique
+    close = Datasource(ds.data.assign(Quantity=1000000 + ds.data['Quantity'] / 1000))
+    binned = close.get_column(BinnedDimension('Quantity', count=5))
+    assert binned.cat.categories.is_unique and binned.notnull().all()
+
+    with pytest.raises(ValueError):
+        BinnedDimension('Quantity', width=2, count=5)
+    with pytest.raises(ValueError):
+        BinnedDimension('Quantity', count=0)
+    with pytest.raises(ValueError):
+        ds.get_column(BinnedDimension('Region', count=5))
+    # a tiny width on a wide column would create millions of bins
+    with pytest.raises(ValueError):
+        ds.get_column(BinnedDimension('Sales', width=0.001))
+    with pytest.raises(ValueError):
+        ds.get_column(BinnedDimension('Quantity', count=10 ** 7))
+
+
+def test_datasource_aggregate_table_calculations():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    dims = [Dimension('Category'), Dimension('Region')]
+    partition = dims[:1]
+    plain = ds.aggregate(dims, Measure('Sales'))
+    assert plain.equals(ds.group_by(dims)['Sales'].sum())
+    assert ds.aggregate(dims, Measure('Sales')) is plain
+
+    per_category = plain.groupby(level=0)
+    expected = {
+        'running_total': per_category.cumsum(),
+        'percent_of_total': plain / per_category.transform('sum'),
+        'rank': per_category.rank(ascending=False, method='min'),
+        'moving_average': per_category.transform(lambda s: s.rolling(2, min_periods=1).mean()),
+    }
+    for calculation, values in expected.items():
+        measure = Measure('Sales', table_calculation=calculation, window=2)
+        calculated = ds.aggregate(dims, measure, partition)
+        assert list(calculated.index) == list(plain.index)
+        assert ((calculated - values).abs() < 1e-6).all(), calculation
+
+    # without partition, the calculation runs over the whole table
+    total = ds.aggregate(dims, Measure('Sales', table_calculation='percent_of_total'))
+    assert abs(total.sum() - 1) < 1e-9
+
+    with pytest.raises(ValueError):
+        Measure('Sales', table_calculation='median')
+
+
+def test_crossfilter_selections():
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    category, region, year = Dimension('Category'), Dimension('Region'), DateDimension('Order Date', 'year')
+    profit = Measure('Profit', aggregation='mean')
+    crossfilter = CrossFilter(ds)
+    crossfilter.add_view('categories', VizConfig([category], [Measure('Sales')], None, None, MarkType.BAR))
+    crossfilter.add_view('regions', VizConfig([region, year], [Measure('Sales'), profit], None, None, MarkType.CIRCLE))
+
+    def assert_matches(view, rows, dimensions):
+        filtered = Datasource(ds.data[rows].copy())
+        for measure, aggregated in crossfilter.get_aggregates(view).items():
+            expected = filtered.aggregate(dimensions, measure)
+            assert list(aggregated.index) == list(expected.index)
+            assert aggregated.index.names == expected.index.names
+            assert [str(level.dtype) for level in getattr(aggregated.index, 'levels', [aggregated.index])] == \
+                [str(level.dtype) for level in getattr(expected.index, 'levels', [expected.index])]
+            assert ((aggregated - expected).abs() < 1e-6).all()
+
+    assert_matches('regions', ds.data['Category'].notnull(), [region, year])
+    crossfilter.select('categories', ['Furniture', 'Technology'])
+    assert_matches('regions', ds.data['Category'].isin(['Furniture', 'Technology']), [region, year])
+    # a view is never filtered by its own selection
+    assert_matches('categories', ds.data['Category'].notnull(), [category])
+
+    years = ds.get_column(year)
+    crossfilter.select('regions', [('West', years.cat.categories[0])])
+    assert_matches('categories', (ds.data['Region'] == 'West') & (years == years.cat.categories[0]), [category])
+    crossfilter.select('categories', Filter(category, values=['Office Supplies']))
+    assert_matches('regions', ds.data['Category'] == 'Office Supplies', [region, year])
+
+    crossfilter.clear()
+    assert crossfilter.get_row_mask('regions').all()
+    assert_matches('categories', ds.data['Category'].notnull(), [category])
+
+    # indexes are rebuilt once the data changes
+    crossfilter.select('categories', ['Furniture'])
+    ds.add_column('Sales', lambda data: data['Sales'] * 2)
+    assert_matches('regions', ds.data['Category'] == 'Furniture', [region, year])
+
+    with pytest.raises(ValueError):
+        crossfilter.get_aggregate('categories', profit)
+    with pytest.raises(ValueError):
+        crossfilter.select('maps', ['Furniture'])
+
+
+def test_tile_pyramid(tmpdir):
+    ds = Datasource.from_csv(TEST_FILE.absolute())
+    pyramid = ds.get_tile_pyramid('Sales', 'Profit', Measure('Quantity'))
+    assert pyramid is ds.get_tile_pyramid(Measure('Sales'), Measure('Profit'), 'Quantity')
+    rows, total = len(ds.data), ds.data['Quantity'].sum()
+    for level in pyramid.levels:
+        assert level.counts.sum() == rows and abs(level.sums.sum() - total) < 1e-6
+        assert (numpy.diff(level.codes) > 0).all()
+
+    # the whole extent fits into the single tile of level 0
+    level, tiles = pyramid.get_tiles(pyramid.x_extent, pyramid.y_extent, 256, 256)
+    assert level == 0 and len(tiles) == 1 and tiles[0].counts.sum() == rows
+    assert tiles[0].x_extent == pyramid.x_extent and tiles[0].y_extent == pyramid.y_extent
+
+    # every pixel of a level is the sum of 2x2 pixels of the next finer level
+    tile_size = pyramid.tile_size
+    finer = numpy.zeros((2 * tile_size, 2 * tile_size), dtype='int64')
+    for tile_x in range(2):
+        for tile_y in range(2):
+            rows = slice(tile_y * tile_size, (tile_y + 1) * tile_size)
+            cols = slice(tile_x * tile_size, (tile_x + 1) * tile_size)
+            finer[rows, cols] = pyramid.get_tile(1, (tile_x, tile_y)).counts
+    assert (finer.reshape(tile_size, 2, tile_size, 2).sum(axis=(1, 3)) == tiles[0].counts).all()
+
+    # zooming into a quarter of both axes needs four times the resolution
+    x_start, x_end = pyramid.x_extent
+    y_start, y_end = pyramid.y_extent
+    x_range, y_range = (x_start, x_start + (x_end - x_start) / 4), (y_start, y_start + (y_end - y_start) / 4)
+    level, tiles = pyramid.get_tiles(x_range, y_range, 256, 256)
+    assert level == 2 and all(tile.x_extent[0] < x_range[1] and tile.y_extent[0] < y_range[1] for tile in tiles)
+
+    filename = str(tmpdir.join('pyramid.npz'))
+    pyramid.save(filename)
+    loaded = TilePyramid.load(filename)
+    assert loaded.depth == pyramid.depth and loaded.value_extent == pyramid.value_extent
+    tile, loaded_tile = pyramid.get_tile(3, (2, 5)), loaded.get_tile(3, (2, 5))
+    assert (tile.counts == loaded_tile.counts).all() and numpy.allclose(tile.sums, loaded_tile.sums)
+
+    ds.add_column('Sales', lambda data: data['Sales'] * 2)
+    assert ds.get_tile_pyramid('Sales', 'Profit', 'Quantity').x_extent == (2 * x_start, 2 * x_end)
+
+
 if __name__ == '__main__':
     pytest.main(['-s'])
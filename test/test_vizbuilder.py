@@ -1,11 +1,23 @@
 import json
+import re
 from typing import List
 
+import numpy
+from bokeh.core.json_encoder import serialize_json
+from bokeh.document import Document
+from bokeh.models import BasicTicker, BasicTickFormatter, ColumnDataSource, CustomJS, HoverTool, Range1d, ToolEvents
+from bokeh.util.serialization import decode_base64_dict
 from bs4 import BeautifulSoup
 
-from datapylot.data.vizconfig import NoSuchAttributeException
+from datapylot.data import Datasource
+from datapylot.data.attributes import Dimension, Measure
+from datapylot.data.vizconfig import NoSuchAttributeException, VizConfig
 from datapylot.data_preparation.aggregator import Aggregator
 from datapylot.plotting import Plotter
+from datapylot.plotting.live import LiveViz
+from datapylot.plotting.parallel import create_components
+from datapylot.plotting.session import VizSession
+from datapylot.utils import MarkType
 from .config_builder import CONFIG_ROTATE
 from .testutils import DATASOURCE, save_plot_temp, get_plot_temp
 
@@ -17,6 +29,14 @@ def test_aggregator(viz_config, infos):
     assert len(aggregator.data) == aggregator.ncols * aggregator.nrows == infos['plot_amount']
 
 
+@CONFIG_ROTATE
+def test_cost_estimate(viz_config, infos):
+    estimate = Aggregator(DATASOURCE, viz_config).estimate_cost()
+    assert estimate.plots == infos['plot_amount']
+    assert infos['glyphs_in_plot_amount'] <= estimate.glyphs <= len(DATASOURCE.data)
+    assert estimate.payload_bytes > 0
+
+
 @CONFIG_ROTATE
 def test_viz(viz_config, infos) -> None:
     plotter = Plotter(DATASOURCE, viz_config)
@@ -26,6 +46,171 @@ def test_viz(viz_config, infos) -> None:
     check_html(viz_config, infos)
 
 
+def test_viz_shared_source() -> None:
+    viz_config = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Dimension('Region')],
+        'rows': [Dimension('Segment'), Measure('Quantity')],
+        'color': Measure('Profit')
+    })
+    plotter = Plotter(DATASOURCE, viz_config)
+    plotter.use_shared_source = True
+    plotter.create_viz()
+    save_plot_temp(plotter.get_output(), f'{viz_config}_shared')
+    json_plot = extract_plot_structure(get_plot_temp(f'{viz_config}_shared'))
+    references = json_plot[list(json_plot.keys())[0]]['roots']['references']
+
+    # the data is only sent once, every plot renders a slice of it
+    shared = [ref for ref in references if ref['type'] == 'ColumnDataSource']
+    panels = [ref['attributes'] for ref in references if ref['type'] == 'PanelDataSource']
+    assert len(shared) == 1 and len(panels) == len(plotter.plots) == 9
+    assert all(panel['data'] == {} and panel['source']['id'] == shared[0]['id'] for panel in panels)
+
+    data = shared[0]['attributes']['data']
+    glyph_counts = [pi.glyph_count for pi in plotter.aggregator.data]
+    assert sorted((panel.get('start', 0), panel['end']) for panel in panels) == \
+        list(zip(numpy.cumsum(glyph_counts) - glyph_counts, numpy.cumsum(glyph_counts)))
+    assert get_column(data, '_panel') == list(numpy.repeat(range(9), glyph_counts))
+    assert len(get_column(data, '_color')) == sum(glyph_counts)
+
+
+def test_viz_shared_models() -> None:
+    viz_config = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Measure('Sales')],
+        'rows': [Dimension('Segment'), Measure('Quantity')]
+    })
+    plotter = Plotter(DATASOURCE, viz_config)
+    plotter.create_viz()
+    grid = plotter.get_output()
+    save_plot_temp(grid, f'{viz_config}_models')
+
+    # models that are the same in all plots are only created once
+    assert len(plotter.plots) == 9
+    for model_type in (BasicTicker, BasicTickFormatter, Range1d, ToolEvents):
+        assert len(list(grid.select(dict(type=model_type)))) in (1, 2)
+    assert len({id(plot.x_range) for plot in plotter.plots}) == 1
+    assert len({id(r.glyph) for plot in plotter.plots for r in plot.renderers if hasattr(r, 'glyph')}) == 1
+    # only the plot in the top center gets a title
+    assert len([plot for plot in plotter.plots if plot.title is not None]) == 1
+
+
+def test_viz_parallel() -> None:
+    viz_config = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Measure('Sales')],
+        'rows': [Dimension('Sub-Category'), Measure('Quantity')]
+    })
+    script, div = create_components(DATASOURCE, viz_config, processes=2)
+    docs_json = json.loads(re.search(r'var docs_json = (.*);', script).group(1))
+    references = list(docs_json.values())[0]['roots']['references']
+
+    # every model is sent once and all references between the rows of the pool are resolved
+    ids = [reference['id'] for reference in references]
+    assert len(ids) == len(set(ids))
+    referenced = set(re.findall(r'"id": "([^"]+)"', json.dumps([r['attributes'] for r in references])))
+    assert referenced <= set(ids)
+    plots = [reference for reference in references if reference['type'] == 'Plot']
+    plotter = Plotter(DATASOURCE, viz_config)
+    plotter.create_viz()
+    assert len(plots) == len(plotter.plots)
+    # plots created by different processes still share their models
+    assert len({plot['attributes']['x_range']['id'] for plot in plots}) == 1
+
+
+def test_viz_session() -> None:
+    def create_grid(color, mark_type=MarkType.CIRCLE):
+        viz_config = VizConfig.from_dict({
+            'columns': [Dimension('Category'), Measure('Sales')],
+            'rows': [Dimension('Segment'), Measure('Quantity')],
+            'color': color
+        })
+        viz_config.mark_type = mark_type
+        plotter = Plotter(DATASOURCE, viz_config)
+        plotter.create_viz()
+        return plotter.get_output()
+
+    session = VizSession()
+    first = session.get_update(create_grid(Measure('Profit')))
+    assert set(first) == {'script', 'div'}
+    known_ids = {model._id for model in session.document.roots[0].references()}
+
+    # another color measure only changes the color columns
+    update = session.get_update(create_grid(Measure('Sales')))
+    assert update['root'] == session.document.roots[0]._id
+    assert update['patch']['references'] == []
+    assert len(update['columns']) == 9
+    assert all(list(columns['data']) == ['_color'] for columns in update['columns'].values())
+    assert set(update['columns']) <= known_ids
+    assert len(serialize_json(update)) < len(serialize_json(first)) / 4
+
+    # a new glyph is sent with its attributes, the models it uses are only referenced
+    update = session.get_update(create_grid(Measure('Sales'), MarkType.BAR))
+    references = update['patch']['references']
+    assert [reference['type'] for reference in references if reference['attributes']] == ['VBar']
+    assert {event['attr'] for event in update['patch']['events']} >= {'glyph'}
+    referenced = set(re.findall(r'"id": "([^"]+)"', serialize_json(update['patch'])))
+    assert referenced <= known_ids | {reference['id'] for reference in references}
+
+
+def test_live_viz() -> None:
+    data = DATASOURCE.data.sort_values('Order ID')
+    datasource = Datasource(data.iloc[:3000].copy())
+    viz_config = VizConfig.from_dict({
+        'columns': [Dimension('Order ID')],
+        'rows': [Dimension('Segment'), Measure('Sales')]
+    })
+    live = LiveViz(datasource, viz_config)
+    plots = list(live.plotter.plots)
+    document = Document()
+    document.add_root(live.root)
+    events = []
+    document.on_change(lambda event: events.append(event))
+    assert not live.update() and events == []
+
+    datasource.append_rows(data.iloc[3000:3020])
+    assert live.update()
+    # the plots are kept and the new rows are merged into the cached aggregates instead of aggregating all rows
+    assert live.plotter.plots == plots
+    assert 'Sales: cached' in live.plotter.aggregator.explain()
+    # the sources only get the new and changed orders
+    data_events = [event for event in events if event.attr == 'data']
+    assert len(data_events) > 0
+    assert all(type(event.hint).__name__ in ('ColumnsStreamedEvent', 'ColumnsPatchedEvent') for event in data_events)
+    plotter = Plotter(datasource, viz_config)
+    plotter.create_viz()
+
+    def get_sales(root):
+        return sorted(tuple(source.data['Sales']) for source in root.select(dict(type=ColumnDataSource)))
+    assert get_sales(live.root) == get_sales(plotter.get_output())
+
+    # rows of a new segment add a row of plots, so the viz is created again
+    datasource = Datasource(data[data['Segment'] != 'Corporate'].iloc[:1000].copy())
+    live = LiveViz(datasource, viz_config)
+    datasource.append_rows(data[data['Segment'] == 'Corporate'].iloc[:10])
+    assert live.update()
+    assert len(live.plotter.plots) == 3 and all(plot in live.root.references() for plot in live.plotter.plots)
+
+
+def test_viz_details_tooltips() -> None:
+    viz_config = VizConfig.from_dict({
+        'columns': [Dimension('Category'), Measure('Sales')],
+        'rows': [Dimension('Segment'), Measure('Quantity')],
+        'color': Dimension('Region')
+    })
+    plotter = Plotter(DATASOURCE, viz_config)
+    plotter.details_url = '/details?viz=test'
+    plotter.create_viz()
+    grid = plotter.get_output()
+
+    # the tooltips only need the point of every glyph, all plots share the code that loads the details
+    sources = list(grid.select(dict(type=ColumnDataSource)))
+    assert all('_point' in source.column_names for source in sources)
+    assert sorted(numpy.concatenate([source.data['_point'] for source in sources])) == \
+        list(range(sum(pi.glyph_count for pi in plotter.data)))
+    hovers = list(grid.select(dict(type=HoverTool)))
+    assert len(hovers) == len(plotter.plots) and all(hover.tooltips is None for hover in hovers)
+    shared = {id(hover.callback.args['details']) for hover in hovers}
+    assert len(shared) == 1 and len(list(grid.select(dict(type=CustomJS)))) == len(hovers) + 1
+
+
 def check_html(viz_config, infos) -> None:
     file_name = get_plot_temp(str(viz_config))
     json_plot = extract_plot_structure(file_name)
@@ -42,24 +227,27 @@ def check_html(viz_config, infos) -> None:
     plots = [ref for ref in references if ref['type'] == 'Plot']
     glyphs = [ref for ref in references if ref['type'] == viz_config.mark_type.value.glyph_name]
     renderers = [ref for ref in references if ref['type'] == 'GlyphRenderer']
-    if not (len(plots) == len(renderers) == len(glyphs) == infos['plot_amount']):
-        import pdb; pdb.set_trace()
+    assert len(plots) == len(renderers) == infos['plot_amount']
+    # the renderers of all plots share one glyph
+    assert len(glyphs) == 1
 
     column_datasources = [ref for ref in references if ref['type'] == 'ColumnDataSource']
     data = [ref['attributes']['data'] for ref in column_datasources]
 
-    # check for colors
-    all_colors: List[str] = sum([d['_color'] for d in data], [])  # type: ignore
+    # check for colors, a single color is set on the glyph instead of sent for every glyph
     if 'colN' in str(viz_config):
-        assert len(set(all_colors)) == 1
+        assert all('_color' not in d for d in data)
+        assert 'value' in glyphs[0]['attributes']['fill_color']
     else:
+        all_colors: List[str] = sum([get_column(d, '_color') for d in data], [])  # type: ignore
         assert len(set(all_colors)) >= 1
 
-    # check for sizes
-    all_sizes: List[int] = sum([d['_size'] for d in data], [])  # type: ignore
+    # check for sizes, a single size is set on the glyph as well
     if 'sizeN' in str(viz_config):
-        assert len(set(all_sizes)) == 1
+        assert all('_size' not in d for d in data)
+        assert 'value' in glyphs[0]['attributes']['size']
     else:
+        all_sizes: List[int] = sum([get_column(d, '_size') for d in data], [])  # type: ignore
         assert len(set(all_sizes)) >= 1
 
     # check for glyph amounts
@@ -68,11 +256,20 @@ def check_html(viz_config, infos) -> None:
         colname = viz_config.x_data.col_name
     except NoSuchAttributeException:
         pass
-    glyph_amounts = [len(d[colname]) for d in data]
+    glyph_amounts = [len(get_column(d, colname)) for d in data]
     # since not all plots will contain all dimension values, the glyph amount can be less than the max amount
     assert max(glyph_amounts) <= infos['glyphs_in_plot_amount']
 
 
+def get_column(data: dict, colname: str) -> list:
+    """ Numeric arrays are serialized in binary form, all other columns as plain lists
+    """
+    column = data[colname]
+    if isinstance(column, dict):
+        return decode_base64_dict(column).tolist()
+    return column
+
+
 def extract_plot_structure(file_name: str) -> dict:
     with open(file_name) as infile:
         soup = BeautifulSoup(infile, 'html.parser')